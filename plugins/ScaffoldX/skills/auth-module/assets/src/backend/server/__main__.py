@@ -3,13 +3,18 @@ from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager, AsyncExitStack
 import argparse
+import os
 import uvicorn
 
-from .db import init_db
+from .db import engine_report
+from .lifecycle import resources, router as lifecycle_router
 from .auth.auth import fastapi_users, auth_backend, router as auth_router
 from .auth.models import User
 from .auth.auth import UserCreate
 from .auth.admin import setup_admin
+# AI_Amend 2026-10-17 以下模块导入时向 resources 登记 start / stop 与预热任务
+from . import mail
+from .auth import points, ratelimit
 
 default = 8007
 
@@ -19,7 +24,12 @@ default = 8007
 async def combined_lifespan(app: FastAPI):
     # Run both lifespans
     async with AsyncExitStack() as stack:
-        init_db()
+        # AI_Amend 2026-10-17 各模块登记的资源（建表、邮件队列、哈希进程池、验证码存储、积分合并、限流）
+        # 按登记顺序启动并执行预热，完成后 /readyz 才返回 200；退出时按相反顺序关闭
+        await resources.start(stack)
+        # AI_Amend 2026-10-17 打印实际生效的数据库引擎 / 连接池配置
+        print(engine_report())
+        print(resources.report())
 
         yield
 
@@ -55,10 +65,15 @@ app.include_router(
 # 自定义认证 / 忘记密码 路由
 app.include_router(auth_router, prefix="/auth", tags=["auth"])
 
+# AI_Amend 2026-10-17 存活 / 就绪检查 /healthz /readyz
+app.include_router(lifecycle_router)
+
 
 
 # SQLAdmin 后台
 setup_admin(app)
+# AI_Amend 2026-10-17 启动时预先生成 OpenAPI schema，首次打开 /docs 不再现算
+resources.add_warmup("openapi", app.openapi)
 # AI_Amend END
 
 
@@ -69,6 +84,19 @@ async def root():
 
 
 
+def workers_arg(value: str) -> int:
+    """--workers / $WEB_CONCURRENCY：'auto'（每个 CPU 核一个）或正整数，其它值由 argparse 报错退出。"""
+    if value == "auto":
+        return os.cpu_count() or 1
+    try:
+        workers = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected 'auto' or a positive integer, got {value!r}")
+    if workers < 1:
+        raise argparse.ArgumentTypeError(f"expected 'auto' or a positive integer, got {value!r}")
+    return workers
+
+
 if __name__ == "__main__":
  
     parser = argparse.ArgumentParser(
@@ -98,6 +126,52 @@ if __name__ == "__main__":
         action="store_true",  # 当存在 --prod 时，该值为 True
         help="Run in production mode.",
     )
+
+    # AI_Amend 2026-10-17 多进程与 uvicorn 性能参数
+    parser.add_argument(
+        "--workers",
+        type=workers_arg,
+        default=os.getenv("WEB_CONCURRENCY", "1"),
+        help="Number of worker processes, or 'auto' for one per CPU core "
+             "[default: $WEB_CONCURRENCY or 1]. Ignored in dev mode (reload). "
+             "Send SIGHUP to the master process to restart workers gracefully.",
+    )
+    parser.add_argument(
+        "--loop",
+        choices=["auto", "asyncio", "uvloop"],
+        default="auto",
+        help="Event loop implementation, uvloop requires the uvloop package [default: auto].",
+    )
+    parser.add_argument(
+        "--http",
+        choices=["auto", "h11", "httptools"],
+        default="auto",
+        help="HTTP protocol implementation, httptools requires the httptools package [default: auto].",
+    )
+    parser.add_argument(
+        "--backlog",
+        type=int,
+        default=2048,
+        help="Maximum number of pending connections in the socket backlog [default: 2048].",
+    )
+    parser.add_argument(
+        "--limit-concurrency",
+        type=int,
+        default=None,
+        help="Respond with 503 once this many connections / tasks are in flight per worker.",
+    )
+    parser.add_argument(
+        "--limit-max-requests",
+        type=int,
+        default=None,
+        help="Recycle a worker after it has served this many requests (use with --workers > 1).",
+    )
+    parser.add_argument(
+        "--timeout-graceful-shutdown",
+        type=int,
+        default=30,
+        help="Seconds to wait for in-flight requests on shutdown / reload [default: 30].",
+    )
     args = parser.parse_args()
 
     if args.prod:
@@ -107,22 +181,41 @@ if __name__ == "__main__":
         env = "dev"
 
     port = args.port
+    workers = args.workers
 
     if env == "dev":
         port += 100
         reload = True
+        workers = 1  # 热重载与多进程互斥
         app_import_string = (
             f"{__package__}.__main__:app"  # <--- 关键修改：传递导入字符串
         )
     elif env == "prod":
         reload = False
-        app_import_string = app
+        # 多进程时每个 worker 需要自行导入 app，只能传导入字符串
+        app_import_string = f"{__package__}.__main__:app" if workers > 1 else app
     else:
         reload = False
         app_import_string = app
 
+    # 各 worker 按进程数平分哈希进程池（auth/hashing.py 读取 WEB_CONCURRENCY）
+    os.environ["WEB_CONCURRENCY"] = str(workers)
+
+    if args.limit_max_requests and workers == 1:
+        print("⚠️ --limit-max-requests 在单进程下会让服务直接退出，建议配合 --workers 使用")
+
     # 使用 uvicorn.run() 来启动服务器
     # 参数对应于命令行选项
     uvicorn.run(
-        app_import_string, host="0.0.0.0", port=port, reload=reload  # 启用热重载
+        app_import_string,
+        host="0.0.0.0",
+        port=port,
+        reload=reload,  # 启用热重载
+        workers=workers,
+        loop=args.loop,
+        http=args.http,
+        backlog=args.backlog,
+        limit_concurrency=args.limit_concurrency,
+        limit_max_requests=args.limit_max_requests,
+        timeout_graceful_shutdown=args.timeout_graceful_shutdown,
     )
@@ -1,10 +1,20 @@
-from fastapi import Request
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional, Tuple
+from uuid import UUID
+
+from fastapi import HTTPException, Request
+from markupsafe import Markup
 from sqladmin import Admin, ModelView
 from sqladmin.authentication import AuthenticationBackend
+from sqladmin.pagination import PageControl, Pagination
+from sqlalchemy import func, select, text, tuple_
 from sqlmodel import Session
+from starlette.datastructures import URL
 
 from .models import Order
 from ..db import engine
+from ..lifecycle import resources
 
 
 class AdminAuth(AuthenticationBackend):
@@ -32,6 +42,80 @@ class AdminAuth(AuthenticationBackend):
         return request.session.get("admin") is True
 
 
+# AI_Amend 2026-10-17 订单列表改为 keyset（seek）分页：按 (created_at, id) 游标翻页，
+# 配合 Order 上的复合索引，每页都是一次索引范围扫描，与翻到第几页无关
+@dataclass
+class KeysetPagination(Pagination):
+    """
+    游标分页结果。page 只用于界面显示页码，实际定位依赖 after / before 游标；
+    count 在大表上是估算值（见 OrderAdmin.count_limit）。
+    """
+
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+
+    def __post_init__(self) -> None:
+        # 不按 count 修正页码：count 是估算值，页码仅用于显示
+        if self.page_size < 1:
+            raise ValueError("page_size must be greater than 0")
+
+    @property
+    def has_previous(self) -> bool:
+        return self.prev_cursor is not None
+
+    @property
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+    @property
+    def previous_page(self) -> PageControl:
+        return self._control(self.page - 1)
+
+    @property
+    def next_page(self) -> PageControl:
+        return self._control(self.page + 1)
+
+    def _control(self, number: int) -> PageControl:
+        for page_control in self.page_controls:
+            if page_control.number == number:
+                return page_control
+        raise RuntimeError(f"Page {number} not found.")
+
+    def resize(self, page_size: int) -> Pagination:
+        # 切换每页条数时保持当前游标，不重新计算页码
+        return self
+
+    def add_pagination_urls(self, base_url: URL) -> None:
+        base_url = base_url.remove_query_params(["after", "before"])
+        if self.prev_cursor is not None:
+            url = base_url.include_query_params(page=max(self.page - 1, 1), before=self.prev_cursor)
+            self.page_controls.append(PageControl(number=self.page - 1, url=str(url)))
+        self.page_controls.append(PageControl(number=self.page, url=str(base_url.include_query_params(page=self.page))))
+        if self.next_cursor is not None:
+            url = base_url.include_query_params(page=self.page + 1, after=self.next_cursor)
+            self.page_controls.append(PageControl(number=self.page + 1, url=str(url)))
+
+
+def encode_cursor(created_at: datetime, id_: int, descending: bool) -> str:
+    # 游标带上排序方向：SQLAdmin 的排序切换链接会原样保留 after / before，方向不一致的游标要能认出来
+    return f"{'d' if descending else 'a'}~{created_at.isoformat()}~{id_}"
+
+
+def decode_cursor(cursor: str) -> Tuple[bool, datetime, int]:
+    try:
+        direction, created_at, id_ = cursor.split("~", 2)
+        if direction not in ("a", "d"):
+            raise ValueError(direction)
+        return direction == "d", datetime.fromisoformat(created_at), int(id_)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+
+
+def _user_link(model, attribute) -> Markup:
+    # 点击用户 ID 只看该用户的订单（走 (user_id, created_at, id) 索引）
+    return Markup('<a href="?user_id={0}">{0}</a>').format(model.user_id)
+
+
 class OrderAdmin(ModelView, model=Order):
     column_list = [
         Order.id,
@@ -42,6 +126,112 @@ class OrderAdmin(ModelView, model=Order):
     ]
     column_searchable_list = [Order.status]
     column_sortable_list = [Order.created_at]
+    column_default_sort = [(Order.created_at, True)]
+    column_formatters = {Order.user_id: _user_link}
+
+    # 超过该行数时不再精确 COUNT，界面显示为估算值
+    count_limit = 10000
+
+    def _keyset_filters(self, request: Request) -> list:
+        conditions = []
+        user_id = request.query_params.get("user_id")
+        if user_id:
+            try:
+                conditions.append(Order.user_id == UUID(user_id))
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Invalid user_id")
+        return conditions
+
+    async def count(self, request: Request, stmt=None) -> int:
+        """
+        有上限的计数：COUNT 只扫描前 count_limit + 1 行；超过上限时，
+        PostgreSQL 上无过滤条件则取 pg_class.reltuples 估算，其它情况直接显示上限。
+        """
+        if stmt is not None:
+            return await super().count(request, stmt)
+        base = select(Order.id).where(*self._keyset_filters(request))
+        search = request.query_params.get("search")
+        if search:
+            base = self.search_query(stmt=base, term=search)
+        capped = base.limit(self.count_limit + 1).subquery()
+        rows = await self._run_arbitrary_query(select(func.count()).select_from(capped))
+        count = rows[0][0]
+        if count <= self.count_limit:
+            return count
+        if engine.dialect.name == "postgresql" and not search and not request.query_params.get("user_id"):
+            rows = await self._run_arbitrary_query(
+                text("SELECT reltuples::bigint FROM pg_class WHERE relname = :name").bindparams(
+                    name=Order.__tablename__
+                )
+            )
+            if rows and rows[0][0] > count:
+                return rows[0][0]
+        return count
+
+    async def list(self, request: Request) -> Pagination:
+        sort_by = request.query_params.get("sortBy")
+        if sort_by not in (None, "created_at"):
+            return await super().list(request)
+
+        page = self.validate_page_number(request.query_params.get("page"), 1)
+        page_size = self.validate_page_number(request.query_params.get("pageSize"), self.page_size)
+        page_size = min(page_size, max(self.page_size_options))
+        descending = request.query_params.get("sort", "desc" if sort_by is None else "asc") == "desc"
+        after = request.query_params.get("after")
+        before = request.query_params.get("before")
+        raw_cursor = after if after is not None else before
+        cursor = decode_cursor(raw_cursor) if raw_cursor is not None else None
+        if cursor is not None and cursor[0] != descending:
+            # 从另一种排序方向翻页时带过来的游标（点击了表头排序链接）：回到第一页
+            after = before = cursor = None
+            page = 1
+
+        key = tuple_(Order.created_at, Order.id)
+        stmt = select(Order).where(*self._keyset_filters(request))
+        search = request.query_params.get("search")
+        if search:
+            stmt = self.search_query(stmt=stmt, term=search)
+
+        # 向前翻页（before）时反向扫描再把结果倒过来
+        backwards = before is not None and after is None
+        if after is not None:
+            position = tuple_(*cursor[1:])
+            stmt = stmt.where(key < position if descending else key > position)
+        elif before is not None:
+            position = tuple_(*cursor[1:])
+            stmt = stmt.where(key > position if descending else key < position)
+
+        scan_descending = descending != backwards
+        if scan_descending:
+            stmt = stmt.order_by(Order.created_at.desc(), Order.id.desc())
+        else:
+            stmt = stmt.order_by(Order.created_at.asc(), Order.id.asc())
+
+        # 多取一行判断是否还有下一页，省去额外的查询
+        rows = list(await self._run_query(stmt.limit(page_size + 1)))
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if backwards:
+            rows.reverse()
+
+        next_cursor = prev_cursor = None
+        if rows:
+            first, last = rows[0], rows[-1]
+            if backwards:
+                next_cursor = encode_cursor(last.created_at, last.id, descending)
+                prev_cursor = encode_cursor(first.created_at, first.id, descending) if has_more else None
+            else:
+                next_cursor = encode_cursor(last.created_at, last.id, descending) if has_more else None
+                prev_cursor = encode_cursor(first.created_at, first.id, descending) if after is not None else None
+
+        return KeysetPagination(
+            rows=rows,
+            page=page,
+            page_size=page_size,
+            count=await self.count(request),
+            next_cursor=next_cursor,
+            prev_cursor=prev_cursor,
+        )
 
 
 
@@ -49,5 +239,10 @@ class OrderAdmin(ModelView, model=Order):
 def setup_admin(app):
     admin = Admin(app, engine, authentication_backend=AdminAuth())
     admin.add_view(OrderAdmin)
+    # AI_Amend 2026-10-17 启动时预先编译后台模板，首次打开后台不再卡顿
+    resources.add_warmup("admin_templates", lambda: [
+        admin.templates.env.get_template(f"sqladmin/{name}.html")
+        for name in ("login", "index", "list", "details", "create", "edit")
+    ])
 
 
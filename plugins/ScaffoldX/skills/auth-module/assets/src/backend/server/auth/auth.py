@@ -1,21 +1,26 @@
 # AI_Amend 2026-01-27 邮箱注册增加验证码发送与校验
+import os
 import random
-from datetime import datetime, timedelta
 from typing import Optional
-from uuid import UUID
+from uuid import UUID, uuid4
 
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi_users import BaseUserManager, FastAPIUsers
-from fastapi_users.password import PasswordHelper
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi_users import BaseUserManager, FastAPIUsers, exceptions
 from fastapi_users.authentication import CookieTransport, AuthenticationBackend
-from fastapi_users.authentication.strategy import JWTStrategy
-from fastapi_users_db_sqlmodel import SQLModelUserDatabase
+from fastapi_users_db_sqlmodel import SQLModelUserDatabaseAsync
 from fastapi_users.schemas import BaseUserCreate
 from pydantic import BaseModel
-from sqlmodel import Session, select
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from .models import User, PasswordResetCode
-from ..db import get_session
+from .codes import code_store, PURPOSE_PHONE, PURPOSE_REGISTER, PURPOSE_RESET
+from .hashing import password_hasher
+from .models import User
+from .ratelimit import limit_code_request
+from .token_cache import CachedJWTStrategy, TokenCache
+from ..db import async_session_maker, get_async_session
+from ..lifecycle import resources
+from ..mail import mail_queue
 
 
 
@@ -30,9 +35,6 @@ class LoginRequest(BaseModel):
     password: Optional[str] = None
 
 
-password_helper = PasswordHelper()
-
-
 class UserManager(BaseUserManager[User, UUID]):
     reset_password_token_secret = SECRET
     verification_token_secret = SECRET
@@ -45,35 +47,55 @@ class UserManager(BaseUserManager[User, UUID]):
     # AI_Amend 2026-01-27 避免启动期 NameError，使用 BaseUserCreate 并在运行期校验 code
     async def create(self, user_create: BaseUserCreate, safe: bool = False, request=None):
         # AI_Amend 2026-01-27 注册前校验邮箱验证码
-        session: Session = getattr(self, "_session", None)
-        if not session:
-            raise HTTPException(500, "session not injected")
-
-        record = session.exec(
-            select(PasswordResetCode)
-            .where(PasswordResetCode.user_id == None)
-            .where(PasswordResetCode.code == user_create.code)
-            .where(PasswordResetCode.used == False)
-            .order_by(PasswordResetCode.id.desc())
-        ).first()
-
-        if not record or record.expires_at < datetime.utcnow():
+        # AI_Amend 2026-10-17 改为通过 code_store 消费注册验证码（按邮箱）
+        if not await code_store.consume(PURPOSE_REGISTER, user_create.email, user_create.code):
             raise HTTPException(400, "invalid or expired email code")
 
-        record.used = True
-        session.add(record)
-        session.commit()
-
-        return await super().create(user_create, safe=safe, request=request)
+        # AI_Amend 2026-10-17 与 BaseUserManager.create 一致，但哈希交给进程池
+        await self.validate_password(user_create.password, user_create)
+        if await self.user_db.get_by_email(user_create.email) is not None:
+            raise exceptions.UserAlreadyExists()
+
+        user_dict = (
+            user_create.create_update_dict()
+            if safe
+            else user_create.create_update_dict_superuser()
+        )
+        user_dict.pop("code", None)
+        password = user_dict.pop("password")
+        user_dict["hashed_password"] = await password_hasher.hash(password)
+        created_user = await self.user_db.create(user_dict)
+        await self.on_after_register(created_user, request)
+        return created_user
 
     # AI_Amend 2026-01-27 删除重复 create(UserCreate) 实现，避免 NameError
 
+    # AI_Amend 2026-10-17 登录校验走进程池，避免 bcrypt 阻塞事件循环
+    async def authenticate(self, credentials):
+        try:
+            user = await self.get_by_email(credentials.username)
+        except exceptions.UserNotExists:
+            # 与 fastapi-users 一致：用户不存在时也跑一次哈希，抵御计时攻击
+            await password_hasher.hash(credentials.password)
+            return None
+
+        verified, updated_password_hash = await password_hasher.verify_and_update(
+            credentials.password, user.hashed_password
+        )
+        if not verified:
+            return None
+        if updated_password_hash is not None:
+            await self.user_db.update(user, {"hashed_password": updated_password_hash})
+        return user
+
     async def on_after_register(self, user: User, request=None):
         # 确保密码是合法 hash（防止历史脏数据）
         try:
-            password_helper.verify_and_update(user.hashed_password, user.hashed_password)
+            await password_hasher.verify_and_update(user.hashed_password, user.hashed_password)
+        except HTTPException:
+            raise
         except Exception:
-            user.hashed_password = password_helper.hash(user.hashed_password)
+            user.hashed_password = await password_hasher.hash(user.hashed_password)
 
 
 # AI_Amend 2026-01-27 邮箱注册增加验证码字段
@@ -81,15 +103,24 @@ class UserCreate(BaseUserCreate):
     code: str
 
 
-def get_user_db(session: Session = Depends(get_session)):
-    yield SQLModelUserDatabase(session, User)
+# AI_Amend 2026-10-17 改用异步 SQLModelUserDatabase
+async def get_user_db(session: AsyncSession = Depends(get_async_session)):
+    yield SQLModelUserDatabaseAsync(session, User)
+
+
+async def get_user_manager(user_db=Depends(get_user_db)):
+    yield UserManager(user_db)
+
 
+# AI_Amend 2026-10-17 启动时跑一遍登录 / 鉴权路径上的查询，预先填充 SQLAlchemy 语句编译缓存
+async def _warm_user_queries() -> None:
+    async with async_session_maker() as session:
+        user_db = SQLModelUserDatabaseAsync(session, User)
+        await user_db.get_by_email("warmup@localhost")
+        await user_db.get(uuid4())
 
-def get_user_manager(user_db=Depends(get_user_db), session: Session = Depends(get_session)):
-    # AI_Amend 2026-01-27 注入 session 用于注册验证码校验
-    manager = UserManager(user_db)
-    manager._session = session
-    yield manager
+
+resources.add_warmup("user_queries", _warm_user_queries)
 
 
 from fastapi_users.authentication import BearerTransport
@@ -99,9 +130,23 @@ from fastapi_users.authentication import BearerTransport
 bearer_transport = BearerTransport(tokenUrl="/auth/login")
 
 # ⚠️ 关键：必须提供 strategy
+# AI_Amend 2026-10-17 strategy 全局复用一个实例，并缓存 token -> User 快照
+JWT_LIFETIME_SECONDS = 3600
+token_cache = TokenCache(
+    maxsize=int(os.getenv("JWT_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("JWT_CACHE_TTL", "60")),
+    not_before_ttl=JWT_LIFETIME_SECONDS,
+)
+jwt_strategy = CachedJWTStrategy(
+    secret=SECRET,
+    lifetime_seconds=JWT_LIFETIME_SECONDS,
+    cache=token_cache,
+    trust_claims=os.getenv("JWT_TRUST_CLAIMS", "0") == "1",
+)
+
 
 def get_strategy():
-    return JWTStrategy(secret=SECRET, lifetime_seconds=3600)
+    return jwt_strategy
 
 
 # AI_Amend 2026-01-28 使用 Bearer Token 后端
@@ -181,32 +226,20 @@ class EmailRegisterWithCode(BaseModel):
     - 注册成功后需通过 `/auth/login` 获取 JWT Token
     """,
 )
-def register_with_code(data: EmailRegisterWithCode, session: Session = Depends(get_session)):
-    from .models import EmailRegisterCode
-
-    # 1. 校验验证码
-    rec = session.exec(
-        select(EmailRegisterCode)
-        .where(EmailRegisterCode.email == data.email)
-        .where(EmailRegisterCode.code == data.code)
-        .where(EmailRegisterCode.used == False)
-        .order_by(EmailRegisterCode.id.desc())
-    ).first()
-
-    if not rec or rec.expires_at < datetime.utcnow():
-        raise HTTPException(400, "invalid or expired email code")
-
-    # 2. 创建用户（强制唯一邮箱）
-    if session.exec(select(User).where(User.email == data.email)).first():
+async def register_with_code(data: EmailRegisterWithCode, session: AsyncSession = Depends(get_async_session)):
+    # 1. 强制唯一邮箱
+    if (await session.exec(select(User).where(User.email == data.email))).first():
         raise HTTPException(400, "email already registered")
 
-    user = User(email=data.email, hashed_password=password_helper.hash(data.password))
-    session.add(user)
+    # 2. 校验并消费验证码
+    if not await code_store.consume(PURPOSE_REGISTER, data.email, data.code):
+        raise HTTPException(400, "invalid or expired email code")
 
-    # 3. 标记验证码已使用
-    rec.used = True
-    session.add(rec)
-    session.commit()
+    # 3. 创建用户
+    hashed_password = await password_hasher.hash(data.password)
+    user = User(email=data.email, hashed_password=hashed_password)
+    session.add(user)
+    await session.commit()
 
     return {"ok": True}
 
@@ -228,39 +261,29 @@ class EmailRegisterCodeRequest(BaseModel):
     - 验证码 5 分钟有效
     """,
 )
-def send_register_email_code(data: EmailRegisterCodeRequest, session: Session = Depends(get_session)):
-    import smtplib
-    from email.mime.text import MIMEText
-    from email.mime.multipart import MIMEMultipart
-    from .models import EmailRegisterCode
+async def send_register_email_code(
+    data: EmailRegisterCodeRequest,
+    request: Request,
+    session: AsyncSession = Depends(get_async_session),
+):
+    # AI_Amend 2026-10-17 先限流（按 IP / 邮箱），超限直接 429，不再查库和发信
+    await limit_code_request(request, "register_code", "email", data.email)
 
     # 已存在用户不再发送
-    if session.exec(select(User).where(User.email == data.email)).first():
+    if (await session.exec(select(User).where(User.email == data.email))).first():
         raise HTTPException(400, "email already registered")
 
+    # AI_Amend 2026-10-17 与忘记密码一致：未配置发信时直接报错，不签发收不到的验证码
+    if not mail_queue.backend.configured:
+        raise HTTPException(500, "SMTP not configured")
+
     code = f"{random.randint(0, 999999):06d}"
-    rec = EmailRegisterCode(
-        email=data.email,
-        code=code,
-        expires_at=datetime.utcnow() + timedelta(minutes=5),
-    )
-    session.add(rec)
-    session.commit()
-    import os
-
-    sender = os.getenv("sender")
-    password = os.getenv("SMTP")
-
-    msg = MIMEMultipart()
-    msg["From"] = sender
-    msg["To"] = data.email
-    msg["Subject"] = "PostPin注册"
-    body = f"您的验证码是：{code}，5 分钟内有效，请勿泄露给他人。"
-    msg.attach(MIMEText(body, "plain", "utf-8"))
+    await code_store.issue(PURPOSE_REGISTER, data.email, code, ttl_seconds=5 * 60)
 
-    with smtplib.SMTP_SSL("smtp.qq.com", 465) as server:
-        server.login(sender, password)
-        server.send_message(msg)
+    # AI_Amend 2026-10-17 邮件改为入队，由后台 MailQueue 发送
+    body = f"您的验证码是：{code}，5 分钟内有效，请勿泄露给他人。"
+    if not mail_queue.enqueue(data.email, "PostPin注册", body):
+        raise HTTPException(503, "mail queue is full, please retry later")
 
     return {"ok": True}
 
@@ -288,45 +311,30 @@ class PasswordResetConfirm(BaseModel):
     - 验证码 10 分钟内有效
     """,
 )
-def request_password_reset(
+async def request_password_reset(
     data: PasswordResetRequest,
-    session: Session = Depends(get_session),
+    request: Request,
+    session: AsyncSession = Depends(get_async_session),
 ):
-    user = session.exec(select(User).where(User.email == data.email)).first()
+    # AI_Amend 2026-10-17 先限流（按 IP / 邮箱）
+    await limit_code_request(request, "password_forgot", "email", data.email)
+
+    user = (await session.exec(select(User).where(User.email == data.email))).first()
     if not user:
         # AI_Amend 2026-02-03 改进用户体验：明确提示邮箱未注册
         raise HTTPException(400, "邮箱没有注册,请注册")
 
+    if not mail_queue.backend.configured:
+        raise HTTPException(500, "SMTP not configured")
+
     code = f"{random.randint(0, 999999):06d}"
-    reset = PasswordResetCode(
-        user_id=user.id,
-        code=code,
-        expires_at=datetime.utcnow() + timedelta(minutes=10),
-    )
-    session.add(reset)
-    session.commit()
+    await code_store.issue(PURPOSE_RESET, str(user.id), code, ttl_seconds=10 * 60)
 
     # AI_Amend 2026-01-27 忘记密码验证码通过邮箱发送（修复未发送问题）
-    import smtplib
-    from email.mime.text import MIMEText
-    from email.mime.multipart import MIMEMultipart
-    import os
-
-    sender = os.getenv("sender")
-    password = os.getenv("SMTP")
-    if not sender or not password:
-        raise HTTPException(500, "SMTP not configured")
-
-    msg = MIMEMultipart()
-    msg["From"] = sender
-    msg["To"] = user.email
-    msg["Subject"] = "PostPin重置密码"
+    # AI_Amend 2026-10-17 邮件改为入队，由后台 MailQueue 发送
     body = f"您的重置密码验证码是：{code}\n10 分钟内有效，请勿泄露给他人。"
-    msg.attach(MIMEText(body, "plain", "utf-8"))
-
-    with smtplib.SMTP_SSL("smtp.qq.com", 465) as server:
-        server.login(sender, password)
-        server.send_message(msg)
+    if not mail_queue.enqueue(user.email, "PostPin重置密码", body):
+        raise HTTPException(503, "mail queue is full, please retry later")
 
     return {"ok": True}
 
@@ -342,30 +350,21 @@ def request_password_reset(
     - 需重新登录获取 JWT Token
     """,
 )
-def confirm_password_reset(
+async def confirm_password_reset(
     data: PasswordResetConfirm,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_async_session),
 ):
-    user = session.exec(select(User).where(User.email == data.email)).first()
+    user = (await session.exec(select(User).where(User.email == data.email))).first()
     if not user:
         raise HTTPException(400, "invalid")
 
-    reset = session.exec(
-        select(PasswordResetCode)
-        .where(PasswordResetCode.user_id == user.id)
-        .where(PasswordResetCode.code == data.code)
-        .where(PasswordResetCode.used == False)
-        .order_by(PasswordResetCode.id.desc())
-    ).first()
-
-    if not reset or reset.expires_at < datetime.utcnow():
+    if not await code_store.consume(PURPOSE_RESET, str(user.id), data.code):
         raise HTTPException(400, "invalid or expired code")
 
-    user.hashed_password = password_helper.hash(data.new_password)
-    reset.used = True
+    user.hashed_password = await password_hasher.hash(data.new_password)
     session.add(user)
-    session.add(reset)
-    session.commit()
+    await session.commit()
+    token_cache.invalidate_user(user.id)
 
     return {"ok": True}
 
@@ -383,44 +382,24 @@ class PhoneCodeLogin(BaseModel):
 
 
 @router.post("/phone/code")
-def send_phone_code(data: PhoneCodeRequest, session: Session = Depends(get_session)):
-    from .models import PhoneLoginCode
-
+async def send_phone_code(data: PhoneCodeRequest, request: Request):
+    # AI_Amend 2026-10-17 先限流（按 IP / 手机号）
+    await limit_code_request(request, "phone_code", "phone", data.phone)
     code = f"{random.randint(0, 999999):06d}"
-    rec = PhoneLoginCode(
-        phone=data.phone,
-        code=code,
-        expires_at=datetime.utcnow() + timedelta(minutes=5),
-    )
-    session.add(rec)
-    session.commit()
+    await code_store.issue(PURPOSE_PHONE, data.phone, code, ttl_seconds=5 * 60)
     print(f"[PHONE CODE] {data.phone}: {code}")
     return {"ok": True}
 
 
 @router.post("/phone/login")
-def phone_login(data: PhoneCodeLogin, session: Session = Depends(get_session)):
-    from .models import PhoneLoginCode
-
-    rec = session.exec(
-        select(PhoneLoginCode)
-        .where(PhoneLoginCode.phone == data.phone)
-        .where(PhoneLoginCode.code == data.code)
-        .where(PhoneLoginCode.used == False)
-        .order_by(PhoneLoginCode.id.desc())
-    ).first()
-
-    if not rec or rec.expires_at < datetime.utcnow():
+async def phone_login(data: PhoneCodeLogin, session: AsyncSession = Depends(get_async_session)):
+    if not await code_store.consume(PURPOSE_PHONE, data.phone, data.code):
         raise HTTPException(400, "invalid or expired code")
 
-    user = session.exec(select(User).where(User.phone == data.phone)).first()
+    user = (await session.exec(select(User).where(User.phone == data.phone))).first()
     if not user:
         user = User(phone=data.phone, hashed_password="")
         session.add(user)
-
-    rec.used = True
-    session.add(rec)
-    session.commit()
+        await session.commit()
 
     return {"ok": True}
-
@@ -0,0 +1,267 @@
+# AI_Amend 2026-10-17 统一验证码存储：注册 / 重置密码 / 手机登录共用一套 issue / verify / consume
+import asyncio
+import heapq
+import hmac
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from uuid import UUID
+
+from sqlalchemy import delete, or_, update
+from sqlmodel import select
+
+from .models import EmailRegisterCode, PasswordResetCode, PhoneLoginCode
+from ..db import async_engine, async_session_maker
+from ..lifecycle import resources
+
+PURPOSE_REGISTER = "register"  # subject = email
+PURPOSE_RESET = "reset"  # subject = str(user.id)
+PURPOSE_PHONE = "phone"  # subject = phone
+
+
+def _codes_equal(expected: str, code: str) -> bool:
+    # compare_digest 对含非 ASCII 字符的 str 抛 TypeError（如全角数字），按 UTF-8 字节比较
+    return hmac.compare_digest(expected.encode("utf-8"), code.encode("utf-8"))
+
+
+class VerificationCodeStore:
+    """
+    验证码存储接口。
+
+    以 (purpose, subject) 为键，同一键重新签发会覆盖旧验证码（SQL 后端除外，旧码仍在有效期内可用）。
+    """
+
+    async def issue(self, purpose: str, subject: str, code: str, ttl_seconds: int) -> None:
+        raise NotImplementedError
+
+    async def verify(self, purpose: str, subject: str, code: str) -> bool:
+        raise NotImplementedError
+
+    async def consume(self, purpose: str, subject: str, code: str) -> bool:
+        """校验成功则立即作废该验证码，返回是否成功。"""
+        raise NotImplementedError
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+
+class MemoryCodeStore(VerificationCodeStore):
+    """
+    进程内 TTL 字典，O(1) 读写，适合单进程部署。
+
+    过期键由最小堆按到期时间惰性清理，后台任务定期触发一次清理。
+    """
+
+    def __init__(self, sweep_interval: float = 60.0):
+        self.sweep_interval = sweep_interval
+        self._codes: Dict[str, Tuple[str, float]] = {}
+        self._expiry_heap: List[Tuple[float, str]] = []
+        self._sweeper: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _key(purpose, subject):
+        return f"{purpose}:{subject}"
+
+    def _match(self, key, code, now) -> bool:
+        entry = self._codes.get(key)
+        return entry is not None and entry[1] > now and _codes_equal(entry[0], code)
+
+    async def issue(self, purpose, subject, code, ttl_seconds):
+        key = self._key(purpose, subject)
+        expires_at = time.monotonic() + ttl_seconds
+        self._codes[key] = (code, expires_at)
+        heapq.heappush(self._expiry_heap, (expires_at, key))
+
+    async def verify(self, purpose, subject, code):
+        return self._match(self._key(purpose, subject), code, time.monotonic())
+
+    async def consume(self, purpose, subject, code):
+        # 单线程事件循环内 get + pop 之间没有 await，天然原子
+        key = self._key(purpose, subject)
+        if not self._match(key, code, time.monotonic()):
+            return False
+        del self._codes[key]
+        return True
+
+    def sweep(self) -> int:
+        now = time.monotonic()
+        removed = 0
+        while self._expiry_heap and self._expiry_heap[0][0] <= now:
+            expires_at, key = heapq.heappop(self._expiry_heap)
+            entry = self._codes.get(key)
+            # 键可能已被重新签发，只删除到期时间一致的那一条
+            if entry is not None and entry[1] == expires_at:
+                del self._codes[key]
+                removed += 1
+        return removed
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            self.sweep()
+
+    async def start(self):
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+
+
+# 比对与删除在 Redis 内一次完成，避免并发请求重复消费
+_CONSUME_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class RedisCodeStore(VerificationCodeStore):
+    """
+    基于 Redis 协议的存储（SET EX 原生过期），多进程 / 多实例共享。
+
+    client 为 redis.asyncio.Redis（decode_responses=True），本地可用 fakeredis 等替身测试。
+    """
+
+    def __init__(self, client, prefix: str = "vcode:"):
+        self.client = client
+        self.prefix = prefix
+
+    def _key(self, purpose, subject):
+        return f"{self.prefix}{purpose}:{subject}"
+
+    async def issue(self, purpose, subject, code, ttl_seconds):
+        await self.client.set(self._key(purpose, subject), code, ex=ttl_seconds)
+
+    async def verify(self, purpose, subject, code):
+        value = await self.client.get(self._key(purpose, subject))
+        return value is not None and _codes_equal(value, code)
+
+    async def consume(self, purpose, subject, code):
+        return bool(await self.client.eval(_CONSUME_SCRIPT, 1, self._key(purpose, subject), code))
+
+    async def stop(self):
+        await self.client.aclose()
+
+
+# purpose -> (表, subject 列名)
+_SQL_TABLES = {
+    PURPOSE_REGISTER: (EmailRegisterCode, "email"),
+    PURPOSE_RESET: (PasswordResetCode, "user_id"),
+    PURPOSE_PHONE: (PhoneLoginCode, "phone"),
+}
+
+
+class SQLCodeStore(VerificationCodeStore):
+    """
+    SQL 兜底实现，沿用原有三张验证码表。
+
+    查询命中 (subject, code, used) 复合索引；后台任务定期删除已使用和已过期的记录，避免表无限增长。
+    """
+
+    def __init__(self, purge_interval: float = 600.0):
+        self.purge_interval = purge_interval
+        self._purger: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _table(purpose, subject):
+        model, column = _SQL_TABLES[purpose]
+        value = UUID(subject) if column == "user_id" else subject
+        return model, getattr(model, column), column, value
+
+    async def issue(self, purpose, subject, code, ttl_seconds):
+        model, _, column, value = self._table(purpose, subject)
+        rec = model(**{column: value}, code=code,
+                    expires_at=datetime.utcnow() + timedelta(seconds=ttl_seconds))
+        async with async_session_maker() as session:
+            session.add(rec)
+            await session.commit()
+
+    def _active(self, purpose, subject, code):
+        model, subject_col, _, value = self._table(purpose, subject)
+        return model, (
+            subject_col == value,
+            model.code == code,
+            model.used == False,
+            model.expires_at > datetime.utcnow(),
+        )
+
+    async def verify(self, purpose, subject, code):
+        model, conditions = self._active(purpose, subject, code)
+        async with async_session_maker() as session:
+            return (await session.exec(select(model.id).where(*conditions).limit(1))).first() is not None
+
+    async def consume(self, purpose, subject, code):
+        # AI_Amend 2026-10-17 校验与作废合并为一条条件 UPDATE ... RETURNING，
+        # 并发请求中只有一个能命中 used=false 的行，也省去 SELECT 往返
+        model, conditions = self._active(purpose, subject, code)
+        stmt = (
+            update(model)
+            .where(*conditions)
+            .values(used=True)
+            .execution_options(synchronize_session=False)
+        )
+        async with async_session_maker() as session:
+            if async_engine.dialect.update_returning:
+                result = await session.execute(stmt.returning(model.id))
+                consumed = result.first() is not None
+            else:
+                # MySQL 等不支持 UPDATE ... RETURNING，退回到受影响行数
+                result = await session.execute(stmt)
+                consumed = result.rowcount > 0
+            await session.commit()
+        return consumed
+
+    async def purge(self) -> int:
+        now = datetime.utcnow()
+        removed = 0
+        async with async_session_maker() as session:
+            for model, _ in _SQL_TABLES.values():
+                result = await session.execute(
+                    delete(model).where(or_(model.used == True, model.expires_at < now))
+                )
+                removed += result.rowcount or 0
+            await session.commit()
+        return removed
+
+    async def _purge_loop(self):
+        while True:
+            await asyncio.sleep(self.purge_interval)
+            try:
+                await self.purge()
+            except Exception as e:
+                print(f"[CODE STORE] purge failed: {e}")
+
+    async def start(self):
+        if self._purger is None:
+            self._purger = asyncio.create_task(self._purge_loop())
+
+    async def stop(self):
+        if self._purger is not None:
+            self._purger.cancel()
+            self._purger = None
+
+
+def create_code_store() -> VerificationCodeStore:
+    """根据环境变量 CODE_STORE (sql | memory | redis) 创建验证码存储。"""
+    kind = os.getenv("CODE_STORE", "sql")
+    if kind == "memory":
+        return MemoryCodeStore()
+    if kind == "redis":
+        import redis.asyncio as redis
+
+        client = redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"), decode_responses=True)
+        return RedisCodeStore(client)
+    return SQLCodeStore(purge_interval=float(os.getenv("CODE_PURGE_INTERVAL", "600")))
+
+
+code_store = create_code_store()
+# AI_Amend 2026-10-17 过期清理任务 / Redis 连接
+resources.register("code_store", code_store.start, code_store.stop)
@@ -0,0 +1,141 @@
+# AI_Amend 2026-10-17 密码哈希放入独立进程池，避免占用事件循环与共享线程池
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Tuple
+
+from fastapi import HTTPException
+from fastapi_users.password import PasswordHelper
+
+from ..lifecycle import resources
+
+# 子进程内各自持有一个 PasswordHelper（passlib CryptContext 初始化有成本，只做一次）
+_worker_helper: Optional[PasswordHelper] = None
+
+
+def _get_worker_helper() -> PasswordHelper:
+    global _worker_helper
+    if _worker_helper is None:
+        _worker_helper = PasswordHelper()
+    return _worker_helper
+
+
+def _hash(password: str) -> str:
+    return _get_worker_helper().hash(password)
+
+
+def _verify_and_update(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    return _get_worker_helper().verify_and_update(plain_password, hashed_password)
+
+
+def default_workers() -> int:
+    """每个 web worker 各自持有一个进程池：按 WEB_CONCURRENCY 平分 CPU 核数，避免 N 个 worker 各开满核数的子进程。"""
+    cpu = os.cpu_count() or 1
+    web = os.getenv("WEB_CONCURRENCY", "1")
+    if web == "auto":
+        return 1
+    try:
+        web_workers = max(1, int(web or "1"))
+    except ValueError:
+        # import 时执行：写错的环境变量不能让整个应用起不来
+        print(f"[HASH] invalid WEB_CONCURRENCY={web!r}, assuming 1 web worker")
+        web_workers = 1
+    return max(1, cpu // web_workers)
+
+
+class AsyncPasswordHelper:
+    """
+    PasswordHelper 的异步包装。
+
+    hash / verify_and_update 提交到专用的 ProcessPoolExecutor，多核并行且与 API 其余部分隔离。
+    同时在途任务数超过 max_pending 时直接返回 503（准入控制），避免登录风暴把队列无限拉长。
+    """
+
+    def __init__(self, workers: Optional[int] = None, max_pending: Optional[int] = None):
+        self.workers = workers or default_workers()
+        self.max_pending = max_pending or self.workers * 16
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._helper = PasswordHelper()
+        self.pending = 0
+        self.peak_pending = 0
+        self.completed = 0  # 只统计成功的任务
+        self.failed = 0
+        self.rejected = 0
+
+    @property
+    def queue_depth(self) -> int:
+        """已提交但还没有进程在处理的任务数。"""
+        return max(0, self.pending - self.workers)
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    async def _submit(self, fn, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(503, "password hashing overloaded", headers={"Retry-After": "1"})
+        self.pending += 1
+        self.peak_pending = max(self.peak_pending, self.pending)
+        try:
+            loop = asyncio.get_running_loop()
+            executor = self._get_executor()
+            try:
+                result = await loop.run_in_executor(executor, fn, *args)
+            except BrokenProcessPool:
+                # 子进程被 OOM killer 等杀掉后整个池不可用：换一个新池重试一次，而不是之后每个请求都失败
+                self._reset_executor(executor)
+                result = await loop.run_in_executor(self._get_executor(), fn, *args)
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.pending -= 1
+        self.completed += 1
+        return result
+
+    def _reset_executor(self, broken: ProcessPoolExecutor) -> None:
+        if self._executor is broken:  # 并发失败的请求只重建一次
+            self._executor = None
+            broken.shutdown(wait=False, cancel_futures=True)
+            print("[HASH] process pool broken, recreated")
+
+    async def hash(self, password: str) -> str:
+        return await self._submit(_hash, password)
+
+    async def verify_and_update(self, plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        return await self._submit(_verify_and_update, plain_password, hashed_password)
+
+    def generate(self) -> str:
+        return self._helper.generate()
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "pending": self.pending,
+            "queue_depth": self.queue_depth,
+            "peak_pending": self.peak_pending,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
+
+    async def warmup(self) -> None:
+        """每个子进程各做一次哈希：进程池拉起所有 worker，并完成 bcrypt / CryptContext 的首次初始化。"""
+        await asyncio.gather(*(self.hash("warmup-password") for _ in range(self.workers)))
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+password_hasher = AsyncPasswordHelper(
+    workers=int(os.getenv("HASH_WORKERS", "0")) or None,
+    max_pending=int(os.getenv("HASH_MAX_PENDING", "0")) or None,
+)
+# AI_Amend 2026-10-17 启动时预热进程池，退出时关闭
+resources.register("password_hasher", stop=password_hasher.shutdown)
+resources.add_warmup("password_hasher", password_hasher.warmup)
@@ -3,6 +3,7 @@ from datetime import datetime, timedelta
 from typing import Optional
 from uuid import UUID, uuid4
 
+from sqlalchemy import Index
 from sqlmodel import SQLModel, Field
 
 
@@ -18,7 +19,13 @@ class User(SQLModel, table=True):
     points: int = Field(default=0)
 
 # 订单表
+# AI_Amend 2026-10-17 (created_at, id) / (user_id, created_at, id) 复合索引，支撑后台 keyset 分页与按用户查订单
 class Order(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_order_created_at_id", "created_at", "id"),
+        Index("ix_order_user_id_created_at_id", "user_id", "created_at", "id"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: UUID = Field(foreign_key="user.id")
     status: str = Field(index=True)
@@ -26,7 +33,23 @@ class Order(SQLModel, table=True):
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 
+# AI_Amend 2026-10-17 积分流水表：只追加不修改，User.points 为其 delta 之和
+# idempotency_key 唯一（NULL 不参与唯一约束），同一业务请求重试时不会重复加分
+class PointsTransaction(SQLModel, table=True):
+    __table_args__ = (Index("ix_pointstransaction_user_id_created_at_id", "user_id", "created_at", "id"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: UUID = Field(foreign_key="user.id")
+    delta: int
+    reason: str = Field(default="")
+    idempotency_key: Optional[str] = Field(default=None, unique=True, max_length=128)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+# AI_Amend 2026-10-17 验证码表增加 (subject, code, used) 复合索引，配合 codes.SQLCodeStore 使用
 class PasswordResetCode(SQLModel, table=True):
+    __table_args__ = (Index("ix_passwordresetcode_user_id_code_used", "user_id", "code", "used"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: UUID = Field(foreign_key="user.id", index=True)
     code: str = Field(index=True)
@@ -36,6 +59,8 @@ class PasswordResetCode(SQLModel, table=True):
 
 # AI_Amend 2026-01-27 邮箱注册验证码表（独立于忘记密码）
 class EmailRegisterCode(SQLModel, table=True):
+    __table_args__ = (Index("ix_emailregistercode_email_code_used", "email", "code", "used"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     email: str = Field(index=True)
     code: str = Field(index=True)
@@ -45,6 +70,8 @@ class EmailRegisterCode(SQLModel, table=True):
 
 # AI_Amend 2026-01-27 手机验证码登录表
 class PhoneLoginCode(SQLModel, table=True):
+    __table_args__ = (Index("ix_phonelogincode_phone_code_used", "phone", "code", "used"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     phone: str = Field(index=True)
     code: str = Field(index=True)
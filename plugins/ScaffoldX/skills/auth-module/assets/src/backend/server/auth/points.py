@@ -0,0 +1,279 @@
+# AI_Amend 2026-10-17 积分子系统：流水表 + 原子增减 + 幂等键 + 同用户小额加分合并写入
+"""
+用法:
+
+    from .points import add_points, points_batcher
+
+    # 立即生效，返回变更后的余额；同一 idempotency_key 重试只会记一次
+    result = await add_points(user.id, 10, reason="daily_checkin", idempotency_key=f"checkin:{user.id}:{day}")
+
+    # 高频小额加分（点赞、浏览奖励等）：同一用户在 POINTS_BATCH_INTERVAL_MS 内的多次加分合并为一次 UPDATE
+    result = await points_batcher.add(user.id, 1, reason="like")
+
+余额变更只通过 UPDATE user SET points = points + :delta 完成，不做 ORM 读-改-写，并发下不会丢失更新。
+"""
+import asyncio
+import os
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+from uuid import UUID
+
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+
+from .models import PointsTransaction, User
+from ..db import async_engine, async_session_maker
+from ..lifecycle import resources
+
+
+class PointsError(Exception):
+    pass
+
+
+class UserNotFound(PointsError):
+    pass
+
+
+class InsufficientPoints(PointsError):
+    pass
+
+
+@dataclass
+class PointsResult:
+    applied: bool  # False 表示 idempotency_key 已存在，本次没有重复记账
+    balance: int
+    transaction_id: Optional[int] = None
+
+
+async def _balance(session, user_id: UUID) -> Optional[int]:
+    return (await session.execute(select(User.points).where(User.id == user_id))).scalar_one_or_none()
+
+
+async def _apply_delta(session, user_id: UUID, delta: int, allow_negative: bool) -> Optional[int]:
+    """原子增减余额，返回新余额；用户不存在或余额不足时返回 None。"""
+    stmt = (
+        update(User)
+        .where(User.id == user_id)
+        .values(points=User.points + delta)
+        .execution_options(synchronize_session=False)
+    )
+    if delta < 0 and not allow_negative:
+        stmt = stmt.where(User.points + delta >= 0)
+    if async_engine.dialect.update_returning:
+        row = (await session.execute(stmt.returning(User.points))).first()
+        return None if row is None else row[0]
+    # MySQL 等不支持 UPDATE ... RETURNING：同一事务内再读一次（行锁仍被本事务持有）
+    result = await session.execute(stmt)
+    if not result.rowcount:
+        return None
+    return await _balance(session, user_id)
+
+
+async def _raise_for_missing(session, user_id: UUID):
+    if await _balance(session, user_id) is None:
+        raise UserNotFound(str(user_id))
+    raise InsufficientPoints(str(user_id))
+
+
+async def add_points(user_id: UUID, delta: int, reason: str = "",
+                     idempotency_key: Optional[str] = None, allow_negative: bool = False) -> PointsResult:
+    """
+    在同一事务内写一条流水并原子更新余额。
+
+    先插入流水：idempotency_key 冲突说明已记过账，直接返回当时的流水 id 与当前余额；
+    扣分（delta < 0）默认要求余额充足，否则抛 InsufficientPoints，流水一并回滚。
+    """
+    async with async_session_maker() as session:
+        tx = PointsTransaction(user_id=user_id, delta=delta, reason=reason, idempotency_key=idempotency_key)
+        session.add(tx)
+        try:
+            await session.flush()
+        except IntegrityError as e:
+            await session.rollback()
+            existing = None
+            if idempotency_key is not None:
+                existing = (await session.execute(
+                    select(PointsTransaction.id).where(PointsTransaction.idempotency_key == idempotency_key)
+                )).scalar_one_or_none()
+            if existing is None:
+                # 外键约束生效的数据库上，用户不存在时插入流水即失败
+                if await _balance(session, user_id) is None:
+                    raise UserNotFound(str(user_id)) from e
+                raise
+            return PointsResult(applied=False, balance=await _balance(session, user_id), transaction_id=existing)
+
+        balance = await _apply_delta(session, user_id, delta, allow_negative)
+        if balance is None:
+            await session.rollback()
+            await _raise_for_missing(session, user_id)
+        await session.commit()
+        return PointsResult(applied=True, balance=balance, transaction_id=tx.id)
+
+
+async def get_transactions(user_id: UUID, limit: int = 50, before_id: Optional[int] = None) -> List[PointsTransaction]:
+    """按时间倒序列出流水，before_id 为上一页最后一条的 id（keyset 分页）。"""
+    stmt = select(PointsTransaction).where(PointsTransaction.user_id == user_id)
+    if before_id is not None:
+        stmt = stmt.where(PointsTransaction.id < before_id)
+    stmt = stmt.order_by(PointsTransaction.created_at.desc(), PointsTransaction.id.desc()).limit(limit)
+    async with async_session_maker() as session:
+        return list((await session.execute(stmt)).scalars())
+
+
+@dataclass
+class _Pending:
+    delta: int
+    reason: str
+    idempotency_key: Optional[str]
+    future: asyncio.Future
+
+
+class PointsBatcher:
+    """
+    合并同一用户的加分请求。
+
+    add() 把请求挂到待写队列，后台任务在第一条请求到达后等待 interval 秒（或攒满 max_batch 条）再统一落库：
+    一个事务内批量插入全部流水，每个用户只执行一次 points = points + sum(delta)。
+    热点用户每秒上千次加分时，行锁竞争从上千次降为每个 interval 一次。
+
+    - 扣分不参与合并（需要即时校验余额），直接走 add_points
+    - 批量写入失败（幂等键冲突、用户不存在等）时整批回退为逐条 add_points，每个调用方拿到各自的结果 / 异常
+    - 调用方取消等待不会撤销已排队的加分
+    - 未 start() 时 add() 等同于 add_points；stop() 等正在进行的写入完成后再写完剩余请求，不会中途取消
+    """
+
+    def __init__(self, interval: float = 0.02, max_batch: int = 1000):
+        self.interval = interval
+        self.max_batch = max_batch
+        self._pending: Dict[UUID, List[_Pending]] = {}
+        self._size = 0
+        self._has_items = asyncio.Event()
+        self._full = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.requests = 0
+        self.writes = 0
+        self.fallbacks = 0
+
+    @property
+    def pending(self) -> int:
+        return self._size
+
+    async def add(self, user_id: UUID, delta: int, reason: str = "",
+                  idempotency_key: Optional[str] = None) -> PointsResult:
+        if self._task is None or delta < 0:
+            return await add_points(user_id, delta, reason, idempotency_key)
+        future = asyncio.get_running_loop().create_future()
+        self._pending.setdefault(user_id, []).append(_Pending(delta, reason, idempotency_key, future))
+        self._size += 1
+        self.requests += 1
+        self._has_items.set()
+        if self._size >= self.max_batch:
+            self._full.set()
+        return await future
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """停止后台任务并写完剩余请求，之后的 add() 直接落库。"""
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        # 不 cancel：取消会打断正在进行的 _write，已取出的批次既没落库也不会再被写，调用方永远等不到结果
+        self._stopping = True
+        self._has_items.set()
+        self._full.set()
+        await asyncio.gather(task, return_exceptions=True)
+        await self.flush()
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            await self._has_items.wait()
+            if not self._full.is_set():
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"[POINTS] flush failed: {e}")
+
+    async def flush(self) -> None:
+        batch, self._pending, self._size = self._pending, {}, 0
+        self._has_items.clear()
+        self._full.clear()
+        if not batch:
+            return
+        try:
+            try:
+                await self._write(batch)
+            except Exception:
+                self.fallbacks += 1
+                await self._write_one_by_one(batch)
+        finally:
+            # 写入被取消等意外中断时，不让调用方一直挂起
+            for items in batch.values():
+                for item in items:
+                    if not item.future.done():
+                        item.future.set_exception(PointsError("points write interrupted, result unknown"))
+
+    async def _write(self, batch: Dict[UUID, List[_Pending]]) -> None:
+        # 固定顺序加锁，避免与其它批量事务交叉死锁
+        user_ids = sorted(batch, key=str)
+        async with async_session_maker() as session:
+            rows = [
+                (item, PointsTransaction(user_id=user_id, delta=item.delta, reason=item.reason,
+                                         idempotency_key=item.idempotency_key))
+                for user_id in user_ids for item in batch[user_id]
+            ]
+            session.add_all([tx for _, tx in rows])
+            await session.flush()
+            balances = {}
+            for user_id in user_ids:
+                balance = await _apply_delta(session, user_id, sum(item.delta for item in batch[user_id]), True)
+                if balance is None:
+                    raise UserNotFound(str(user_id))
+                balances[user_id] = balance
+            await session.commit()
+        self.writes += 1
+        for item, tx in rows:
+            if not item.future.done():
+                item.future.set_result(PointsResult(applied=True, balance=balances[tx.user_id], transaction_id=tx.id))
+
+    async def _write_one_by_one(self, batch: Dict[UUID, List[_Pending]]) -> None:
+        for user_id, items in batch.items():
+            for item in items:
+                try:
+                    result = await add_points(user_id, item.delta, item.reason, item.idempotency_key)
+                except Exception as e:
+                    if not item.future.done():
+                        item.future.set_exception(e)
+                else:
+                    if not item.future.done():
+                        item.future.set_result(result)
+                self.writes += 1
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.pending,
+            "requests": self.requests,
+            "writes": self.writes,
+            "fallbacks": self.fallbacks,
+        }
+
+
+def create_points_batcher() -> PointsBatcher:
+    """POINTS_BATCH_INTERVAL_MS / POINTS_BATCH_MAX 控制合并窗口与单批上限。"""
+    return PointsBatcher(
+        interval=float(os.getenv("POINTS_BATCH_INTERVAL_MS", "20")) / 1000,
+        max_batch=int(os.getenv("POINTS_BATCH_MAX", "1000")),
+    )
+
+
+points_batcher = create_points_batcher()
+# AI_Amend 2026-10-17 合并写入任务，退出时写完剩余加分
+resources.register("points_batcher", points_batcher.start, points_batcher.stop)
@@ -0,0 +1,211 @@
+# AI_Amend 2026-10-17 验证码接口限流：按 IP / 邮箱 / 手机号的令牌桶，超限返回 429 + Retry-After
+"""
+令牌桶使用 GCRA 实现：每个键只保存一个"理论到达时间"（TAT），检查为 O(1)，
+内存后端单次检查约 1µs；Redis 后端用 Lua 脚本在服务端原子完成读-判断-写，多进程 / 多实例共享额度。
+
+规则格式 "次数/周期"，多条用逗号分隔，例如 "1/minute,10/hour"；周期可写秒数或 second / minute / hour / day。
+"""
+import math
+import os
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException, Request
+
+from ..lifecycle import resources
+
+_PERIODS = {"s": 1, "second": 1, "m": 60, "minute": 60, "h": 3600, "hour": 3600, "d": 86400, "day": 86400}
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    """period 秒内最多 limit 次，允许一次性用完（突发上限 = limit）。"""
+
+    limit: int
+    period: float
+
+    @property
+    def interval(self) -> float:
+        return self.period / self.limit
+
+    def __str__(self):
+        return f"{self.limit}/{self.period:g}s"
+
+
+def parse_limits(spec: str) -> List[RateLimit]:
+    limits = []
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        count, _, period = part.partition("/")
+        period = period.strip().lower() or "1"
+        seconds = _PERIODS[period] if period in _PERIODS else float(period)
+        limits.append(RateLimit(int(count), seconds))
+    return limits
+
+
+class RateLimiter:
+    """
+    限流后端接口：hit / hit_all 返回 0 表示放行，否则返回需要等待的秒数。
+
+    hit_all 对多条 (键, 规则) 全有或全无：全部通过才一起扣额度，任一超限时都不扣，
+    被小时级规则拦下的请求不会继续消耗分钟级额度。
+    """
+
+    async def hit_all(self, checks: Sequence[Tuple[str, RateLimit]]) -> float:
+        raise NotImplementedError
+
+    async def hit(self, key: str, limit: RateLimit) -> float:
+        return await self.hit_all([(key, limit)])
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+
+class MemoryRateLimiter(RateLimiter):
+    """
+    进程内 GCRA，适合单进程部署。
+
+    键数超过 max_keys 时清理已回满的桶（TAT 早于当前时间的键与不存在等价），
+    仍超限则丢弃最早写入的一半，保证内存有上界。
+    """
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._tat: Dict[str, float] = {}
+
+    def hit_nowait(self, key: str, limit: RateLimit, now: Optional[float] = None) -> float:
+        return self.hit_all_nowait([(key, limit)], now)
+
+    def hit_all_nowait(self, checks: Sequence[Tuple[str, RateLimit]], now: Optional[float] = None) -> float:
+        if now is None:
+            now = time.monotonic()
+        wait = 0.0
+        updates = []
+        for key, limit in checks:
+            tat = max(self._tat.get(key, now), now)
+            new_tat = tat + limit.interval
+            allow_at = new_tat - limit.period
+            if allow_at > now:
+                wait = max(wait, allow_at - now)
+            updates.append((key, new_tat))
+        if wait > 0:
+            return wait
+        self._tat.update(updates)
+        if len(self._tat) > self.max_keys:
+            self._sweep(now)
+        return 0.0
+
+    async def hit_all(self, checks):
+        return self.hit_all_nowait(checks)
+
+    def _sweep(self, now: float) -> None:
+        self._tat = {k: v for k, v in self._tat.items() if v > now}
+        if len(self._tat) > self.max_keys:
+            keys = list(self._tat)
+            for k in keys[: len(keys) // 2]:
+                del self._tat[k]
+
+
+# 时间取 Redis 服务端 TIME，避免多实例时钟偏差；值为 TAT（毫秒），PX 过期后键自动消失
+# ARGV 依次为每个键的 interval / period（毫秒）；先检查全部键，全部通过才写入
+_GCRA_SCRIPT = """
+local t = redis.call('TIME')
+local now = t[1] * 1000 + math.floor(t[2] / 1000)
+local wait = 0
+local new_tats = {}
+for i, key in ipairs(KEYS) do
+    local interval = tonumber(ARGV[2 * i - 1])
+    local period = tonumber(ARGV[2 * i])
+    local tat = tonumber(redis.call('GET', key)) or now
+    if tat < now then tat = now end
+    new_tats[i] = tat + interval
+    local allow_at = new_tats[i] - period
+    if allow_at - now > wait then wait = allow_at - now end
+end
+if wait > 0 then
+    return wait
+end
+for i, key in ipairs(KEYS) do
+    redis.call('SET', key, new_tats[i], 'PX', math.ceil(new_tats[i] - now))
+end
+return 0
+"""
+
+
+class RedisRateLimiter(RateLimiter):
+    """基于 Redis 协议的 GCRA，一次 EVALSHA 往返完成检查。"""
+
+    def __init__(self, client, prefix: str = "ratelimit:"):
+        self.client = client
+        self.prefix = prefix
+        self._script = client.register_script(_GCRA_SCRIPT)
+
+    async def hit_all(self, checks):
+        wait_ms = await self._script(
+            keys=[f"{self.prefix}{key}" for key, _ in checks],
+            args=[value for _, limit in checks for value in (limit.interval * 1000, limit.period * 1000)],
+        )
+        return int(wait_ms) / 1000
+
+    async def stop(self):
+        await self.client.aclose()
+
+
+def create_rate_limiter() -> Optional[RateLimiter]:
+    """RATE_LIMIT_ENABLED=0 时返回 None（不限流）；RATE_LIMIT_BACKEND (memory | redis) 选择后端。"""
+    if os.getenv("RATE_LIMIT_ENABLED", "1") == "0":
+        return None
+    if os.getenv("RATE_LIMIT_BACKEND", "memory") == "redis":
+        import redis.asyncio as redis
+
+        client = redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+        return RedisRateLimiter(client)
+    return MemoryRateLimiter(max_keys=int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000")))
+
+
+rate_limiter = create_rate_limiter()
+if rate_limiter is not None:
+    # AI_Amend 2026-10-17 限流后端（Redis 连接）
+    resources.register("rate_limiter", rate_limiter.start, rate_limiter.stop)
+IP_LIMITS = parse_limits(os.getenv("RATE_LIMIT_IP", "10/minute,100/hour"))
+SUBJECT_LIMITS = parse_limits(os.getenv("RATE_LIMIT_SUBJECT", "1/minute,10/hour"))
+TRUST_PROXY = os.getenv("RATE_LIMIT_TRUST_PROXY", "0") == "1"
+
+
+def client_ip(request: Request) -> str:
+    """RATE_LIMIT_TRUST_PROXY=1 时取 X-Forwarded-For 第一跳（仅在可信反向代理之后开启）。"""
+    if TRUST_PROXY:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",", 1)[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+async def _check(checks: List[Tuple[str, RateLimit]]) -> None:
+    # 每条规则独立计数，但全部通过才扣额度
+    wait = await rate_limiter.hit_all(checks)
+    if wait > 0:
+        retry_after = max(1, math.ceil(wait))
+        raise HTTPException(
+            429,
+            f"too many requests, retry after {retry_after}s",
+            headers={"Retry-After": str(retry_after)},
+        )
+
+
+async def limit_code_request(request: Request, scope: str, subject_kind: str, subject: str) -> None:
+    """
+    验证码类接口的限流检查，应放在查库 / 发信之前。
+
+    IP 与收件人（邮箱 / 手机号）的全部规则一次检查，任一超限抛出 429，且本次不扣任何额度。
+    scope 区分接口，同一 IP 在不同接口的额度互不影响；收件人额度跨接口共享。
+    """
+    if rate_limiter is None:
+        return
+    ip_key = f"{scope}:ip:{client_ip(request)}"
+    subject_key = f"{subject_kind}:{subject.strip().lower()}"
+    await _check([(f"{ip_key}:{limit}", limit) for limit in IP_LIMITS]
+                 + [(f"{subject_key}:{limit}", limit) for limit in SUBJECT_LIMITS])
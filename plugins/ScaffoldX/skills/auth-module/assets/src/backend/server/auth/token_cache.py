@@ -0,0 +1,175 @@
+# AI_Amend 2026-10-17 JWT 解码结果缓存，减少 current_user 每次请求的解码与 User 查询
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Set
+from uuid import UUID
+
+import jwt
+from fastapi_users.authentication.strategy import JWTStrategy, StrategyDestroyNotSupportedError
+from fastapi_users.jwt import decode_jwt, generate_jwt
+
+from .models import User
+
+_REVOKED = object()
+
+
+class TokenCache:
+    """
+    token -> User 快照的 LRU + TTL 缓存。
+
+    另外维护 user_id -> tokens 的反向索引，用于重置密码时按用户整体失效。
+    仅在当前进程内有效，多 worker 部署时各自独立：登出 / 重置密码只在处理该请求的 worker 上立即生效。
+
+    not_before_ttl 为 token 有效期：超过它的失效记录不再需要（之前签发的 token 都已过期），
+    失效记录最多保留 maxsize 条，超出时淘汰最早的。
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 60.0, not_before_ttl: float = 3600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.not_before_ttl = not_before_ttl
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._by_user: Dict[UUID, Set[str]] = {}
+        # user_id -> 失效时间戳，早于该时间签发的 token 一律拒绝（信任 claims 模式下使用），按时间先后排列
+        self._not_before: "OrderedDict[UUID, int]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str):
+        entry = self._data.get(token)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, _, value = entry
+        if expires_at <= time.monotonic():
+            self._remove(token)
+            self.misses += 1
+            return None
+        self._data.move_to_end(token)
+        self.hits += 1
+        return value
+
+    def set(self, token: str, user_id: Optional[UUID], value, ttl: Optional[float] = None) -> None:
+        if token in self._data:
+            self._remove(token)
+        self._data[token] = (time.monotonic() + (ttl or self.ttl), user_id, value)
+        if user_id is not None:
+            self._by_user.setdefault(user_id, set()).add(token)
+        while len(self._data) > self.maxsize:
+            self._remove(next(iter(self._data)))
+
+    def revoke(self, token: str, ttl: float) -> None:
+        """登出：写入墓碑，在 ttl 内（且未被 LRU 淘汰前）直接拒绝该 token。"""
+        self.set(token, None, _REVOKED, ttl=ttl)
+
+    def invalidate_user(self, user_id: UUID) -> None:
+        # 取整到秒，与 JWT 的 iat 精度一致，避免误伤重置后同一秒内签发的新 token
+        now = int(time.time())
+        self._not_before.pop(user_id, None)
+        self._not_before[user_id] = now
+        while self._not_before:
+            oldest_user, oldest = next(iter(self._not_before.items()))
+            if oldest > now - self.not_before_ttl and len(self._not_before) <= self.maxsize:
+                break
+            del self._not_before[oldest_user]
+        for token in self._by_user.pop(user_id, ()):
+            self._data.pop(token, None)
+
+    def issued_before_invalidation(self, user_id: UUID, issued_at: Optional[float]) -> bool:
+        not_before = self._not_before.get(user_id)
+        return not_before is not None and (issued_at is None or issued_at < not_before)
+
+    def _remove(self, token: str) -> None:
+        _, user_id, _ = self._data.pop(token)
+        if user_id is not None:
+            tokens = self._by_user.get(user_id)
+            if tokens is not None:
+                tokens.discard(token)
+                if not tokens:
+                    del self._by_user[user_id]
+
+    def stats(self) -> dict:
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses,
+                "invalidated_users": len(self._not_before)}
+
+
+def _snapshot(user: User) -> User:
+    # 与请求 session 脱离的副本，只读使用；需要写库的路由请重新查询
+    return User(**user.model_dump())
+
+
+class CachedJWTStrategy(JWTStrategy):
+    """
+    带缓存的 JWTStrategy，整个进程共用一个实例。
+
+    trust_claims=True 时把 email / phone / is_active / is_superuser 写入 JWT，
+    读取时直接用 claims 构造 User，不再查询数据库；代价是账号状态变更要等 token 过期才生效
+    （重置密码除外：处理重置请求的进程会立即拒绝旧 token，其它 worker 要等 token 过期）。
+    """
+
+    def __init__(self, *args, cache: TokenCache, trust_claims: bool = False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache = cache
+        self.trust_claims = trust_claims
+
+    def _decode(self, token: str) -> Optional[dict]:
+        try:
+            return decode_jwt(token, self.decode_key, self.token_audience, algorithms=[self.algorithm])
+        except jwt.PyJWTError:
+            return None
+
+    def _user_from_claims(self, data: dict) -> Optional[User]:
+        try:
+            user_id = UUID(data["sub"])
+        except (KeyError, ValueError):
+            return None
+        if self.cache.issued_before_invalidation(user_id, data.get("iat")):
+            return None
+        return User(
+            id=user_id,
+            email=data.get("email"),
+            phone=data.get("phone"),
+            hashed_password="",
+            is_active=data.get("is_active", True),
+            is_superuser=data.get("is_superuser", False),
+        )
+
+    async def read_token(self, token, user_manager):
+        if token is None:
+            return None
+        cached = self.cache.get(token)
+        if cached is _REVOKED:
+            return None
+        if cached is not None:
+            return cached
+
+        ttl = self.cache.ttl
+        if self.trust_claims:
+            data = self._decode(token)
+            user = self._user_from_claims(data) if data else None
+            if user is not None and "exp" in data:
+                ttl = min(ttl, data["exp"] - time.time())
+        else:
+            user = await super().read_token(token, user_manager)
+            user = _snapshot(user) if user is not None else None
+
+        if user is not None and ttl > 0:
+            self.cache.set(token, user.id, user, ttl=ttl)
+        return user
+
+    async def write_token(self, user) -> str:
+        data = {"sub": str(user.id), "aud": self.token_audience, "iat": int(time.time())}
+        if self.trust_claims:
+            data.update(
+                email=user.email,
+                phone=user.phone,
+                is_active=user.is_active,
+                is_superuser=user.is_superuser,
+            )
+        return generate_jwt(data, self.encode_key, self.lifetime_seconds, algorithm=self.algorithm)
+
+    async def destroy_token(self, token, user) -> None:
+        self.cache.revoke(token, ttl=self.lifetime_seconds or self.cache.ttl)
+        raise StrategyDestroyNotSupportedError(
+            "A JWT can't be invalidated: it's valid until it expires."
+        )
@@ -0,0 +1,282 @@
+# AI_Amend 2026-10-17 鉴权接口基准测试：进程内 ASGI 压测，输出 RPS / 延迟分位数 / 每请求 SQL 条数
+"""
+用法（在项目包目录下，建议使用独立的数据库）:
+
+    python -m <module>.server.bench.auth --output bench-before.json
+    # 修改代码后
+    python -m <module>.server.bench.auth --output bench-after.json --compare bench-before.json
+
+默认使用 sqlite:///./bench_auth.db、内存邮件后端、内存验证码存储，并关闭限流；
+通过 DATABASE_URL 等环境变量可改为 PostgreSQL 等真实环境。
+
+请求经 httpx.ASGITransport 直接调用 app，不经过网络栈，结果反映的是应用本身（路由 + ORM + 哈希）的开销。
+场景：
+- login              POST /auth/login
+- me                 GET  /bench/me（current_active_user 鉴权）
+- register_with_code POST /auth/register_with_code（验证码预先写入 code_store）
+- phone_login        POST /auth/phone/login（新手机号，含建用户）
+- password_reset     POST /auth/password/reset
+"""
+import os
+
+# 必须在导入 server 模块之前设置
+os.environ.setdefault("DATABASE_URL", "sqlite:///./bench_auth.db")
+os.environ.setdefault("DB_ECHO", "0")
+os.environ.setdefault("MAIL_BACKEND", "memory")
+os.environ.setdefault("CODE_STORE", "memory")
+os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+
+import argparse
+import asyncio
+import json
+import platform
+import subprocess
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List
+from uuid import uuid4
+
+import httpx
+from fastapi import Depends
+from sqlalchemy import event
+
+from ..__main__ import app
+from ..auth.auth import current_active_user, jwt_strategy
+from ..auth.codes import PURPOSE_PHONE, PURPOSE_REGISTER, PURPOSE_RESET, code_store
+from ..auth.hashing import password_hasher
+from ..auth.models import User
+from ..db import async_engine, async_session_maker
+
+PASSWORD = "bench-password-123"
+CODE = "123456"
+SCENARIOS = ("login", "me", "register_with_code", "phone_login", "password_reset")
+
+
+@app.get("/bench/me", include_in_schema=False)
+async def bench_me(user: User = Depends(current_active_user)):
+    return {"id": str(user.id), "email": user.email}
+
+
+class QueryCounter:
+    """统计异步引擎上执行的 SQL 条数（含事务语句以外的所有 cursor.execute）。"""
+
+    def __init__(self, sync_engine):
+        self.count = 0
+        event.listen(sync_engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args, **kwargs):
+        self.count += 1
+
+
+class Context:
+    def __init__(self, run_id: str):
+        self.run_id = run_id
+        self.emails: List[str] = []
+        self.tokens: List[str] = []
+        self.hashed_password = ""
+        self._seq = 0
+
+    def unique(self, tag: str) -> str:
+        """每次 prepare（含预热）使用不同前缀，重复运行 / 预热都不会撞唯一约束。"""
+        self._seq += 1
+        return f"{tag}{self._seq}-{self.run_id}"
+
+    async def seed_users(self, n: int, tag: str) -> List[User]:
+        prefix = self.unique(tag)
+        users = [User(email=f"{prefix}-{i}@bench.local", hashed_password=self.hashed_password) for i in range(n)]
+        async with async_session_maker() as session:
+            session.add_all(users)
+            await session.commit()
+        return users
+
+
+RequestFn = Callable[[httpx.AsyncClient, int], Awaitable[httpx.Response]]
+
+
+async def prepare_login(ctx: Context, n: int) -> RequestFn:
+    if not ctx.emails:
+        ctx.emails = [u.email for u in await ctx.seed_users(min(n, 100), "login")]
+
+    def request(client, i):
+        return client.post("/auth/login", data={"username": ctx.emails[i % len(ctx.emails)], "password": PASSWORD})
+    return request
+
+
+async def prepare_me(ctx: Context, n: int) -> RequestFn:
+    if not ctx.tokens:
+        users = await ctx.seed_users(min(n, 100), "me")
+        ctx.tokens = [await jwt_strategy.write_token(u) for u in users]
+
+    def request(client, i):
+        return client.get("/bench/me", headers={"Authorization": f"Bearer {ctx.tokens[i % len(ctx.tokens)]}"})
+    return request
+
+
+async def prepare_register_with_code(ctx: Context, n: int) -> RequestFn:
+    prefix = ctx.unique("register")
+    emails = [f"{prefix}-{i}@bench.local" for i in range(n)]
+    for email in emails:
+        await code_store.issue(PURPOSE_REGISTER, email, CODE, ttl_seconds=3600)
+
+    def request(client, i):
+        return client.post("/auth/register_with_code", json={"email": emails[i], "password": PASSWORD, "code": CODE})
+    return request
+
+
+async def prepare_phone_login(ctx: Context, n: int) -> RequestFn:
+    prefix = ctx.unique("phone")
+    phones = [f"{prefix}-{i}" for i in range(n)]
+    for phone in phones:
+        await code_store.issue(PURPOSE_PHONE, phone, CODE, ttl_seconds=3600)
+
+    def request(client, i):
+        return client.post("/auth/phone/login", json={"phone": phones[i], "code": CODE})
+    return request
+
+
+async def prepare_password_reset(ctx: Context, n: int) -> RequestFn:
+    users = await ctx.seed_users(n, "reset")
+    for user in users:
+        await code_store.issue(PURPOSE_RESET, str(user.id), CODE, ttl_seconds=3600)
+
+    def request(client, i):
+        return client.post("/auth/password/reset",
+                           json={"email": users[i].email, "code": CODE, "new_password": PASSWORD})
+    return request
+
+
+PREPARE = {
+    "login": prepare_login,
+    "me": prepare_me,
+    "register_with_code": prepare_register_with_code,
+    "phone_login": prepare_phone_login,
+    "password_reset": prepare_password_reset,
+}
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """nearest-rank 分位数。"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(q * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+async def run_scenario(client, request: RequestFn, n: int, concurrency: int, queries: QueryCounter) -> dict:
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    indexes = iter(range(n))
+
+    async def worker():
+        for i in indexes:
+            started = time.perf_counter()
+            response = await request(client, i)
+            latencies.append(time.perf_counter() - started)
+            statuses[response.status_code] += 1
+
+    queries_before = queries.count
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    ms = lambda s: round(s * 1000, 3)
+    return {
+        "requests": n,
+        "errors": n - statuses.get(200, 0),
+        "status_codes": {str(k): v for k, v in sorted(statuses.items())},
+        "seconds": round(elapsed, 3),
+        "rps": round(n / elapsed, 1),
+        "p50_ms": ms(percentile(latencies, 0.50)),
+        "p95_ms": ms(percentile(latencies, 0.95)),
+        "p99_ms": ms(percentile(latencies, 0.99)),
+        "max_ms": ms(latencies[-1]) if latencies else 0.0,
+        "queries_per_request": round((queries.count - queries_before) / n, 2),
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+async def run(scenarios, n: int, concurrency: int, warmup: int) -> dict:
+    queries = QueryCounter(async_engine.sync_engine)
+    ctx = Context(uuid4().hex[:8])
+    results: Dict[str, dict] = {}
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app), httpx.AsyncClient(transport=transport,
+                                                                   base_url="http://bench") as client:
+        ctx.hashed_password = await password_hasher.hash(PASSWORD)
+        for name in scenarios:
+            if warmup:
+                await run_scenario(client, await PREPARE[name](ctx, warmup), warmup, min(concurrency, warmup), queries)
+            request = await PREPARE[name](ctx, n)
+            results[name] = await run_scenario(client, request, n, concurrency, queries)
+            print(f"[BENCH] {name}: {json.dumps(results[name])}", file=sys.stderr)
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "python": platform.python_version(),
+            "database": async_engine.url.render_as_string(hide_password=True),
+            "requests": n,
+            "concurrency": concurrency,
+            "warmup": warmup,
+        },
+        "results": results,
+    }
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> List[str]:
+    """打印对比表，返回判定为退化的场景：RPS 下降、p95 上升超过 threshold，或每请求 SQL 条数增加。"""
+    regressions = []
+    for name, cur in current["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if base is None:
+            continue
+        rps_change = cur["rps"] / base["rps"] - 1 if base["rps"] else 0.0
+        p95_change = cur["p95_ms"] / base["p95_ms"] - 1 if base["p95_ms"] else 0.0
+        regressed = (
+            rps_change < -threshold
+            or p95_change > threshold
+            or cur["queries_per_request"] > base["queries_per_request"]
+        )
+        if regressed:
+            regressions.append(name)
+        print(
+            f"{name:<20} rps {base['rps']} -> {cur['rps']} ({rps_change:+.0%})  "
+            f"p95 {base['p95_ms']}ms -> {cur['p95_ms']}ms ({p95_change:+.0%})  "
+            f"queries/req {base['queries_per_request']} -> {cur['queries_per_request']}"
+            + ("  REGRESSION" if regressed else "")
+        )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the auth endpoints in-process.")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=200, help="Requests per scenario [default: 200].")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=20, help="Untimed requests per scenario [default: 20].")
+    parser.add_argument("--output", help="Write results as JSON to this file.")
+    parser.add_argument("--compare", metavar="BASELINE", help="Compare with a previous --output file.")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Relative RPS / p95 change treated as a regression [default: 0.10].")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args.scenarios, args.requests, args.concurrency, args.warmup))
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        if regressions:
+            print(f"regressions: {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
@@ -0,0 +1,107 @@
+# AI_Amend 2026-10-17 积分热点用户压测：对比 ORM 读-改-写 / 原子 UPDATE / 合并写入的吞吐与丢失更新
+"""
+用法（在项目包目录下，建议使用独立的数据库）:
+
+    DATABASE_URL=sqlite:///./bench.db python -m <module>.server.bench.points
+    DATABASE_URL=postgresql://... python -m <module>.server.bench.points --concurrency 200 --increments 50 --mode atomic batched
+
+每种模式新建一个热点用户，concurrency 个协程各给它加 increments 次 1 分，
+输出 JSON：耗时、每秒加分次数、期望余额、实际余额、丢失更新数、错误数。
+"""
+import argparse
+import asyncio
+import json
+import time
+from uuid import uuid4
+
+from ..auth.models import User
+from ..auth.points import PointsBatcher, add_points
+from ..db import async_engine, async_session_maker, engine, init_db
+
+MODES = ("naive", "atomic", "batched")
+
+
+async def _naive(user_id, reason):
+    # 反例：先读再写，并发下后提交的会覆盖先提交的
+    async with async_session_maker() as session:
+        user = await session.get(User, user_id)
+        user.points += 1
+        session.add(user)
+        await session.commit()
+
+
+async def _atomic(user_id, reason):
+    await add_points(user_id, 1, reason=reason)
+
+
+async def _create_hot_user() -> User:
+    user = User(email=f"bench-{uuid4().hex}@example.com", hashed_password="-")
+    async with async_session_maker() as session:
+        session.add(user)
+        await session.commit()
+    return user
+
+
+async def run_mode(mode: str, concurrency: int, increments: int, batch_interval: float) -> dict:
+    user = await _create_hot_user()
+    batcher = None
+    if mode == "batched":
+        batcher = PointsBatcher(interval=batch_interval)
+        await batcher.start()
+        op = lambda uid, reason: batcher.add(uid, 1, reason=reason)
+    else:
+        op = _naive if mode == "naive" else _atomic
+
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        for _ in range(increments):
+            try:
+                await op(user.id, f"bench:{mode}")
+            except Exception:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    if batcher is not None:
+        await batcher.stop()
+    elapsed = time.perf_counter() - started
+
+    async with async_session_maker() as session:
+        balance = (await session.get(User, user.id)).points
+    total = concurrency * increments
+    report = {
+        "mode": mode,
+        "concurrency": concurrency,
+        "operations": total,
+        "seconds": round(elapsed, 3),
+        "ops_per_second": round(total / elapsed, 1),
+        "expected_balance": total - errors,
+        "balance": balance,
+        "lost_updates": total - errors - balance,
+        "errors": errors,
+    }
+    if batcher is not None:
+        report["batched_writes"] = batcher.writes
+    return report
+
+
+async def main(args) -> None:
+    for mode in args.mode:
+        print(json.dumps(await run_mode(mode, args.concurrency, args.increments, args.batch_interval_ms / 1000)))
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent increments against a single hot user.")
+    parser.add_argument("--mode", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--increments", type=int, default=20, help="Increments per worker [default: 20].")
+    parser.add_argument("--batch-interval-ms", type=float, default=20.0)
+    args = parser.parse_args()
+
+    engine.echo = False
+    async_engine.sync_engine.echo = False
+    init_db()
+    asyncio.run(main(args))
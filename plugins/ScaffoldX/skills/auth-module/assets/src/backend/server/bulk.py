@@ -0,0 +1,304 @@
+# AI_Amend 2026-10-17 User / Order 批量导入导出：分块流式读写 CSV / JSONL，executemany 或 COPY 批量写入
+"""
+用法（在项目包目录下）:
+
+    python -m <module>.server.bulk import users users.csv
+    python -m <module>.server.bulk import orders orders.jsonl --chunk-size 10000
+    python -m <module>.server.bulk export users users.jsonl
+
+导入 users 时：
+- 有 hashed_password 列的行直接使用（例如从旧库导出的 bcrypt 哈希），不再逐行计算哈希
+- 只有 password 列的行在进程池中并行哈希（HASH_WORKERS 控制进程数）
+- 缺省字段使用模型默认值（id 自动生成 uuid、is_active=True、points=0 等）
+
+写入路径：PostgreSQL + psycopg2 使用 COPY FROM STDIN，其它数据库使用 executemany（SQLAlchemy insertmanyvalues）；
+--skip-existing 时改为 INSERT ... ON CONFLICT DO NOTHING（PostgreSQL / SQLite）。
+每个分块单独提交，失败时已提交的分块保留，进度信息输出到 stderr。
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+from uuid import UUID
+
+from sqlalchemy import insert, select
+
+from .auth.hashing import _hash
+from .auth.models import Order, User
+from .db import engine
+
+MODELS = {"users": User, "orders": Order}
+
+_TRUE = ("1", "true", "t", "yes", "y")
+
+
+class Progress:
+    """每隔 interval 秒向 stderr 输出一次已处理行数与吞吐。"""
+
+    def __init__(self, label: str, interval: float = 1.0, stream=sys.stderr):
+        self.label = label
+        self.interval = interval
+        self.stream = stream
+        self.rows = 0
+        self.started = time.perf_counter()
+        self._last_report = self.started
+
+    def add(self, n: int) -> None:
+        self.rows += n
+        now = time.perf_counter()
+        if now - self._last_report >= self.interval:
+            self._last_report = now
+            self._print(now, end="\r")
+
+    def _print(self, now: float, end: str) -> None:
+        elapsed = now - self.started
+        rate = self.rows / elapsed if elapsed > 0 else 0.0
+        self.stream.write(f"[{self.label}] {self.rows:,} rows  {elapsed:,.1f}s  {rate:,.0f} rows/s{end}")
+        self.stream.flush()
+
+    def finish(self) -> dict:
+        now = time.perf_counter()
+        self._print(now, end="\n")
+        elapsed = now - self.started
+        return {"rows": self.rows, "seconds": round(elapsed, 3),
+                "rows_per_second": round(self.rows / elapsed, 1) if elapsed > 0 else None}
+
+
+def _detect_format(path: str, fmt: Optional[str]) -> str:
+    if fmt:
+        return fmt
+    return "jsonl" if path.endswith((".jsonl", ".ndjson", ".json")) else "csv"
+
+
+def read_records(path: str, fmt: str) -> Iterator[dict]:
+    """逐行产出 dict，文件不会整体读入内存。"""
+    with open(path, newline="", encoding="utf-8") as f:
+        if fmt == "csv":
+            for row in csv.DictReader(f):
+                yield {k: v for k, v in row.items() if v not in ("", None)}
+        else:
+            for line in f:
+                if line.strip():
+                    yield {k: v for k, v in json.loads(line).items() if v is not None}
+
+
+def chunked(iterable: Iterable, size: int) -> Iterator[list]:
+    it = iter(iterable)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _converter(python_type) -> Callable:
+    if python_type is bool:
+        return lambda v: v if isinstance(v, bool) else str(v).lower() in _TRUE
+    if python_type is datetime:
+        return lambda v: v if isinstance(v, datetime) else datetime.fromisoformat(v)
+    if python_type is UUID:
+        return lambda v: v if isinstance(v, UUID) else UUID(str(v))
+    return lambda v: v if isinstance(v, python_type) else python_type(v)
+
+
+def _python_type(type_):
+    # sqlmodel 的 AutoString / UTCDateTime 是 TypeDecorator，自身 python_type 为 object，需从底层类型取
+    for candidate in (getattr(type_, "impl_instance", None), type_):
+        if candidate is None:
+            continue
+        try:
+            python_type = candidate.python_type
+        except NotImplementedError:
+            continue
+        if python_type is not object:
+            return python_type
+    return None
+
+
+class RowBuilder:
+    """把导入记录转换为表的列值：类型转换 + 模型默认值，保证同一批次的列集合一致。"""
+
+    def __init__(self, model):
+        self.model = model
+        self.table = model.__table__
+        self.converters: Dict[str, Callable] = {}
+        for column in self.table.columns:
+            python_type = _python_type(column.type)
+            self.converters[column.name] = _converter(python_type) if python_type else (lambda v: v)
+
+    def build(self, record: dict, number: Optional[int] = None) -> dict:
+        """number 为记录在文件中的序号（从 1 开始），只用于报错信息。"""
+        row = {}
+        for name, convert in self.converters.items():
+            if name in record:
+                row[name] = convert(record[name])
+                continue
+            field = self.model.model_fields.get(name)
+            if field is not None and field.is_required():
+                raise ValueError(f"{self.table.name} row {number}: missing required column {name!r}")
+            value = field.get_default(call_default_factory=True) if field is not None else None
+            if value is not None or not self.table.columns[name].primary_key:
+                row[name] = value
+        return row
+
+
+def group_by_columns(rows: List[dict]) -> List[List[dict]]:
+    """
+    executemany / COPY 按第一行取列清单：自增主键有的行给了、有的行没给时，后面行的显式 id 会被静默丢弃。
+    按列集合拆成多组分别写入（组间保持首次出现的顺序）。
+    """
+    groups: Dict[tuple, List[dict]] = {}
+    for row in rows:
+        groups.setdefault(tuple(row), []).append(row)
+    return list(groups.values())
+
+
+def _hash_passwords(records: List[dict], executor: Optional[ProcessPoolExecutor]) -> None:
+    pending = [r for r in records if "hashed_password" not in r]
+    if not pending:
+        return
+    missing = [r for r in pending if "password" not in r]
+    if missing:
+        raise ValueError(f"user row without password / hashed_password: {missing[0]}")
+    passwords = [r.pop("password") for r in pending]
+    hashed = executor.map(_hash, passwords, chunksize=64) if executor else map(_hash, passwords)
+    for record, value in zip(pending, hashed):
+        record["hashed_password"] = value
+    for r in records:
+        r.pop("password", None)
+
+
+def _copy_rows(connection, table, rows: List[dict]) -> None:
+    """psycopg2 COPY FROM STDIN（CSV），比 executemany 快一个数量级。"""
+    columns = list(rows[0].keys())
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([
+            "" if row[c] is None else ("t" if row[c] is True else "f" if row[c] is False else row[c])
+            for c in columns
+        ])
+    buffer.seek(0)
+    column_list = ", ".join(f'"{c}"' for c in columns)
+    cursor = connection.connection.driver_connection.cursor()
+    try:
+        cursor.copy_expert(f'COPY "{table.name}" ({column_list}) FROM STDIN WITH (FORMAT csv)', buffer)
+    finally:
+        cursor.close()
+
+
+def _insert_statement(table, skip_existing: bool):
+    if not skip_existing:
+        return insert(table)
+    if engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+        return pg_insert(table).on_conflict_do_nothing()
+    if engine.dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+        return sqlite_insert(table).on_conflict_do_nothing()
+    return insert(table).prefix_with("IGNORE")  # MySQL
+
+
+def import_file(kind: str, path: str, fmt: Optional[str] = None, chunk_size: int = 5000,
+                skip_existing: bool = False, hash_workers: Optional[int] = None,
+                use_copy: Optional[bool] = None) -> dict:
+    model = MODELS[kind]
+    table = model.__table__
+    builder = RowBuilder(model)
+    if use_copy is None:
+        use_copy = engine.dialect.name == "postgresql" and engine.dialect.driver == "psycopg2"
+    use_copy = use_copy and not skip_existing
+    stmt = _insert_statement(table, skip_existing)
+
+    executor = None
+    if kind == "users":
+        workers = hash_workers if hash_workers is not None else int(os.getenv("HASH_WORKERS", "0")) or os.cpu_count() or 1
+        executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+
+    progress = Progress(f"import {kind}")
+    try:
+        for records in chunked(read_records(path, _detect_format(path, fmt)), chunk_size):
+            if kind == "users":
+                _hash_passwords(records, executor)
+            rows = [builder.build(r, progress.rows + i + 1) for i, r in enumerate(records)]
+            with engine.begin() as connection:
+                for group in group_by_columns(rows):
+                    if use_copy:
+                        _copy_rows(connection, table, group)
+                    else:
+                        connection.execute(stmt, group)
+            progress.add(len(rows))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return progress.finish()
+
+
+def _jsonable(value):
+    if isinstance(value, (datetime, UUID)):
+        return value.isoformat() if isinstance(value, datetime) else str(value)
+    return value
+
+
+def export_file(kind: str, path: str, fmt: Optional[str] = None, chunk_size: int = 5000) -> dict:
+    """服务端游标分批读取（stream_results + yield_per），内存占用与表大小无关。"""
+    model = MODELS[kind]
+    table = model.__table__
+    fmt = _detect_format(path, fmt)
+    columns = [c.name for c in table.columns]
+    progress = Progress(f"export {kind}")
+    with open(path, "w", newline="", encoding="utf-8") as f, engine.connect() as connection:
+        writer = None
+        if fmt == "csv":
+            writer = csv.writer(f)
+            writer.writerow(columns)
+        result = connection.execution_options(stream_results=True, yield_per=chunk_size).execute(
+            select(table).order_by(*table.primary_key.columns)
+        )
+        for partition in result.partitions():
+            for row in partition:
+                values = [_jsonable(v) for v in row]
+                if writer is not None:
+                    writer.writerow(values)
+                else:
+                    f.write(json.dumps(dict(zip(columns, values)), ensure_ascii=False) + "\n")
+            progress.add(len(partition))
+    return progress.finish()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk import / export users and orders.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_import = sub.add_parser("import", help="Load CSV / JSONL into the database.")
+    p_import.add_argument("kind", choices=sorted(MODELS))
+    p_import.add_argument("path")
+    p_import.add_argument("--format", choices=["csv", "jsonl"], help="Default: inferred from extension.")
+    p_import.add_argument("--chunk-size", type=int, default=5000)
+    p_import.add_argument("--skip-existing", action="store_true",
+                          help="Ignore rows that violate a unique constraint (disables COPY).")
+    p_import.add_argument("--hash-workers", type=int, default=None,
+                          help="Processes for hashing plain passwords [default: $HASH_WORKERS or CPU count].")
+    p_import.add_argument("--no-copy", action="store_true", help="Use executemany even on PostgreSQL.")
+
+    p_export = sub.add_parser("export", help="Dump a table to CSV / JSONL.")
+    p_export.add_argument("kind", choices=sorted(MODELS))
+    p_export.add_argument("path")
+    p_export.add_argument("--format", choices=["csv", "jsonl"], help="Default: inferred from extension.")
+    p_export.add_argument("--chunk-size", type=int, default=5000)
+
+    args = parser.parse_args()
+    engine.echo = False  # dev profile 的逐条 SQL 日志会让批量任务慢几个数量级
+    if args.command == "import":
+        report = import_file(args.kind, args.path, args.format, args.chunk_size, args.skip_existing,
+                             args.hash_workers, use_copy=False if args.no_copy else None)
+    else:
+        report = export_file(args.kind, args.path, args.format, args.chunk_size)
+    print(json.dumps(report))
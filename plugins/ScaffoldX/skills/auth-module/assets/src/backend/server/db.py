@@ -1,14 +1,186 @@
-from sqlmodel import SQLModel, create_engine, Session
+import asyncio
+import os
 
-DATABASE_URL = "sqlite:///./test3.db"
-engine = create_engine(DATABASE_URL, echo=True)
+from sqlalchemy import event, text
+from sqlalchemy.orm import configure_mappers
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import StaticPool
+from sqlmodel import create_engine, Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from .lifecycle import resources
+
+# AI_Amend 2026-10-17 引擎配置改为环境变量驱动（dev / prod 两套 profile）
+# prod 关闭 echo（逐条 SQL 同步写日志代价很高），并开启连接池 pre-ping / recycle
+DB_PROFILE = os.getenv("DB_PROFILE", "dev")
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./test3.db")
+
+PROFILES = {
+    "dev": dict(echo=True, pool_size=5, max_overflow=5, pool_timeout=30,
+                pool_pre_ping=False, pool_recycle=-1, query_cache_size=500),
+    "prod": dict(echo=False, pool_size=20, max_overflow=10, pool_timeout=10,
+                 pool_pre_ping=True, pool_recycle=1800, query_cache_size=1200),
+}
+
+# 同步 URL 对应的异步驱动
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+}
+
+
+def _env_bool(name, default):
+    value = os.getenv(name)
+    return default if value is None else value.lower() in ("1", "true", "yes")
+
+
+def load_settings(profile: str = DB_PROFILE) -> dict:
+    """profile 默认值 + DB_* 环境变量覆盖。"""
+    settings = dict(PROFILES.get(profile, PROFILES["dev"]))
+    settings["echo"] = _env_bool("DB_ECHO", settings["echo"])
+    settings["pool_pre_ping"] = _env_bool("DB_POOL_PRE_PING", settings["pool_pre_ping"])
+    for key in ("pool_size", "max_overflow", "pool_timeout", "pool_recycle", "query_cache_size"):
+        value = os.getenv(f"DB_{key.upper()}")
+        if value is not None:
+            settings[key] = int(value)
+    return settings
+
+
+def to_async_url(url: str) -> str:
+    scheme, rest = url.split("://", 1)
+    dialect = scheme.split("+", 1)[0]
+    return f"{ASYNC_DRIVERS.get(dialect, scheme)}://{rest}"
+
+
+def _is_sqlite(url: str) -> bool:
+    return url.startswith("sqlite")
+
+
+def _is_sqlite_memory(url: str) -> bool:
+    return _is_sqlite(url) and (
+        url.endswith(":memory:") or url.split("://", 1)[1] in ("", "/") or "mode=memory" in url
+    )
+
+
+def shared_memory_url(url: str) -> str:
+    """
+    同步 / 异步引擎各自打开 :memory: 会得到两个互不相通的空库（同步引擎建的表异步路由看不到），
+    改写为同一个命名的共享缓存内存库：sqlite:///file:auth_memdb?mode=memory&cache=shared&uri=true
+    """
+    if not _is_sqlite_memory(url) or "mode=memory" in url:
+        return url
+    scheme = url.split("://", 1)[0]
+    return f"{scheme}:///file:auth_memdb?mode=memory&cache=shared&uri=true"
+
+
+def engine_kwargs(url: str, settings: dict) -> dict:
+    kwargs = dict(echo=settings["echo"], query_cache_size=settings["query_cache_size"])
+    if _is_sqlite_memory(url):
+        # 内存库只在有连接打开时存在：每个引擎固定一个连接，两个引擎通过共享缓存看到同一个库
+        kwargs.update(poolclass=StaticPool, connect_args={"check_same_thread": False})
+        return kwargs
+    kwargs.update(
+        pool_size=settings["pool_size"],
+        max_overflow=settings["max_overflow"],
+        pool_timeout=settings["pool_timeout"],
+        pool_pre_ping=settings["pool_pre_ping"],
+        pool_recycle=settings["pool_recycle"],
+    )
+    if _is_sqlite(url):
+        kwargs["connect_args"] = {"check_same_thread": False}
+    return kwargs
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+settings = load_settings()
+
+DATABASE_URL = shared_memory_url(DATABASE_URL)
+
+engine = create_engine(DATABASE_URL, **engine_kwargs(DATABASE_URL, settings))
+
+# AI_Amend 2026-10-17 异步引擎：路由与 UserManager 使用 AsyncSession，不再占用线程池
+# 同步 engine 仍保留给 SQLAdmin 与离线脚本使用
+ASYNC_DATABASE_URL = shared_memory_url(os.getenv("ASYNC_DATABASE_URL", to_async_url(DATABASE_URL)))
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **engine_kwargs(ASYNC_DATABASE_URL, settings))
+async_session_maker = async_sessionmaker(
+    async_engine, class_=AsyncSession, expire_on_commit=False
+)
+
+if _is_sqlite(DATABASE_URL) and not _is_sqlite_memory(DATABASE_URL):
+    event.listen(engine, "connect", _set_sqlite_pragmas)
+    event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
+
+
+def engine_report() -> str:
+    """启动时打印的实际生效配置。"""
+    lines = [f"[DB] profile={DB_PROFILE}"]
+    for name, eng in (("sync", engine), ("async", async_engine)):
+        lines.append(
+            f"[DB] {name} url={eng.url.render_as_string(hide_password=True)} "
+            f"pool={type(eng.pool).__name__} {eng.pool.status()}"
+        )
+    lines.append(
+        "[DB] echo={echo} pool_size={pool_size} max_overflow={max_overflow} "
+        "pool_timeout={pool_timeout} pre_ping={pool_pre_ping} recycle={pool_recycle} "
+        "query_cache_size={query_cache_size}".format(**settings)
+    )
+    if _is_sqlite(DATABASE_URL) and not _is_sqlite_memory(DATABASE_URL):
+        lines.append("[DB] sqlite pragmas: journal_mode=WAL synchronous=NORMAL")
+    return "\n".join(lines)
 
 
 def init_db():
-    SQLModel.metadata.create_all(engine)
+    # AI_Amend 2026-10-17 改为版本化迁移：已是最新版本时只执行一条查询，不再每次 create_all 反射全部表
+    from .migrate import ensure_schema
+
+    ensure_schema(engine)
+
+
+# AI_Amend 2026-10-17 启动预热：连接池预先建好连接，首批请求不再排队建连；退出时关闭连接池
+DB_WARMUP_CONNECTIONS = int(os.getenv("DB_WARMUP_CONNECTIONS", str(settings["pool_size"])))
+
+
+def _ping_sync():
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+
+async def warm_pool(n: int = DB_WARMUP_CONNECTIONS) -> None:
+    """同时借出 n 个异步连接执行 SELECT 1，归还后留在池中；同步引擎（SQLAdmin）建 1 个。"""
+    if _is_sqlite_memory(ASYNC_DATABASE_URL):
+        n = min(n, 1)
+    n = min(n, settings["pool_size"] + settings["max_overflow"])
+    connections = [async_engine.connect() for _ in range(n)]
+    try:
+        await asyncio.gather(*(conn.start() for conn in connections))
+        await asyncio.gather(*(conn.execute(text("SELECT 1")) for conn in connections))
+    finally:
+        await asyncio.gather(*(conn.close() for conn in connections), return_exceptions=True)
+    await asyncio.to_thread(_ping_sync)
+
+
+async def dispose_engines() -> None:
+    await async_engine.dispose()
+    engine.dispose()
+
+
+resources.register("database", init_db, dispose_engines)
+resources.add_warmup("db_pool", warm_pool)
+resources.add_warmup("orm_mappers", configure_mappers)
 
 
 def get_session():
     with Session(engine) as session:
         yield session
 
+
+async def get_async_session():
+    async with async_session_maker() as session:
+        yield session
@@ -0,0 +1,330 @@
+# AI_Amend 2026-10-17 异步邮件发送队列：路由只负责入队，后台协程批量发送
+import asyncio
+import json
+import os
+import queue
+import random
+import smtplib
+import threading
+from dataclasses import dataclass, asdict
+from datetime import datetime
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from typing import Dict, List, Optional
+
+from .lifecycle import resources
+
+
+@dataclass
+class MailMessage:
+    to: str
+    subject: str
+    body: str
+    attempts: int = 0
+
+
+class MailBatchError(Exception):
+    """批次发送到一半失败：前 sent 封已送达，只需重试其余的。"""
+
+    def __init__(self, sent: int, error: Exception):
+        super().__init__(str(error))
+        self.sent = sent
+        self.error = error
+
+
+def is_permanent_failure(error: Exception) -> bool:
+    """服务端返回 5xx（收件人不存在、内容被拒等），重试也不会成功。"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+
+
+class MailBackend:
+    """
+    邮件发送后端基类，send_batch 在线程中被调用，可以阻塞。
+
+    中途失败时抛出 MailBatchError(已发送数, 原异常)，队列只重试未发送的部分；其它异常视为整批未发送。
+    """
+
+    configured = True
+
+    def send_batch(self, messages: List[MailMessage]) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryMailBackend(MailBackend):
+    """内存收件箱，用于压测和本地调试。"""
+
+    def __init__(self):
+        self.outbox: List[MailMessage] = []
+        self._lock = threading.Lock()
+
+    def send_batch(self, messages):
+        with self._lock:
+            self.outbox.extend(messages)
+
+
+class FileMailBackend(MailBackend):
+    """把邮件以 JSONL 形式追加到本地文件。"""
+
+    def __init__(self, path: str = "logs/mail.jsonl"):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+
+    def send_batch(self, messages):
+        lines = [
+            json.dumps({**asdict(m), "sent_at": datetime.utcnow().isoformat()}, ensure_ascii=False)
+            for m in messages
+        ]
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+
+class SMTPMailBackend(MailBackend):
+    """
+    持久化 SMTP 连接池。
+
+    连接在批次之间复用，断线（SMTPServerDisconnected 等）时丢弃连接并重连一次。
+    """
+
+    def __init__(self, host: str, port: int, sender: Optional[str], password: Optional[str],
+                 pool_size: int = 2, timeout: float = 10.0):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.password = password
+        self.timeout = timeout
+        self._pool: "queue.LifoQueue[smtplib.SMTP_SSL]" = queue.LifoQueue(maxsize=pool_size)
+
+    @property
+    def configured(self):
+        return bool(self.sender and self.password)
+
+    def _connect(self) -> smtplib.SMTP_SSL:
+        server = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        server.login(self.sender, self.password)
+        return server
+
+    def _acquire(self) -> smtplib.SMTP_SSL:
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def _release(self, server: smtplib.SMTP_SSL) -> None:
+        try:
+            self._pool.put_nowait(server)
+        except queue.Full:
+            self._quit(server)
+
+    @staticmethod
+    def _quit(server) -> None:
+        try:
+            server.quit()
+        except Exception:
+            pass
+
+    def _build(self, message: MailMessage) -> MIMEMultipart:
+        msg = MIMEMultipart()
+        msg["From"] = self.sender
+        msg["To"] = message.to
+        msg["Subject"] = message.subject
+        msg.attach(MIMEText(message.body, "plain", "utf-8"))
+        return msg
+
+    def send_batch(self, messages):
+        server = self._acquire()
+        sent = 0
+        try:
+            for message in messages:
+                msg = self._build(message)
+                try:
+                    server.send_message(msg)
+                except OSError as e:
+                    # 池中的连接可能已被服务端关闭，重连后重试一次；
+                    # SMTPException 也是 OSError 的子类，服务端明确拒绝（收件人 / 内容 / 发件人）时不重发
+                    if isinstance(e, smtplib.SMTPException) and not isinstance(e, smtplib.SMTPServerDisconnected):
+                        raise
+                    self._quit(server)
+                    server = self._connect()
+                    server.send_message(msg)
+                sent += 1
+        except Exception as e:
+            self._quit(server)
+            # 已送达的邮件不能再重试，否则收件人会收到重复的验证码
+            raise MailBatchError(sent, e) from e
+        self._release(server)
+
+    def close(self):
+        while True:
+            try:
+                self._quit(self._pool.get_nowait())
+            except queue.Empty:
+                break
+
+
+class MailQueue:
+    """
+    进程内异步邮件队列。
+
+    enqueue 立即返回；后台 worker 每次最多取 batch_size 封邮件交给后端发送，
+    失败的邮件按指数退避 + 抖动重新入队，超过 max_retries 后丢弃并打印。
+    """
+
+    def __init__(self, backend: MailBackend, maxsize: int = 10000, workers: int = 2,
+                 batch_size: int = 20, max_retries: int = 5,
+                 backoff_base: float = 1.0, backoff_max: float = 60.0):
+        self.backend = backend
+        self.maxsize = maxsize
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        # 等待重试的邮件（退避中），stop 时立即放回队列发送
+        self._retry_tasks: Dict[asyncio.Task, MailMessage] = {}
+        self._stopping = False
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    def enqueue(self, to: str, subject: str, body: str) -> bool:
+        if self._queue is None:
+            raise RuntimeError("mail queue not started")
+        try:
+            self._queue.put_nowait(MailMessage(to=to, subject=subject, body=body))
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+
+    async def start(self) -> None:
+        if self._tasks:
+            return
+        self._stopping = False
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """尽量把队列中剩余的邮件（含退避中等待重试的）发完，再停止 worker；没发完的计入 dropped。"""
+        if not self._tasks:
+            return
+        # 之后的失败不再退避，立即重新入队，直到超过 max_retries
+        self._stopping = True
+        for task, message in list(self._retry_tasks.items()):
+            task.cancel()
+            self._put(message)
+        self._retry_tasks.clear()
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            self.dropped += self.pending
+            print(f"[MAIL] stop timeout, {self.pending} messages discarded")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await asyncio.to_thread(self.backend.close)
+
+    async def _next_batch(self) -> List[MailMessage]:
+        batch = [await self._queue.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        return batch
+
+    async def _worker(self) -> None:
+        while True:
+            batch = await self._next_batch()
+            try:
+                await asyncio.to_thread(self.backend.send_batch, batch)
+                self.sent += len(batch)
+            except MailBatchError as e:
+                self.sent += e.sent
+                rest = batch[e.sent:]
+                if rest and is_permanent_failure(e.error):
+                    # 出错的那一封被服务端明确拒绝，不再重试；后面的邮件还没发过，照常重试
+                    self.failed += 1
+                    print(f"[MAIL] rejected by server, not retrying {rest[0].to}: {e.error}")
+                    rest = rest[1:]
+                for message in rest:
+                    self._schedule_retry(message, e.error)
+            except Exception as e:
+                for message in batch:
+                    self._schedule_retry(message, e)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _schedule_retry(self, message: MailMessage, error: Exception) -> None:
+        message.attempts += 1
+        if message.attempts > self.max_retries:
+            self.failed += 1
+            print(f"[MAIL] give up sending to {message.to}: {error}")
+            return
+        if self._stopping:
+            self._put(message)
+            return
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (message.attempts - 1))
+        delay = random.uniform(0, delay)
+        task = asyncio.create_task(self._requeue_later(message, delay))
+        self._retry_tasks[task] = message
+        task.add_done_callback(lambda t: self._retry_tasks.pop(t, None))
+
+    def _put(self, message: MailMessage) -> None:
+        try:
+            self._queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def _requeue_later(self, message: MailMessage, delay: float) -> None:
+        await asyncio.sleep(delay)
+        self._put(message)
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.pending,
+            "retrying": len(self._retry_tasks),
+            "sent": self.sent,
+            "failed": self.failed,
+            "dropped": self.dropped,
+        }
+
+
+def create_mail_backend() -> MailBackend:
+    """根据环境变量 MAIL_BACKEND (smtp | memory | file) 创建后端。"""
+    kind = os.getenv("MAIL_BACKEND", "smtp")
+    if kind == "memory":
+        return MemoryMailBackend()
+    if kind == "file":
+        return FileMailBackend(os.getenv("MAIL_FILE", "logs/mail.jsonl"))
+    return SMTPMailBackend(
+        host=os.getenv("SMTP_HOST", "smtp.qq.com"),
+        port=int(os.getenv("SMTP_PORT", "465")),
+        sender=os.getenv("sender"),
+        password=os.getenv("SMTP"),
+        pool_size=int(os.getenv("SMTP_POOL_SIZE", "2")),
+    )
+
+
+mail_queue = MailQueue(
+    create_mail_backend(),
+    maxsize=int(os.getenv("MAIL_QUEUE_SIZE", "10000")),
+    workers=int(os.getenv("MAIL_WORKERS", "2")),
+    batch_size=int(os.getenv("MAIL_BATCH_SIZE", "20")),
+    max_retries=int(os.getenv("MAIL_MAX_RETRIES", "5")),
+)
+# AI_Amend 2026-10-17 启动后台发送队列，退出时尽量发完剩余邮件
+resources.register("mail_queue", mail_queue.start, mail_queue.stop)
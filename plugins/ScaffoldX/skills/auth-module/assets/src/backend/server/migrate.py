@@ -0,0 +1,309 @@
+# AI_Amend 2026-10-17 版本化迁移：schema_migrations 记录已执行版本，启动时一条查询即可判断是否已是最新
+"""
+用法（在项目包目录下）:
+
+    python -m <module>.server.migrate                  # 执行未应用的迁移（等同 upgrade）
+    python -m <module>.server.migrate status           # 当前版本与各迁移状态
+    python -m <module>.server.migrate upgrade --target 2
+    python -m <module>.server.migrate stamp            # 只记录版本不执行（库结构已手工变更过时使用）
+
+启动时 init_db() 只执行 SELECT MAX(version)：已是最新直接返回，启动耗时不随表数量增长；
+落后时 MIGRATE_ON_BOOT=1（默认）在启动时执行迁移，MIGRATE_ON_BOOT=0 只打印警告（由发布流程单独执行本命令）。
+
+- 空库：按当前模型 create_all 后直接记为最新版本，不逐条回放
+- 已有库（含此前由 create_all 建出、没有 schema_migrations 的库）：从 baseline 起依次执行未应用的迁移
+- 建索引：PostgreSQL 用 CREATE INDEX CONCURRENTLY（不锁写，需在事务外执行，上次中断留下的无效索引会先删掉重建），
+  MySQL 用 ALGORITHM=INPLACE LOCK=NONE，其它数据库用 CREATE INDEX IF NOT EXISTS
+- PostgreSQL / MySQL 上迁移期间持有数据库级锁，SQLite 文件库持有 <db>.migrate.lock 文件锁（flock / msvcrt.locking），
+  多个 worker 同时启动时只有一个执行，其余等待后跳过；其它数据库上并发写入同一版本记录视为其它进程已完成
+
+新增迁移：在 MIGRATIONS 末尾追加 Migration(版本号 + 1, 名称, 函数)，函数接收 Connection。
+baseline 会按最新模型补建缺失的表，因此迁移应可重复执行（加列 / 建索引前先检查是否已存在）。
+"""
+import argparse
+import os
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable, List, Optional, Sequence
+
+try:
+    import fcntl
+    msvcrt = None
+except ImportError:  # Windows 上没有 fcntl，改用 msvcrt.locking
+    fcntl = None
+    import msvcrt
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import DBAPIError, IntegrityError, OperationalError
+from sqlmodel import SQLModel
+
+from .auth import models  # 导入即把全部表注册到 SQLModel.metadata
+
+LOCK_KEY = 7_305_912_114  # pg_advisory_lock 的任意固定键
+LOCK_NAME = "schema_migrations"
+
+schema_migrations = Table(
+    "schema_migrations",
+    MetaData(),
+    Column("version", Integer, primary_key=True, autoincrement=False),
+    Column("name", String(128), nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+    Column("duration_ms", Integer, nullable=False),
+)
+
+
+@dataclass
+class Migration:
+    version: int
+    name: str
+    upgrade: Callable[[Connection], None]
+    # False 时在 AUTOCOMMIT 连接上执行（PostgreSQL 的 CREATE INDEX CONCURRENTLY 不能放在事务里）
+    transactional: bool = True
+
+
+def create_index(conn: Connection, name: str, table: str, columns: Sequence[str]) -> None:
+    """在线建索引，已存在时跳过。PostgreSQL 上须在 AUTOCOMMIT 连接上调用。"""
+    quote = conn.dialect.identifier_preparer.quote
+    cols = ", ".join(quote(c) for c in columns)
+    dialect = conn.dialect.name
+    if dialect == "postgresql":
+        valid = conn.execute(
+            text("SELECT i.indisvalid FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid WHERE c.relname = :name"),
+            {"name": name},
+        ).scalar()
+        if valid is False:
+            # 上次 CONCURRENTLY 中途失败会留下无效索引，IF NOT EXISTS 会把它当成已存在
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {quote(name)}"))
+        conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {quote(name)} ON {quote(table)} ({cols})"))
+    elif dialect in ("mysql", "mariadb"):
+        if name in {ix["name"] for ix in inspect(conn).get_indexes(table)}:
+            return
+        conn.execute(text(f"CREATE INDEX {quote(name)} ON {quote(table)} ({cols}) ALGORITHM=INPLACE LOCK=NONE"))
+    else:
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {quote(name)} ON {quote(table)} ({cols})"))
+
+
+def _baseline(conn: Connection) -> None:
+    # 此前由 create_all 建出的库：补建缺失的表（已有表不做改动）
+    SQLModel.metadata.create_all(conn)
+
+
+def _composite_indexes(conn: Connection) -> None:
+    # create_all 不会给已有表补索引，这里补齐验证码 / 订单 / 积分流水的复合索引
+    create_index(conn, "ix_emailregistercode_email_code_used", "emailregistercode", ("email", "code", "used"))
+    create_index(conn, "ix_passwordresetcode_user_id_code_used", "passwordresetcode", ("user_id", "code", "used"))
+    create_index(conn, "ix_phonelogincode_phone_code_used", "phonelogincode", ("phone", "code", "used"))
+    create_index(conn, "ix_order_created_at_id", "order", ("created_at", "id"))
+    create_index(conn, "ix_order_user_id_created_at_id", "order", ("user_id", "created_at", "id"))
+    create_index(conn, "ix_pointstransaction_user_id_created_at_id", "pointstransaction",
+                 ("user_id", "created_at", "id"))
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "baseline", _baseline),
+    Migration(2, "composite_indexes", _composite_indexes, transactional=False),
+]
+HEAD = MIGRATIONS[-1].version
+
+
+def current_version(engine: Engine) -> Optional[int]:
+    """已执行的最高版本；schema_migrations 不存在时返回 None。只执行一条查询，不反射表结构。"""
+    with engine.connect() as conn:
+        try:
+            return conn.execute(select(func.max(schema_migrations.c.version))).scalar() or 0
+        except DBAPIError:
+            return None
+
+
+def applied_versions(conn: Connection) -> set:
+    return set(conn.execute(select(schema_migrations.c.version)).scalars())
+
+
+@contextmanager
+def _sqlite_file_lock(engine: Engine):
+    database = engine.url.database
+    if not database or database == ":memory:" or engine.url.query.get("mode") == "memory":
+        yield
+        return
+    with open(f"{database}.migrate.lock", "a+") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)  # LK_LOCK 最多重试 10 秒后抛 OSError
+                    break
+                except OSError:
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def migration_lock(engine: Engine):
+    """PostgreSQL / MySQL 上的会话级锁（SQLite 用文件锁），保证同一时刻只有一个进程在迁移。"""
+    dialect = engine.dialect.name
+    if dialect == "sqlite":
+        with _sqlite_file_lock(engine):
+            yield
+        return
+    if dialect not in ("postgresql", "mysql", "mariadb"):
+        yield
+        return
+    with engine.connect() as conn:
+        if dialect == "postgresql":
+            conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": LOCK_KEY})
+        else:
+            # 1 = 拿到锁，0 = 超时，NULL = 出错；没拿到时不能继续迁移
+            got = conn.execute(text("SELECT GET_LOCK(:name, 600)"), {"name": LOCK_NAME}).scalar()
+            if got != 1:
+                raise RuntimeError(f"could not acquire migration lock {LOCK_NAME!r} (GET_LOCK returned {got})")
+        conn.commit()
+        try:
+            yield
+        finally:
+            if dialect == "postgresql":
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": LOCK_KEY})
+            else:
+                conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": LOCK_NAME})
+            conn.commit()
+
+
+def _record(conn: Connection, migration: Migration, duration_ms: int = 0) -> None:
+    applied_at = datetime.now(timezone.utc).replace(tzinfo=None)  # 列是无时区的 DateTime，按 UTC 存
+    conn.execute(schema_migrations.insert().values(
+        version=migration.version, name=migration.name, applied_at=applied_at, duration_ms=duration_ms,
+    ))
+
+
+def _run(engine: Engine, migration: Migration) -> int:
+    started = time.perf_counter()
+    if migration.transactional:
+        with engine.begin() as conn:
+            migration.upgrade(conn)
+            _record(conn, migration, int((time.perf_counter() - started) * 1000))
+    else:
+        with engine.connect() as conn:
+            conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+            migration.upgrade(conn)
+            _record(conn, migration, int((time.perf_counter() - started) * 1000))
+    return int((time.perf_counter() - started) * 1000)
+
+
+def _wait_for_version(engine: Engine, version: int, timeout: float = 60.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if (current_version(engine) or 0) >= version:
+            return True
+        time.sleep(0.2)
+    return False
+
+
+def upgrade(engine: Engine, target: Optional[int] = None) -> List[int]:
+    """执行版本 <= target 的未应用迁移，返回本次执行的版本号。"""
+    target = HEAD if target is None else target
+    with migration_lock(engine):
+        try:
+            schema_migrations.create(engine, checkfirst=True)
+        except OperationalError:
+            if current_version(engine) is None:
+                raise  # 不是并发建表（表已存在）导致的失败
+        with engine.connect() as conn:
+            applied = applied_versions(conn)  # 拿到锁后重新读取，其它进程可能刚迁移完
+            fresh = not applied and not inspect(conn).has_table(models.User.__tablename__)
+        if fresh and target == HEAD:
+            # 空库：按当前模型建表（含全部索引），直接记为最新版本
+            try:
+                with engine.begin() as conn:
+                    SQLModel.metadata.create_all(conn)
+                    for migration in MIGRATIONS:
+                        _record(conn, migration)
+            except (IntegrityError, OperationalError):
+                # 没有锁保护时另一个进程抢先建库（重复的版本记录 / 表已存在）：等它记完版本
+                if not _wait_for_version(engine, HEAD):
+                    raise
+                print("[MIGRATE] schema was created by another process")
+                return []
+            print(f"[MIGRATE] created schema at version {HEAD}")
+            return [m.version for m in MIGRATIONS]
+        done = []
+        for migration in MIGRATIONS:
+            if migration.version in applied or migration.version > target:
+                continue
+            try:
+                duration_ms = _run(engine, migration)
+            except IntegrityError:
+                with engine.connect() as conn:
+                    if migration.version not in applied_versions(conn):
+                        raise
+                continue  # 另一个进程已记录该版本
+            print(f"[MIGRATE] {migration.version} {migration.name}: {duration_ms}ms")
+            done.append(migration.version)
+        return done
+
+
+def stamp(engine: Engine, target: Optional[int] = None) -> List[int]:
+    """把版本 <= target 的迁移记为已执行，不运行迁移本身。"""
+    target = HEAD if target is None else target
+    schema_migrations.create(engine, checkfirst=True)
+    with engine.begin() as conn:
+        applied = applied_versions(conn)
+        pending = [m for m in MIGRATIONS if m.version not in applied and m.version <= target]
+        for migration in pending:
+            _record(conn, migration)
+    return [m.version for m in pending]
+
+
+def ensure_schema(engine: Engine) -> None:
+    """启动时调用：已是最新时只有一条查询；否则按 MIGRATE_ON_BOOT 执行迁移或只告警。"""
+    version = current_version(engine)
+    if version == HEAD:
+        return
+    if version is not None and version > HEAD:
+        print(f"[MIGRATE] database is at version {version}, newer than this code ({HEAD})")
+        return
+    if os.getenv("MIGRATE_ON_BOOT", "1") == "1":
+        upgrade(engine)
+    else:
+        print(f"[MIGRATE] database is at version {version or 0}, head is {HEAD}; "
+              f"run `python -m {__package__}.migrate` to upgrade")
+
+
+def status(engine: Engine) -> str:
+    schema_migrations.create(engine, checkfirst=True)
+    with engine.connect() as conn:
+        rows = {r.version: r for r in conn.execute(select(schema_migrations))}
+    lines = [f"head: {HEAD}, current: {max(rows, default=0)}"]
+    for migration in MIGRATIONS:
+        row = rows.get(migration.version)
+        state = f"applied {row.applied_at:%Y-%m-%d %H:%M:%S} ({row.duration_ms}ms)" if row else "pending"
+        lines.append(f"{migration.version:>4}  {migration.name:<24} {state}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    from .db import engine
+
+    parser = argparse.ArgumentParser(description="Apply versioned schema migrations.")
+    parser.add_argument("command", nargs="?", choices=["upgrade", "status", "stamp"], default="upgrade")
+    parser.add_argument("--target", type=int, default=None, help=f"Stop at this version [default: head = {HEAD}].")
+    args = parser.parse_args()
+
+    if args.command == "status":
+        print(status(engine))
+    elif args.command == "stamp":
+        print(f"stamped: {stamp(engine, args.target) or 'nothing'}")
+    else:
+        started = time.perf_counter()
+        applied = upgrade(engine, args.target)
+        print(f"applied: {applied or 'nothing'} in {time.perf_counter() - started:.3f}s")
@@ -0,0 +1,25 @@
+# AI_Amend 2026-10-17 server 模块的回归测试：backend/ 复制到 src/<module>/ 下，包名随项目而定，这里按文件定位
+import importlib
+import os
+import tempfile
+from pathlib import Path
+
+import pytest
+
+# 导入 server 之前固定测试环境：临时 SQLite 库、内存发信后端，不连外部服务
+_tmp = tempfile.mkdtemp(prefix="auth-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_tmp}/test.db")
+os.environ.setdefault("DB_ECHO", "0")
+os.environ.setdefault("MAIL_BACKEND", "memory")
+os.environ.setdefault("CODE_STORE", "memory")
+
+SRC = Path(__file__).resolve().parents[1] / "src"
+PACKAGE = next((p.parents[2].name for p in SRC.glob("*/server/auth/points.py")), None)
+
+
+@pytest.fixture
+def server_module():
+    """server_module("auth.codes") -> <module>.server.auth.codes"""
+    if PACKAGE is None:
+        pytest.skip("src/<module>/server not found")
+    return lambda name: importlib.import_module(f"{PACKAGE}.server.{name}")
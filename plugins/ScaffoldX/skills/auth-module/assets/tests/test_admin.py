@@ -0,0 +1,57 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from urllib.parse import parse_qs, quote, urlsplit
+from uuid import uuid4
+
+import pytest
+from fastapi import FastAPI
+from sqladmin import Admin
+from starlette.datastructures import URL
+from starlette.requests import Request
+
+
+@pytest.fixture
+def order_admin(server_module):
+    db = server_module("db")
+    db.init_db()
+    models = server_module("auth.models")
+    admin_module = server_module("auth.admin")
+    user_id = uuid4()
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    with db.Session(db.engine) as session:
+        session.add(models.User(id=user_id, email=f"{user_id.hex}@example.com", hashed_password="x"))
+        session.commit()
+        session.add_all([
+            models.Order(user_id=user_id, status="paid", total_amount=i, created_at=start + timedelta(minutes=i))
+            for i in range(5)
+        ])
+        session.commit()
+    admin = Admin(FastAPI(), db.engine)
+    admin.add_view(admin_module.OrderAdmin)
+    return admin.views[0], user_id
+
+
+def _list(view, query):
+    request = Request({"type": "http", "method": "GET", "path": "/admin/order/list", "headers": [],
+                       "query_string": query.encode(), "server": ("test", 80), "scheme": "http", "root_path": ""})
+    return asyncio.run(view.list(request))
+
+
+def test_sort_toggle_ignores_cursor_from_other_direction(order_admin):
+    view, user_id = order_admin
+    first = _list(view, f"user_id={user_id}&pageSize=2")
+    assert [o.total_amount for o in first.rows] == [4, 3]
+    after = quote(first.next_cursor)
+
+    second = _list(view, f"user_id={user_id}&pageSize=2&page=2&after={after}")
+    assert [o.total_amount for o in second.rows] == [2, 1]
+
+    # 点击表头切到升序：链接保留了降序的 after，应从升序第一页开始
+    toggled = _list(view, f"user_id={user_id}&pageSize=2&page=2&after={after}&sortBy=created_at&sort=asc")
+    assert toggled.page == 1
+    assert [o.total_amount for o in toggled.rows] == [0, 1]
+    toggled.add_pagination_urls(URL(f"http://test/admin/order/list?after={after}&sortBy=created_at&sort=asc"))
+    next_query = parse_qs(urlsplit(toggled.next_page.url).query)
+    assert next_query["after"][0].startswith("a~")
+    assert _list(view, f"user_id={user_id}&pageSize=2&page=2&after={quote(next_query['after'][0])}"
+                       "&sortBy=created_at&sort=asc").rows[0].total_amount == 2
@@ -0,0 +1,86 @@
+import csv
+import json
+from uuid import uuid4
+
+import pytest
+from sqlalchemy import func, select
+
+
+@pytest.fixture
+def bulk(server_module):
+    server_module("db").init_db()
+    return server_module("bulk")
+
+
+def _write_jsonl(path, records):
+    path.write_text("".join(json.dumps(r) + "\n" for r in records), encoding="utf-8")
+    return str(path)
+
+
+def _users(bulk, ids):
+    models = bulk.MODELS["users"]
+    with bulk.engine.connect() as conn:
+        return {str(row.id): row for row in conn.execute(select(models.__table__).where(models.id.in_(ids)))}
+
+
+def test_users_round_trip_and_skip_existing(bulk, tmp_path):
+    ids = [uuid4() for _ in range(3)]
+    source = _write_jsonl(tmp_path / "users.jsonl", [
+        {"id": str(ids[0]), "email": f"{ids[0].hex}@example.com", "hashed_password": "hash-0", "points": 7},
+        {"id": str(ids[1]), "email": f"{ids[1].hex}@example.com", "hashed_password": "hash-1", "is_active": False},
+        {"id": str(ids[2]), "email": f"{ids[2].hex}@example.com", "password": "secret"},
+    ])
+    assert bulk.import_file("users", source, chunk_size=2, hash_workers=1)["rows"] == 3
+    rows = _users(bulk, ids)
+    assert rows[str(ids[0])].points == 7 and rows[str(ids[0])].is_active
+    assert not rows[str(ids[1])].is_active
+    assert rows[str(ids[2])].hashed_password not in ("", "secret")
+
+    exported = tmp_path / "users.csv"
+    bulk.export_file("users", str(exported))
+    with open(exported, newline="", encoding="utf-8") as f:
+        by_id = {row["id"]: row for row in csv.DictReader(f)}
+    assert by_id[str(ids[0])]["hashed_password"] == "hash-0"
+
+    # 重复导入同一份导出：--skip-existing 跳过已存在的主键 / 邮箱，不报错也不改动
+    bulk.import_file("users", str(exported), skip_existing=True)
+    assert _users(bulk, ids)[str(ids[0])].points == 7
+    with pytest.raises(Exception):
+        bulk.import_file("users", str(exported))
+
+
+def test_orders_chunk_with_and_without_id_keeps_explicit_ids(bulk, tmp_path):
+    user_id = uuid4()
+    bulk.import_file("users", _write_jsonl(tmp_path / "u.jsonl", [
+        {"id": str(user_id), "email": f"{user_id.hex}@example.com", "hashed_password": "x"},
+    ]))
+    table = bulk.MODELS["orders"].__table__
+    source = _write_jsonl(tmp_path / "orders.jsonl", [
+        {"user_id": str(user_id), "status": "paid", "total_amount": 1},
+        {"id": 5000, "user_id": str(user_id), "status": "paid", "total_amount": 2},
+        {"user_id": str(user_id), "status": "new", "total_amount": 3},
+    ])
+    bulk.import_file("orders", source)
+    with bulk.engine.connect() as conn:
+        rows = conn.execute(select(table.c.id, table.c.total_amount).where(table.c.user_id == user_id)).all()
+    assert len(rows) == 3
+    assert (5000, 2) in [(row.id, row.total_amount) for row in rows]
+
+    exported = tmp_path / "orders.jsonl.out"
+    bulk.export_file("orders", str(exported), fmt="jsonl")
+    lines = [json.loads(line) for line in exported.read_text(encoding="utf-8").splitlines()]
+    assert {"id": 5000, "status": "paid", "total_amount": 2.0}.items() <= next(r for r in lines if r["id"] == 5000).items()
+
+
+def test_missing_required_column_names_row_and_column(bulk, tmp_path):
+    table = bulk.MODELS["orders"].__table__
+    with bulk.engine.connect() as conn:
+        before = conn.execute(select(func.count()).select_from(table)).scalar()
+    source = _write_jsonl(tmp_path / "orders.jsonl", [
+        {"user_id": str(uuid4()), "status": "paid", "total_amount": 1},
+        {"user_id": str(uuid4()), "status": "paid"},
+    ])
+    with pytest.raises(ValueError, match=r"orders? row 2: missing required column 'total_amount'"):
+        bulk.import_file("orders", source)
+    with bulk.engine.connect() as conn:
+        assert conn.execute(select(func.count()).select_from(table)).scalar() == before
@@ -0,0 +1,34 @@
+import asyncio
+
+import pytest
+
+
+@pytest.mark.parametrize("attempt", ["１２３４５６", "验证码", "123456\u200b"])
+def test_memory_store_rejects_non_ascii_codes(server_module, attempt):
+    codes = server_module("auth.codes")
+    store = codes.MemoryCodeStore()
+
+    async def main():
+        await store.issue(codes.PURPOSE_REGISTER, "a@example.com", "123456", ttl_seconds=60)
+        return (
+            await store.verify(codes.PURPOSE_REGISTER, "a@example.com", attempt),
+            await store.consume(codes.PURPOSE_REGISTER, "a@example.com", attempt),
+            await store.consume(codes.PURPOSE_REGISTER, "a@example.com", "123456"),
+        )
+
+    assert asyncio.run(main()) == (False, False, True)
+
+
+def test_redis_store_rejects_non_ascii_codes(server_module):
+    fakeredis = pytest.importorskip("fakeredis")
+    codes = server_module("auth.codes")
+    store = codes.RedisCodeStore(fakeredis.FakeAsyncRedis(decode_responses=True))
+
+    async def main():
+        await store.issue(codes.PURPOSE_REGISTER, "a@example.com", "123456", ttl_seconds=60)
+        return (
+            await store.verify(codes.PURPOSE_REGISTER, "a@example.com", "１２３４５６"),
+            await store.verify(codes.PURPOSE_REGISTER, "a@example.com", "123456"),
+        )
+
+    assert asyncio.run(main()) == (False, True)
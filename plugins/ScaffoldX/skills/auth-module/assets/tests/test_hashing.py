@@ -0,0 +1,59 @@
+import asyncio
+import os
+import signal
+
+import pytest
+from fastapi import HTTPException
+
+
+def test_default_workers_split_cpu_between_web_workers(server_module, monkeypatch):
+    hashing = server_module("auth.hashing")
+    monkeypatch.setattr(os, "cpu_count", lambda: 8)
+    monkeypatch.setenv("WEB_CONCURRENCY", "4")
+    assert hashing.default_workers() == 2
+    monkeypatch.setenv("WEB_CONCURRENCY", "16")
+    assert hashing.default_workers() == 1
+    monkeypatch.setenv("WEB_CONCURRENCY", "auto")
+    assert hashing.default_workers() == 1
+    monkeypatch.setenv("WEB_CONCURRENCY", "four")  # 写错时按 1 个 web worker 处理，不让 import 失败
+    assert hashing.default_workers() == 8
+
+
+def test_broken_pool_is_recreated(server_module):
+    hasher = server_module("auth.hashing").AsyncPasswordHelper(workers=1)
+
+    async def main():
+        first = await hasher.hash("password")
+        for pid in list(hasher._executor._processes):
+            os.kill(pid, signal.SIGKILL)  # 模拟子进程被 OOM killer 杀掉
+        await asyncio.sleep(0.2)
+        second = await hasher.hash("password")
+        ok, _ = await hasher.verify_and_update("password", second)
+        return first, ok
+
+    try:
+        first, ok = asyncio.run(main())
+    finally:
+        hasher.shutdown()
+    assert first and ok
+
+
+def test_failures_and_rejections_are_not_counted_as_completed(server_module):
+    hashing = server_module("auth.hashing")
+    hasher = hashing.AsyncPasswordHelper(workers=1, max_pending=1)
+
+    async def main():
+        assert await hasher.hash("password")
+        with pytest.raises(Exception):
+            await hasher.verify_and_update("password", "not-a-hash")
+        hasher.pending = hasher.max_pending  # 模拟在途任务已满
+        with pytest.raises(HTTPException):
+            await hasher.hash("password")
+        hasher.pending = 0
+
+    try:
+        asyncio.run(main())
+    finally:
+        hasher.shutdown()
+    stats = hasher.stats()
+    assert (stats["completed"], stats["failed"], stats["rejected"]) == (1, 1, 1)
@@ -0,0 +1,86 @@
+import asyncio
+import smtplib
+
+
+class FakeSMTP:
+    """
+    记录送达的收件人；第 n 次调用（从 1 开始）在 fail_on 中时抛出 SMTPDataError（451，可重试），
+    收件人在 refuse 中时抛出 SMTPRecipientsRefused（550）。
+    """
+
+    def __init__(self, state: dict):
+        self.state = state
+
+    def send_message(self, msg):
+        self.state["calls"] += 1
+        self.state.setdefault("attempts", []).append(msg["To"])
+        if self.state["calls"] in self.state["fail_on"]:
+            raise smtplib.SMTPDataError(451, b"temporary failure")
+        if msg["To"] in self.state.get("refuse", ()):
+            raise smtplib.SMTPRecipientsRefused({msg["To"]: (550, b"no such user")})
+        self.state["delivered"].append(msg["To"])
+
+    def quit(self):
+        pass
+
+
+def _smtp_backend(mail, state):
+    backend = mail.SMTPMailBackend("localhost", 465, "sender@example.com", "secret")
+    backend._connect = lambda: FakeSMTP(state)
+    return backend
+
+
+def test_partial_batch_failure_retries_only_unsent(server_module):
+    mail = server_module("mail")
+    state = {"calls": 0, "fail_on": {3}, "delivered": []}
+    queue = mail.MailQueue(_smtp_backend(mail, state), workers=1, batch_size=5,
+                           backoff_base=0.01, backoff_max=0.01)
+
+    async def main():
+        await queue.start()
+        for i in range(5):
+            queue.enqueue(f"user{i}@example.com", "code", "123456")
+        await queue.stop()
+
+    asyncio.run(main())
+    assert sorted(state["delivered"]) == [f"user{i}@example.com" for i in range(5)]
+    assert queue.stats()["sent"] == 5
+
+
+def test_stop_flushes_pending_retries(server_module):
+    mail = server_module("mail")
+    state = {"calls": 0, "fail_on": {1}, "delivered": []}
+    # 退避远大于 stop 的等待时间：不 flush 的话这封邮件会被静默丢弃
+    queue = mail.MailQueue(_smtp_backend(mail, state), workers=1,
+                           backoff_base=60, backoff_max=60)
+
+    async def main():
+        await queue.start()
+        queue.enqueue("user@example.com", "code", "123456")
+        while not queue._retry_tasks:
+            await asyncio.sleep(0.01)
+        await queue.stop(timeout=5)
+
+    asyncio.run(main())
+    assert state["delivered"] == ["user@example.com"]
+    assert queue.stats()["dropped"] == 0
+
+
+def test_refused_recipient_is_not_resent(server_module):
+    mail = server_module("mail")
+    refused = "user2@example.com"
+    state = {"calls": 0, "fail_on": set(), "refuse": {refused}, "delivered": []}
+    queue = mail.MailQueue(_smtp_backend(mail, state), workers=1, batch_size=5,
+                           backoff_base=0.01, backoff_max=0.01)
+
+    async def main():
+        await queue.start()
+        for i in range(5):
+            queue.enqueue(f"user{i}@example.com", "code", "123456")
+        await queue.stop()
+
+    asyncio.run(main())
+    assert state["attempts"].count(refused) == 1  # 不重连重发，也不进退避重试
+    assert sorted(state["delivered"]) == [f"user{i}@example.com" for i in range(5) if i != 2]
+    assert queue.stats()["sent"] == 4
+    assert queue.stats()["failed"] == 1
@@ -0,0 +1,147 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import create_engine, event, inspect, text
+from sqlmodel import SQLModel
+
+
+@pytest.fixture
+def migrate(server_module):
+    return server_module("migrate")
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'app.db'}")
+    yield engine
+    engine.dispose()
+
+
+def _indexes(engine, table):
+    return {ix["name"] for ix in inspect(engine).get_indexes(table)}
+
+
+@contextmanager
+def _count_queries(engine):
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+
+
+def test_fresh_database_is_created_at_head(migrate, engine):
+    assert migrate.current_version(engine) is None
+    assert migrate.upgrade(engine) == [m.version for m in migrate.MIGRATIONS]
+    assert migrate.current_version(engine) == migrate.HEAD
+    assert "ix_order_created_at_id" in _indexes(engine, "order")
+    with engine.connect() as conn:
+        applied_at = conn.execute(text("SELECT applied_at FROM schema_migrations")).scalars().all()
+    assert len(applied_at) == len(migrate.MIGRATIONS) and all(applied_at)
+    assert migrate.upgrade(engine) == []
+
+
+def test_legacy_create_all_database_is_upgraded(migrate, engine):
+    SQLModel.metadata.create_all(engine)  # 引入迁移之前由 create_all 建出的库
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX ix_order_created_at_id"))
+        conn.execute(text("DROP INDEX ix_emailregistercode_email_code_used"))
+    assert migrate.upgrade(engine) == [1, 2]
+    assert "ix_order_created_at_id" in _indexes(engine, "order")
+    assert "ix_emailregistercode_email_code_used" in _indexes(engine, "emailregistercode")
+    assert migrate.current_version(engine) == migrate.HEAD
+
+
+def test_ensure_schema_at_head_runs_one_query(migrate, engine, monkeypatch):
+    monkeypatch.setenv("MIGRATE_ON_BOOT", "1")
+    migrate.ensure_schema(engine)
+    assert migrate.current_version(engine) == migrate.HEAD
+    with _count_queries(engine) as statements:
+        migrate.ensure_schema(engine)
+    assert len(statements) == 1 and "max" in statements[0].lower()
+
+
+def test_ensure_schema_without_migrate_on_boot_only_warns(migrate, engine, monkeypatch, capsys):
+    monkeypatch.setenv("MIGRATE_ON_BOOT", "0")
+    migrate.ensure_schema(engine)
+    assert migrate.current_version(engine) is None
+    assert "head is" in capsys.readouterr().out
+
+
+def test_sqlite_file_lock_serialises_migrations(migrate, engine, tmp_path):
+    events = []
+
+    def hold():
+        with migrate.migration_lock(engine):
+            events.append("first acquired")
+            time.sleep(0.2)
+            events.append("first released")
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    while not events:
+        time.sleep(0.01)
+    with migrate.migration_lock(engine):
+        events.append("second acquired")
+    thread.join()
+    assert events == ["first acquired", "first released", "second acquired"]
+    assert (tmp_path / "app.db.migrate.lock").exists()
+
+
+def test_memory_database_takes_no_file_lock(migrate, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    engine = create_engine("sqlite://")
+    with migrate.migration_lock(engine):
+        pass
+    assert list(tmp_path.iterdir()) == []
+
+
+class _FakeMySQL:
+    """只响应 GET_LOCK / RELEASE_LOCK 的假 MySQL 引擎。"""
+
+    class dialect:
+        name = "mysql"
+
+    def __init__(self, get_lock_result):
+        self.get_lock_result = get_lock_result
+        self.statements = []
+
+    @contextmanager
+    def connect(self):
+        fake = self
+
+        class Result:
+            def __init__(self, value):
+                self.value = value
+
+            def scalar(self):
+                return self.value
+
+        class Conn:
+            def execute(self, statement, params=None):
+                fake.statements.append(str(statement))
+                return Result(fake.get_lock_result if "GET_LOCK" in str(statement) else 1)
+
+            def commit(self):
+                pass
+
+        yield Conn()
+
+
+@pytest.mark.parametrize("result", [0, None])
+def test_mysql_lock_not_acquired_raises(migrate, result):
+    engine = _FakeMySQL(result)
+    with pytest.raises(RuntimeError, match="could not acquire migration lock"):
+        with migrate.migration_lock(engine):
+            pytest.fail("migrated without holding the lock")
+
+
+def test_mysql_lock_released_after_migration(migrate):
+    engine = _FakeMySQL(1)
+    with migrate.migration_lock(engine):
+        pass
+    assert any("RELEASE_LOCK" in s for s in engine.statements)
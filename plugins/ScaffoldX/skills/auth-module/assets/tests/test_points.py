@@ -0,0 +1,53 @@
+import asyncio
+from uuid import uuid4
+
+import pytest
+
+
+@pytest.fixture
+def points(server_module):
+    server_module("db").init_db()
+    return server_module("auth.points")
+
+
+async def _create_user(server_module) -> object:
+    models = server_module("auth.models")
+    async with server_module("db").async_session_maker() as session:
+        user = models.User(email=f"{uuid4().hex}@example.com", hashed_password="x")
+        session.add(user)
+        await session.commit()
+        return user.id
+
+
+def test_stop_during_flush_writes_the_batch(points, server_module):
+    batcher = points.PointsBatcher(interval=0.01)
+    write = batcher._write
+    writing = asyncio.Event()
+
+    async def slow_write(batch):
+        writing.set()
+        await asyncio.sleep(0.2)
+        await write(batch)
+
+    batcher._write = slow_write
+
+    async def main():
+        user_id = await _create_user(server_module)
+        await batcher.start()
+        adds = [asyncio.create_task(batcher.add(user_id, 1, reason="like")) for _ in range(5)]
+        await writing.wait()
+        later = asyncio.create_task(batcher.add(user_id, 1, reason="like"))  # 写入进行中到达，由 stop 写完
+        await asyncio.sleep(0)
+        await batcher.stop()
+        results = await asyncio.wait_for(asyncio.gather(*adds, later), 5)
+        async with server_module("db").async_session_maker() as session:
+            return results, await points._balance(session, user_id)
+
+    results, balance = asyncio.run(main())
+    assert all(r.applied for r in results)
+    assert balance == 6
+
+
+def test_missing_user_raises_user_not_found(points):
+    with pytest.raises(points.UserNotFound):
+        asyncio.run(points.add_points(uuid4(), 1, reason="like"))
@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+
+
+@pytest.fixture
+def ratelimit(server_module):
+    return server_module("auth.ratelimit")
+
+
+def test_rejected_request_does_not_consume_other_rules(ratelimit):
+    limiter = ratelimit.MemoryRateLimiter()
+    minute, hour = ratelimit.parse_limits("2/minute,3/hour")
+    checks = [("k:minute", minute), ("k:hour", hour)]
+
+    assert limiter.hit_all_nowait(checks, now=0) == 0
+    assert limiter.hit_all_nowait(checks, now=30) == 0
+    assert limiter.hit_all_nowait(checks, now=60) == 0
+    # 小时额度用完：之后每分钟来一次都被拒，分钟级额度不应被继续扣
+    for now in (120, 180, 240):
+        assert limiter.hit_all_nowait(checks, now=now) > 0
+    assert limiter.hit_nowait("k:minute", minute, now=240) == 0
+    assert limiter.hit_nowait("k:minute", minute, now=240) == 0
+    assert limiter.hit_nowait("k:minute", minute, now=240) > 0
+
+
+def test_retry_after_is_longest_wait(ratelimit):
+    limiter = ratelimit.MemoryRateLimiter()
+    minute, hour = ratelimit.parse_limits("1/minute,1/hour")
+    checks = [("k:minute", minute), ("k:hour", hour)]
+    assert limiter.hit_all_nowait(checks, now=0) == 0
+    assert limiter.hit_all_nowait(checks, now=1) == pytest.approx(3599)
+
+
+def test_redis_rejected_request_does_not_consume_other_rules(ratelimit):
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    limiter = ratelimit.RedisRateLimiter(fakeredis.FakeAsyncRedis())
+    short, long = ratelimit.parse_limits("5/minute,1/hour")
+
+    async def main():
+        assert await limiter.hit_all([("a", short), ("b", long)]) == 0
+        assert await limiter.hit_all([("a", short), ("b", long)]) > 0
+        assert await limiter.hit_all([("a", short), ("b", long)]) > 0
+        # 被拒的两次没有扣 a 的额度：还剩 4 次
+        results = [await limiter.hit("a", short) for _ in range(5)]
+        return results
+
+    results = asyncio.run(main())
+    assert results[:4] == [0, 0, 0, 0] and results[4] > 0
@@ -252,7 +252,7 @@ ENV_PATH="$PROJECT_DIR/.venv"
   echo "安装pytest 测试相关需求包"
   uv add pytest anyio pytest-tornasync pytest-asyncio 
   echo "安装fastapi 相关包"
-  uv add fastapi uvicorn colorlog dotenv
+  uv add fastapi uvicorn colorlog dotenv httpx
   echo "安装 对齐本包"
   uv pip install -e .
 )
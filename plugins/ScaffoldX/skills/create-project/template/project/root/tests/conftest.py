@@ -0,0 +1,24 @@
+# AI_Amend 2026-10-17 server 模块的回归测试：模板复制到 src/<module>/ 下，包名随项目而定，这里按文件定位
+import importlib
+from pathlib import Path
+
+import pytest
+
+SRC = Path(__file__).resolve().parents[1] / "src"
+PACKAGE = next((p.parents[1].name for p in SRC.glob("*/server/scheduler.py")), None)
+
+
+@pytest.fixture
+def server_module():
+    """server_module("scheduler") -> <module>.server.scheduler"""
+    if PACKAGE is None:
+        pytest.skip("src/<module>/server not found")
+    return lambda name: importlib.import_module(f"{PACKAGE}.server.{name}")
+
+
+@pytest.fixture
+def project_module():
+    """project_module("log") -> <module>.log"""
+    if PACKAGE is None:
+        pytest.skip("src/<module> not found")
+    return lambda name: importlib.import_module(f"{PACKAGE}.{name}")
@@ -0,0 +1,82 @@
+import asyncio
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+
+def _app(cache_module, **middleware):
+    app = FastAPI()
+    cache = cache_module.ResponseCache(cache_module.MemoryCacheBackend(16), default_ttl=60)
+    calls = {"n": 0}
+
+    @app.get("/items/{item_id}")
+    @cache_module.cached(tags=["item:{item_id}", "owner:{owner}"], cache=cache)
+    async def get_item(item_id: int):
+        calls["n"] += 1
+        return {"id": item_id, "n": calls["n"]}
+
+    @app.get("/metrics")
+    async def metrics():
+        calls["n"] += 1
+        return {"n": calls["n"]}
+
+    if middleware:
+        app.add_middleware(cache_module.CacheMiddleware, cache=cache, **middleware)
+    return app, calls
+
+
+def test_missing_tag_param_does_not_fail(server_module):
+    app, calls = _app(server_module("cache"))
+    client = TestClient(app)
+    first = client.get("/items/1")
+    assert first.status_code == 200
+    assert first.headers["cache-control"].startswith("private")
+    assert client.get("/items/1").headers["x-cache"] == "HIT"
+    assert calls["n"] == 1
+
+
+def test_credentials_bypass_cache(server_module):
+    app, calls = _app(server_module("cache"))
+    client = TestClient(app)
+    assert client.get("/items/1", headers={"Authorization": "Bearer a"}).json()["n"] == 1
+    assert client.get("/items/1", headers={"Authorization": "Bearer b"}).json()["n"] == 2
+    assert "x-cache" not in client.get("/items/1", headers={"Cookie": "s=1"}).headers
+
+
+def test_middleware_caches_nothing_by_default(server_module):
+    app, calls = _app(server_module("cache"), ttl=30)
+    client = TestClient(app)
+    assert client.get("/metrics").json() != client.get("/metrics").json()
+
+
+def test_zero_ttl_is_not_the_default(server_module):
+    cache_module = server_module("cache")
+    middleware = cache_module.CacheMiddleware(None, prefixes=("/",), ttl=0)
+    assert middleware.ttl == 0
+
+
+def test_cancelled_leader_does_not_fail_coalesced_waiters(server_module):
+    cache_module = server_module("cache")
+    cache = cache_module.ResponseCache(cache_module.MemoryCacheBackend(16), default_ttl=60)
+    calls = []
+
+    def producer(name):
+        async def produce():
+            calls.append(name)
+            await asyncio.sleep(0.05)
+            return cache_module.CachedResponse(status=200, body=name.encode(), media_type="text/plain", etag=name)
+        return produce
+
+    async def main():
+        leader = asyncio.create_task(cache.get_or_compute("k", producer("leader")))
+        await asyncio.sleep(0.01)
+        follower = asyncio.create_task(cache.get_or_compute("k", producer("follower")))
+        await asyncio.sleep(0.01)
+        leader.cancel()  # 客户端断开
+        value, status = await follower
+        assert leader.cancelled()
+        return value, status
+
+    value, status = asyncio.run(main())
+    assert value.body == b"follower" and status == "MISS"
+    assert calls == ["leader", "follower"]
@@ -0,0 +1,38 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import PACKAGE, SRC
+
+# SKILL.md「导入耗时预算」：import 包本身累计不超过 30ms，IMPORT_BUDGET_MS 可按机器放宽
+BUDGET_US = int(float(os.getenv("IMPORT_BUDGET_MS", "30")) * 1000)
+
+
+def _run(code, cwd, **env):
+    if PACKAGE is None:
+        pytest.skip("src/<module> not found")
+    full_env = {**os.environ, "PYTHONPATH": str(SRC), "SKIP_DOTENV": "1", **env}
+    return subprocess.run([sys.executable, *code], cwd=cwd, env=full_env,
+                          capture_output=True, text=True, check=True)
+
+
+def _cumulative_us(cwd) -> int:
+    result = _run(["-X", "importtime", "-c", f"import {PACKAGE}"], cwd)
+    # 最后一行是包本身："import time: self | cumulative | name"
+    last = [line for line in result.stderr.splitlines() if line.startswith("import time:")][-1]
+    return int(last.split("|")[1])
+
+
+def test_package_import_within_budget(tmp_path):
+    _cumulative_us(tmp_path)  # 首次运行生成 .pyc，不计入
+    best = min(_cumulative_us(tmp_path) for _ in range(3))
+    assert best <= BUDGET_US, f"import {PACKAGE} took {best}us (budget {BUDGET_US}us)"
+
+
+def test_server_import_respects_skip_dotenv(tmp_path):
+    (tmp_path / ".env").write_text("IMPORT_TIME_PROBE=from_dotenv\n", encoding="utf-8")
+    code = f"import os, {PACKAGE}.server.__main__; print(os.environ['IMPORT_TIME_PROBE'])"
+    result = _run(["-c", code], tmp_path, IMPORT_TIME_PROBE="from_env")
+    assert result.stdout.strip() == "from_env"
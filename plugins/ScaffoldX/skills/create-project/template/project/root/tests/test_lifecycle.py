@@ -0,0 +1,45 @@
+import asyncio
+import signal
+from contextlib import AsyncExitStack
+
+
+def test_sigterm_flips_readiness_before_previous_handler(server_module):
+    lifecycle = server_module("lifecycle")
+    registry = lifecycle.ResourceRegistry(warmup_enabled=False)
+    seen = []
+    original = signal.signal(signal.SIGTERM, lambda signum, frame: seen.append(registry.ready))
+
+    async def main():
+        async with AsyncExitStack() as stack:
+            await registry.start(stack)
+            assert registry.ready
+            signal.raise_signal(signal.SIGTERM)
+            assert not registry.ready
+        return signal.getsignal(signal.SIGTERM)
+
+    try:
+        restored = asyncio.run(main())
+    finally:
+        signal.signal(signal.SIGTERM, original)
+    assert seen == [False]  # 原处理函数（uvicorn）被调用时已经摘流
+    assert restored is not None and restored.__name__ == "<lambda>"
+
+
+def test_sigterm_drain_delays_previous_handler(server_module):
+    lifecycle = server_module("lifecycle")
+    registry = lifecycle.ResourceRegistry(warmup_enabled=False, drain_seconds=0.1)
+    seen = []
+    original = signal.signal(signal.SIGTERM, lambda signum, frame: seen.append(signum))
+
+    async def main():
+        async with AsyncExitStack() as stack:
+            await registry.start(stack)
+            signal.raise_signal(signal.SIGTERM)
+            assert not registry.ready and not seen
+            await asyncio.sleep(0.3)
+            assert seen == [signal.SIGTERM]
+
+    try:
+        asyncio.run(main())
+    finally:
+        signal.signal(signal.SIGTERM, original)
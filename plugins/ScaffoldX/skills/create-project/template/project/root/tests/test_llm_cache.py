@@ -0,0 +1,29 @@
+import asyncio
+
+
+def test_disk_tier_is_opt_in(server_module, monkeypatch):
+    llm_cache = server_module("llm_cache")
+    monkeypatch.delenv("LLM_CACHE_DISK_PATH", raising=False)
+    assert llm_cache.create_llm_cache().disk is None
+    monkeypatch.setenv("LLM_CACHE_DISK_PATH", "cache.sqlite3")
+    assert llm_cache.create_llm_cache().disk is not None
+
+
+def test_failed_disk_write_is_logged(server_module, capsys):
+    llm_cache = server_module("llm_cache")
+
+    class BrokenDisk:
+        def set(self, key, entry):
+            raise OSError("disk full")
+
+    cache = llm_cache.LLMResponseCache(llm_cache.MemoryTier(max_entries=4, max_bytes=1 << 20), BrokenDisk())
+
+    async def main():
+        cache.put("key", b'{"usage": {"total_tokens": 1}}', "application/json", stream=False)
+        await asyncio.gather(*cache._writes, return_exceptions=True)
+        await asyncio.sleep(0)
+
+    asyncio.run(main())
+    assert "disk write failed" in capsys.readouterr().out
+    assert not cache._writes
+    assert cache.memory.get("key", 0) is not None
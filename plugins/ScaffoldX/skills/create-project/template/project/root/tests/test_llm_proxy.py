@@ -0,0 +1,29 @@
+import asyncio
+
+import httpx
+import pytest
+
+
+def _upstream(llm_proxy, api_key, status):
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(status, json={})
+
+    upstream = llm_proxy.LLMUpstream("http://upstream.test/v1", api_key=api_key, http2=False, warmup_connections=2)
+    upstream.client = httpx.AsyncClient(base_url=upstream.base_url, transport=httpx.MockTransport(handler))
+    return upstream, calls
+
+
+def test_warmup_skipped_without_api_key(server_module):
+    upstream, calls = _upstream(server_module("llm_proxy"), None, 200)
+    asyncio.run(upstream.warmup())
+    assert calls == []
+
+
+def test_warmup_fails_on_error_status(server_module):
+    upstream, calls = _upstream(server_module("llm_proxy"), "sk-test", 401)
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(upstream.warmup())
+    assert len(calls) == 2
@@ -0,0 +1,191 @@
+import asyncio
+import inspect
+import logging
+import queue
+import time
+import warnings
+
+import pytest
+
+
+def test_snapshot_fingerprint_and_rate_limited_line(project_module, tmp_path, caplog):
+    log = project_module("log")
+    snapshotter = log.CrashSnapshotter(directory=str(tmp_path), burst=1, window=60)
+    logger = logging.getLogger("test_log")
+
+    @log.log_func(logger=logger, max_value_len=50, snapshotter=snapshotter)
+    def explode():
+        raise ValueError("x" * 10000)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", DeprecationWarning)  # 不再读取 TracebackException.exc_type
+        for _ in range(2):
+            try:
+                explode()
+            except ValueError:
+                pass
+        snapshotter.stop()
+
+    assert snapshotter.captured == 1 and snapshotter.suppressed == 1
+    assert len(list(tmp_path.glob("explode_ValueError_*.pkl"))) == 1
+    limited = [r.getMessage() for r in caplog.records if "rate-limited" in r.getMessage()]
+    assert len(limited) == 1 and len(limited[0]) < 200
+
+
+class _Recorder:
+    """替代 CrashSnapshotter，只记录 capture 调用。"""
+
+    def __init__(self):
+        self.errors = []
+
+    def capture(self, logger, func, e, exclude_keys, sensitive_keys, max_value_len):
+        self.errors.append((func.__name__, type(e).__name__))
+
+
+def test_log_func_preserves_function_kind(project_module):
+    log = project_module("log")
+    decorate = log.log_func(snapshotter=_Recorder())
+
+    async def coro():
+        return 1
+
+    async def agen():
+        yield 1
+
+    def gen():
+        yield 1
+
+    def plain():
+        return 1
+
+    assert inspect.iscoroutinefunction(decorate(coro))
+    assert inspect.isasyncgenfunction(decorate(agen))
+    assert inspect.isgeneratorfunction(decorate(gen))
+    wrapped = decorate(plain)
+    assert not inspect.iscoroutinefunction(wrapped) and wrapped() == 1
+    assert wrapped.__name__ == "plain"
+
+
+def test_log_func_async_generator_logs_once(project_module):
+    log = project_module("log")
+    recorder = _Recorder()
+
+    @log.log_func(snapshotter=recorder)
+    async def stream(n):
+        for i in range(n):
+            received = yield i
+            if received == "boom":
+                raise ValueError("boom")
+
+    async def main():
+        items = [item async for item in stream(3)]
+        assert items == [0, 1, 2] and recorder.errors == []
+        agen = stream(3)
+        assert await agen.__anext__() == 0
+        assert await agen.asend(None) == 1
+        with pytest.raises(ValueError):
+            await agen.asend("boom")
+        # 提前关闭不算异常
+        early = stream(3)
+        await early.__anext__()
+        await early.aclose()
+
+    asyncio.run(main())
+    assert recorder.errors == [("stream", "ValueError")]
+
+
+def test_log_func_generator_and_coroutine_log_once(project_module):
+    log = project_module("log")
+    recorder = _Recorder()
+
+    @log.log_func(snapshotter=recorder)
+    def numbers():
+        received = yield 1
+        yield received * 2
+        raise KeyError("done")
+
+    @log.log_func(snapshotter=recorder)
+    async def fail(n):
+        await asyncio.sleep(0)
+        raise RuntimeError(n)
+
+    gen = numbers()
+    assert next(gen) == 1
+    assert gen.send(21) == 42
+    with pytest.raises(KeyError):
+        next(gen)
+    for n in range(2):
+        with pytest.raises(RuntimeError):
+            asyncio.run(fail(n))
+    assert recorder.errors == [("numbers", "KeyError"), ("fail", "RuntimeError"), ("fail", "RuntimeError")]
+
+
+def test_struct_log_accepts_plain_callables(project_module, caplog):
+    log = project_module("log")
+    printed = []
+    log.struct_log(printed.append, "title", "content")
+    assert printed == ["title$content"]
+
+    caplog.set_level(logging.INFO)
+    log.struct_log(logging.getLogger("test_struct").info, "title", "content")
+    record = caplog.records[-1]
+    assert record.getMessage() == "title$content" and record.struct_title == "title"
+
+
+class _SlowHandler(logging.Handler):
+    def __init__(self, delay=0.005):
+        super().__init__()
+        self.delay = delay
+        self.messages = []
+
+    def emit(self, record):
+        time.sleep(self.delay)
+        self.messages.append(record.getMessage())
+
+
+def _record(i):
+    return logging.LogRecord("test_queue", logging.INFO, __file__, 0, "msg %d", (i,), None)
+
+
+def test_queue_drop_policy_counts_dropped(project_module):
+    log = project_module("log")
+    handler = log.BoundedQueueHandler(queue.Queue(maxsize=2), policy="drop")
+    for i in range(5):
+        handler.handle(_record(i))
+    assert handler.dropped == 3
+    assert [handler.queue.get_nowait().msg for _ in range(2)] == ["msg 0", "msg 1"]
+
+
+def test_queue_block_policy_waits_then_drops(project_module):
+    log = project_module("log")
+    handler = log.BoundedQueueHandler(queue.Queue(maxsize=1), policy="block", block_timeout=0.05)
+    handler.handle(_record(0))
+    started = time.monotonic()
+    handler.handle(_record(1))  # 没有消费者：等满 block_timeout 后丢弃
+    assert time.monotonic() - started >= 0.05
+    assert handler.dropped == 1
+
+    # 有消费者时阻塞等待腾出空间，不丢日志
+    slow = _SlowHandler()
+    handler.queue.get_nowait()
+    listener = log._DrainingQueueListener(handler.queue, slow)
+    handler.block_timeout = 5
+    listener.start()
+    for i in range(20):
+        handler.handle(_record(i))
+    listener.stop()
+    assert handler.dropped == 1
+    assert slow.messages == [f"msg {i}" for i in range(20)]
+
+
+def test_listener_stop_drains_full_queue(project_module):
+    log = project_module("log")
+    handler = log.BoundedQueueHandler(queue.Queue(maxsize=3), policy="drop")
+    slow = _SlowHandler(delay=0.02)
+    listener = log._DrainingQueueListener(handler.queue, slow)
+    for i in range(3):
+        handler.handle(_record(i))  # 队列已满，stop 放结束标记时不能抛 queue.Full
+    listener.start()
+    listener.stop()
+    assert handler.dropped == 0
+    assert slow.messages == ["msg 0", "msg 1", "msg 2"]
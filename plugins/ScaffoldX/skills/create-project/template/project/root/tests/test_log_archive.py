@@ -0,0 +1,97 @@
+import json
+import logging
+import os
+import subprocess
+import sys
+from logging.handlers import RotatingFileHandler
+
+from conftest import SRC
+
+
+def _json_logger(project_module, path):
+    log = project_module("log")
+    handler = RotatingFileHandler(path, backupCount=3, encoding="utf-8")
+    handler.setFormatter(log.JsonLinesFormatter())
+    logger = logging.getLogger(f"test_archive.{path}")
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(handler)
+    return log, logger, handler
+
+
+def test_json_sink_archive_query_round_trip(project_module, tmp_path):
+    log_archive = project_module("log_archive")
+    log, logger, handler = _json_logger(project_module, tmp_path / "app.jsonl")
+    logger.info("plain %s", "message")
+    log.struct_log(logger.warning, "checkout", "order=1")
+    try:
+        raise ValueError("bad")
+    except ValueError:
+        logger.exception("failed")
+    handler.doRollover()
+    logger.info("still in the live file")
+    handler.close()
+
+    entries = log_archive.archive_rotated(str(tmp_path), chunk_records=2)
+    assert [e["count"] for e in entries] == [2, 1]
+    assert not (tmp_path / "app.jsonl.1").exists() and (tmp_path / "app.jsonl").exists()
+
+    archive = str(tmp_path / "archive")
+    records = list(log_archive.query(archive))
+    assert [r["message"] for r in records] == ["plain message", "checkout$order=1", "failed"]
+    assert [r["message"] for r in log_archive.query(archive, title="checkout")] == ["checkout$order=1"]
+    (error,) = log_archive.query(archive, levels=["ERROR"])
+    assert "ValueError: bad" in error["exc"]
+    assert list(log_archive.query(archive, since=records[-1]["ts"] + 1)) == []
+
+
+def test_malformed_lines_are_skipped(project_module, tmp_path):
+    log_archive = project_module("log_archive")
+    (tmp_path / "app.jsonl.1").write_text("\n".join([
+        json.dumps({"ts": 1.0, "level": "INFO", "message": "ok"}),
+        '{"ts": 2.0, "level": "IN',  # 崩溃时写了半行
+        "[1, 2]",
+        '"just a string"',
+        json.dumps({"level": "INFO", "message": "no ts"}),
+        json.dumps({"ts": "yesterday", "message": "bad ts"}),
+    ]) + "\n", encoding="utf-8")
+    entries = log_archive.archive_rotated(str(tmp_path))
+    assert [e["count"] for e in entries] == [1]
+    assert [r["message"] for r in log_archive.query(str(tmp_path / "archive"))] == ["ok"]
+
+
+def test_recovers_claimed_leftovers_and_skips_indexed_sources(project_module, tmp_path):
+    log_archive = project_module("log_archive")
+    archive = tmp_path / "archive"
+    line = json.dumps({"ts": 1.0, "level": "INFO", "message": "leftover"}) + "\n"
+
+    # 上次归档认领后、写索引前崩溃：本次继续处理
+    (tmp_path / "app.jsonl.2.1-1.archiving").write_text(line, encoding="utf-8")
+    first = log_archive.archive_rotated(str(tmp_path))
+    assert [e["source"] for e in first] == ["app.jsonl.2.1-1.archiving"]
+
+    # 索引已写入、源文件还没删时崩溃：只删除源文件，不重复归档
+    (tmp_path / "app.jsonl.2.1-1.archiving").write_text(line, encoding="utf-8")
+    assert log_archive.archive_rotated(str(tmp_path)) == []
+    assert not list(tmp_path.glob("*.archiving"))
+    assert len(log_archive.load_index(str(archive))) == 1
+    assert [r["message"] for r in log_archive.query(str(archive))] == ["leftover"]
+
+
+def test_cli_archive_and_query(project_module, tmp_path):
+    package = project_module("log_archive").__package__
+    logs = tmp_path / "logs"
+    logs.mkdir()
+    (logs / "app.jsonl.1").write_text("\n".join(
+        json.dumps({"ts": 1767225600.0 + i, "level": level, "message": f"m{i}"})
+        for i, level in enumerate(["INFO", "USECASE", "INFO"])
+    ) + "\n", encoding="utf-8")
+    env = {**os.environ, "PYTHONPATH": str(SRC), "SKIP_DOTENV": "1"}
+
+    def cli(*args):
+        return subprocess.run([sys.executable, "-m", f"{package}.log_archive", *args], cwd=tmp_path,
+                              env=env, capture_output=True, text=True, check=True).stdout.splitlines()
+
+    assert len(cli("archive")) == 1
+    found = [json.loads(line)["message"] for line in cli("query", "--level", "USECASE", "--since", "2026-01-01")]
+    assert found == ["m1"]
@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+
+def _request(headers: dict) -> Request:
+    return Request({
+        "type": "http",
+        "method": "POST",
+        "path": "/v1/chat/completions",
+        "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+        "client": ("10.0.0.1", 12345),
+    })
+
+
+def test_hedge_slots_released_when_both_requests_fail(server_module):
+    scheduler_module = server_module("scheduler")
+    scheduler = scheduler_module.FairScheduler(max_concurrency=4, max_retries=0, hedge_after=0.01)
+
+    async def send():
+        await asyncio.sleep(0.05)
+        raise HTTPException(502, "upstream unavailable: ConnectError")
+
+    async def main():
+        with pytest.raises(HTTPException):
+            await scheduler.send("k", "normal", send)
+
+    asyncio.run(main())
+    assert scheduler.hedges == 1
+    assert scheduler.active == 0
+    assert scheduler.stats()["active_keys"] == 0
+
+
+def test_client_headers_ignored_unless_trusted(server_module, monkeypatch):
+    scheduler_module = server_module("scheduler")
+    monkeypatch.setattr(scheduler_module, "TRUST_CLIENT_HEADERS", False)
+    request = _request({"X-Tenant-Id": "other", "X-Priority": "high", "Authorization": "Bearer sk-a"})
+    assert scheduler_module.request_lane(request) == "normal"
+    assert scheduler_module.request_key(request) != "other"
+    assert scheduler_module.request_key(request) == scheduler_module.request_key(_request({"Authorization": "Bearer sk-a"}))
+    # 共用代理令牌时按客户端 IP 区分
+    assert scheduler_module.request_key(request, credentials=False) == "10.0.0.1"
+
+    monkeypatch.setattr(scheduler_module, "TRUST_CLIENT_HEADERS", True)
+    assert scheduler_module.request_lane(request) == "high"
+    assert scheduler_module.request_key(request) == "other"
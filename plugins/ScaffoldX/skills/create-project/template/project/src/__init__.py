@@ -1,12 +1,52 @@
 __version__ = "0.1.0"
 
-from dotenv import load_dotenv, find_dotenv
+# AI_Amend 2026-10-17 冷启动优化：import 包时只加载 .env，日志在首次访问 logger / Log_ 时才初始化
+# （创建 logs/、构建 formatter、打开轮转文件都推迟到真正需要日志时）
+import os
+import threading
 
-dotenv_path = find_dotenv()
-load_dotenv(".env", override=True)
+_env_loaded = False
 
-from .log import Log
-import logging
-Log_ = Log(console_level = logging.INFO, # 显示控制台的等级
-             log_file_name="app.log")
-logger = Log_.logger
+
+def load_env(force: bool = False) -> None:
+    """加载当前目录下的 .env，进程内只执行一次；SKIP_DOTENV=1 时跳过（测试 / 容器内由外部注入环境变量）。"""
+    global _env_loaded
+    if _env_loaded and not force:
+        return
+    _env_loaded = True
+    if os.getenv("SKIP_DOTENV") == "1":
+        return
+    from dotenv import load_dotenv
+    load_dotenv(".env", override=True)
+
+
+load_env()
+
+_log_lock = threading.Lock()
+
+
+def _init_log():
+    global Log_, logger
+    with _log_lock:
+        if "Log_" not in globals():
+            from .log import Log
+            import logging
+            Log_ = Log(console_level = logging.INFO, # 显示控制台的等级
+                         log_file_name="app.log",
+                         json_log_file_name=os.getenv("LOG_JSON_FILE") or None, # 例如 app.jsonl
+                         async_mode=os.getenv("LOG_ASYNC", "0") == "1", # 异步日志：LOG_ASYNC=1 开启
+                         queue_size=int(os.getenv("LOG_QUEUE_SIZE", "10000")),
+                         queue_policy=os.getenv("LOG_QUEUE_POLICY", "drop"))
+            logger = Log_.logger
+
+
+def __getattr__(name):
+    # 仅在模块字典中找不到属性时调用；初始化后 Log_ / logger 成为普通全局变量，后续访问没有额外开销
+    if name in ("Log_", "logger"):
+        _init_log()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+if os.getenv("LOG_EAGER") == "1":
+    _init_log()
@@ -1,16 +1,26 @@
+import atexit
+import collections
+import copy
+import hashlib
 import logging
 import os
-from logging.handlers import RotatingFileHandler, TimedRotatingFileHandler
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
 
 import json
 import functools
-import asyncio
 import traceback
 import sys
 import inspect
-import colorlog
 import pickle
 
+try:  # 可选依赖：安装 orjson 后 JSON 日志序列化更快
+    import orjson
+except ImportError:
+    orjson = None
+
 # USECASE
 logging.addLevelName(16, "USECASE")
 USECASE = 16
@@ -34,6 +44,75 @@ def datacol(self, msg, *args, **kws):
 logging.Logger.datacol = datacol
 
 
+# AI_Amend 2026-10-17 异步日志：调用方线程只入队，格式化 / 着色 / 写文件交给 QueueListener 线程
+class BoundedQueueHandler(QueueHandler):
+    """
+    有界队列的 QueueHandler。
+
+    队列满时按 policy 处理：
+    - "drop": 直接丢弃并计数（默认，请求路径永不阻塞）
+    - "block": 阻塞等待，最多 block_timeout 秒，超时仍丢弃并计数
+    """
+
+    def __init__(self, queue_, policy="drop", block_timeout=1.0):
+        super().__init__(queue_)
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.dropped = 0
+
+    def prepare(self, record):
+        # 只合并 msg % args，保证入队后参数对象被修改也不影响日志内容；
+        # 格式化与异常堆栈渲染留给监听线程
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            if self.policy == "block":
+                self.queue.put(record, block=True, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _DrainingQueueListener(QueueListener):
+    # 默认 put_nowait 放入结束标记，有界队列满时会抛 Full；这里阻塞等待监听线程腾出空间
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+# AI_Amend 2026-10-17 JSON Lines 日志：无颜色码，一行一条记录，便于下游解析与归档
+def _dumps(data) -> str:
+    if orjson is not None:
+        return orjson.dumps(data, default=str).decode("utf-8")
+    return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    输出字段：ts(时间戳) / time / level / logger / message，
+    struct_log 写入的记录额外带 title / content，异常记录带 exc。
+    """
+
+    def format(self, record):
+        data = {
+            "ts": record.created,
+            "time": self.formatTime(record, "%Y-%m-%d %H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        title = getattr(record, "struct_title", None)
+        if title is not None:
+            data["title"] = title
+            data["content"] = getattr(record, "struct_content", None)
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return _dumps(data)
+
 
 class Log:
     _instance = None
@@ -42,14 +121,38 @@ class Log:
             cls._instance = super().__new__(cls)
         return cls._instance
 
-    def __init__(self, console_level = logging.INFO, log_file_name="app.log"):
+    def __init__(self, console_level = logging.INFO, log_file_name="app.log",
+                 async_mode=False, queue_size=10000, queue_policy="drop",
+                 json_log_file_name=None):
         self.Console_LOG_LEVEL = console_level
         self.log_file_name = log_file_name
         self.LOG_FILE_PATH = os.path.join("logs", log_file_name) # TODO 优化地址
+        # JSON Lines 日志本（可选），轮转后的文件可用 log_archive 压缩归档
+        self.JSON_LOG_FILE_PATH = os.path.join("logs", json_log_file_name) if json_log_file_name else None
         os.makedirs(os.path.dirname(self.LOG_FILE_PATH), exist_ok=True)
+        # 异步模式：root logger 只挂 QueueHandler，控制台与文件处理器由监听线程持有
+        self.async_mode = async_mode
+        self.queue_size = queue_size
+        self.queue_policy = queue_policy
+        self.queue_handler = None
+        self.listener = None
         self.logger = self.get_logger()
 
+    @property
+    def dropped(self):
+        """异步模式下因队列满而丢弃的日志条数。"""
+        return self.queue_handler.dropped if self.queue_handler else 0
+
+    def stop(self):
+        """停止监听线程，退出前把队列中剩余日志写完。"""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
     def get_logger(self):
+        # colorlog 只在真正初始化日志时导入，只用 log_func 等工具的脚本不必付出这部分导入成本
+        import colorlog
+
         httpx_logger = logging.getLogger("httpx")
         httpx_logger.setLevel(logging.WARNING)
         
@@ -76,7 +179,6 @@ class Log:
             console_handler = colorlog.StreamHandler()
             console_handler.setLevel(self.Console_LOG_LEVEL)  # 控制台只显示 INFO 及以上级别的日志
             console_handler.setFormatter(formatter)
-            logger.addHandler(console_handler)
 
 
             # 文件系统
@@ -88,9 +190,38 @@ class Log:
                 encoding="utf-8",
             )
             file_handler.setLevel(DATACOL)  # 记录所有日志
-            file_handler.setFormatter(formatter)
-            logger.addHandler(file_handler)
-            
+            # AI_Amend 2026-10-17 文件不再写入 ANSI 颜色码
+            file_handler.setFormatter(logging.Formatter(
+                "%(levelname)s: %(asctime)s|%(message)s", datefmt="%Y-%m-%d %H:%M:%S"
+            ))
+            handlers = [console_handler, file_handler]
+
+            ## JSON Lines 日志本
+            if self.JSON_LOG_FILE_PATH:
+                json_handler = RotatingFileHandler(
+                    self.JSON_LOG_FILE_PATH,
+                    maxBytes=10 * 1024 * 1024,
+                    backupCount=10,
+                    encoding="utf-8",
+                )
+                json_handler.setLevel(DATACOL)
+                json_handler.setFormatter(JsonLinesFormatter())
+                handlers.append(json_handler)
+
+            if self.async_mode:
+                self.queue_handler = BoundedQueueHandler(
+                    queue.Queue(maxsize=self.queue_size), policy=self.queue_policy
+                )
+                self.listener = _DrainingQueueListener(
+                    self.queue_handler.queue, *handlers, respect_handler_level=True,
+                )
+                self.listener.start()
+                atexit.register(self.stop)
+                logger.addHandler(self.queue_handler)
+            else:
+                for handler in handlers:
+                    logger.addHandler(handler)
+
         return logger
 
 def _sanitize_value(value, max_len=200):
@@ -116,9 +247,11 @@ def _sanitize_value(value, max_len=200):
 def _get_sanitized_frame_locals(frame, 
                                 exclude_keys: list = None, 
                                 sensitive_keys: list = None, 
-                                max_value_len: int = 200) -> dict:
+                                max_value_len: int = 200,
+                                max_total_len: int = None) -> dict:
     """
     获取并清理指定栈帧的局部变量。
+    max_total_len 为本帧清理结果的总字符预算，超出后剩余变量不再 repr，只记录省略个数。
     """
     if exclude_keys is None:
         exclude_keys = []
@@ -126,109 +259,329 @@ def _get_sanitized_frame_locals(frame,
         sensitive_keys = []
 
     sanitized_data = {}
-    
-    for key, value in frame.f_locals.items():
+    used = 0
+    items = list(frame.f_locals.items())
+
+    for index, (key, value) in enumerate(items):
         if key in exclude_keys:
             continue
+        if max_total_len is not None and used >= max_total_len:
+            sanitized_data["..."] = f"<{len(items) - index} more locals omitted>"
+            break
         
         if key in sensitive_keys:
             sanitized_data[key] = f"***SENSITIVE_DATA_HIDDEN***"
         else:
             sanitized_data[key] = _sanitize_value(value, max_value_len)
+        used += len(key) + len(str(sanitized_data[key]))
             
     return sanitized_data
 
+# AI_Amend 2026-10-17 异常快照：调用线程只做限流判断和有预算的局部变量采集，
+# 堆栈格式化 / JSON / pickle / 写日志交给后台线程，错误风暴时不放大请求延迟
+class CrashSnapshotter:
+    """
+    log_func 的异常快照。
+
+    - 限流：同一 (函数, 异常类型) 每 window 秒最多 burst 份完整快照，其余只记一行摘要
+    - 预算：最多采集最内层 max_frames 个栈帧，局部变量总计不超过 max_locals_len 个字符
+    - 去重：按堆栈指纹（异常类型 + 各帧 文件/函数/行号）去重，同一指纹只落盘一次
+    - 落盘：directory 下的 {函数}_{异常}_{指纹}.pkl，总大小 / 文件数超限时删除最旧的
+    - 后台线程持有有界队列，队列满时丢弃并计数（dropped）
+    """
+
+    def __init__(self, directory=os.path.join("logs", "snapshots"),
+                 burst=3, window=60.0, max_frames=20, max_locals_len=32 * 1024,
+                 max_dir_bytes=50 * 1024 * 1024, max_files=500, queue_size=256):
+        self.directory = directory
+        self.burst = burst
+        self.window = window
+        self.max_frames = max_frames
+        self.max_locals_len = max_locals_len
+        self.max_dir_bytes = max_dir_bytes
+        self.max_files = max_files
+        self.queue_size = queue_size
+
+        self._lock = threading.Lock()
+        self._buckets = {}  # (函数, 异常类型) -> [窗口起点, 本窗口已用次数, 被限流次数]
+        self._queue = None
+        self._thread = None
+        self._seen = collections.OrderedDict()  # 指纹 -> 出现次数（仅后台线程访问）
+        self._files = None  # 已落盘快照 [(mtime, path, size)]，首次写入时扫描目录
+        self._dir_bytes = 0
+        self.captured = 0
+        self.suppressed = 0
+        self.dropped = 0
+
+    def _admit(self, key):
+        """返回 None 表示被限流，否则返回上个窗口内被限流的次数。"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None or now - bucket[0] >= self.window:
+                suppressed = bucket[2] if bucket else 0
+                if len(self._buckets) >= 4096:
+                    self._buckets.clear()
+                self._buckets[key] = [now, 1, 0]
+                return suppressed
+            if bucket[1] < self.burst:
+                bucket[1] += 1
+                return 0
+            bucket[2] += 1
+            self.suppressed += 1
+            return None
+
+    def _ensure_writer(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._queue = queue.Queue(maxsize=self.queue_size)
+                    self._thread = threading.Thread(
+                        target=self._run, name="crash-snapshot-writer", daemon=True
+                    )
+                    self._thread.start()
+                    atexit.register(self.stop)
+
+    def capture(self, logger, func, e, exclude_keys, sensitive_keys, max_value_len):
+        key = (func.__qualname__, type(e).__name__)
+        suppressed = self._admit(key)
+        message = _sanitize_value(str(e), max_value_len)
+        if suppressed is None:
+            logger.error(f"{func.__name__} raised {type(e).__name__}: {message} (snapshot rate-limited)")
+            return
+
+        # 以下必须在调用线程完成：栈帧和局部变量在函数返回后就会变化
+        exc = traceback.TracebackException(
+            type(e), e, e.__traceback__, limit=-self.max_frames, lookup_lines=False
+        )
+        frames = []
+        tb_frame = e.__traceback__
+        while tb_frame:
+            # 排除本文件内（装饰器自身）的栈帧
+            if tb_frame.tb_frame.f_code.co_filename != __file__:
+                frames.append(tb_frame)
+            tb_frame = tb_frame.tb_next
+
+        frames_data = []
+        budget = self.max_locals_len
+        for tb_frame in frames[-self.max_frames:]:
+            frame = tb_frame.tb_frame
+            frame_locals = {}
+            if budget > 0:
+                frame_locals = _get_sanitized_frame_locals(
+                    frame,
+                    exclude_keys=exclude_keys,
+                    sensitive_keys=sensitive_keys,
+                    max_value_len=max_value_len,
+                    max_total_len=budget,
+                )
+                budget -= sum(len(k) + len(str(v)) for k, v in frame_locals.items())
+            frames_data.append({
+                "filename": frame.f_code.co_filename,
+                "function": frame.f_code.co_name,
+                "lineno": tb_frame.tb_lineno,
+                "locals": frame_locals
+            })
+
+        # 构建结构化的错误信息
+        error_info = {
+            "function_name": func.__name__, # 被装饰的函数名
+            "error_type": type(e).__name__,
+            "error_message": message,
+            "time": time.time(),
+            "suppressed_since_last": suppressed,
+            "frames_omitted": max(0, len(frames) - self.max_frames),
+            "frames": frames_data,
+        }
+
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait((logger, exc, f"{type(e).__module__}.{type(e).__qualname__}", error_info))
+            self.captured += 1
+        except queue.Full:
+            self.dropped += 1
+            logger.error(f"{func.__name__} raised {type(e).__name__}: {message} (snapshot queue full)")
+
+    @staticmethod
+    def fingerprint(exc: traceback.TracebackException, type_name: str) -> str:
+        # TracebackException.exc_type 自 3.13 起弃用，异常类型名由 capture 时传入
+        digest = hashlib.sha1(type_name.encode())
+        for frame in exc.stack:
+            digest.update(f"|{frame.filename}:{frame.name}:{frame.lineno}".encode())
+        return digest.hexdigest()[:16]
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            try:
+                self._write(*item)
+            except Exception as write_error:
+                print(f"[crash snapshot] write failed: {write_error}", file=sys.stderr)
+
+    def _write(self, logger, exc, type_name, error_info):
+        fp = self.fingerprint(exc, type_name)
+        error_info["fingerprint"] = fp
+        count = self._seen.pop(fp, 0) + 1
+        self._seen[fp] = count
+        if len(self._seen) > 4096:
+            self._seen.popitem(last=False)
+        error_info["occurrences"] = count
+
+        # 使用logger记录错误信息，以JSON格式输出（格式化时才读取源码行）
+        logger.error("".join(exc.format()) + "$" + _dumps(error_info))
+        if count > 1:
+            return
+
+        path = os.path.join(
+            self.directory, f"{error_info['function_name']}_{error_info['error_type']}_{fp}.pkl"
+        )
+        if os.path.exists(path):  # 之前的进程已落盘过同一指纹
+            return
+        self._load_files()
+        with open(path, "wb") as f:
+            pickle.dump(error_info, f)
+        size = os.path.getsize(path)
+        self._files.append((time.time(), path, size))
+        self._dir_bytes += size
+        while self._files and (self._dir_bytes > self.max_dir_bytes or len(self._files) > self.max_files):
+            _, old_path, old_size = self._files.popleft()
+            self._dir_bytes -= old_size
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+
+    def _load_files(self):
+        if self._files is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        files = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.endswith(".pkl"):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, entry.path, stat.st_size))
+        files.sort()
+        self._files = collections.deque(files)
+        self._dir_bytes = sum(size for _, _, size in files)
+
+    def stop(self, timeout=5.0):
+        """写完队列中剩余的快照后停止后台线程。"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def stats(self) -> dict:
+        return {
+            "captured": self.captured,
+            "suppressed": self.suppressed,
+            "dropped": self.dropped,
+            "pending": self._queue.qsize() if self._queue is not None else 0,
+        }
+
+
+# 所有 log_func 默认共用的快照器，可在启动时替换或调整参数
+crash_snapshots = CrashSnapshotter()
+
+
 def log_func(logger=None, 
              exclude_keys: list = None, 
              sensitive_keys: list = None, 
-             max_value_len: int = 2000):
-    # TODO Log无法处理异步流式的问题 async for 这种问题会导致出错
-    
+             max_value_len: int = 2000,
+             snapshotter: "CrashSnapshotter" = None):
     """
     一个用于记录函数执行（包括异常）的装饰器。
     在发生异常时，会记录所有相关栈帧的局部变量。
 
+    AI_Amend 2026-10-17 装饰时按函数类型生成对应的包装器，被装饰函数的调用方式保持不变：
+    - 普通函数 -> 普通函数（不再被变成协程）
+    - async def -> async def
+    - 生成器 -> 生成器（yield from 委托，send / throw / close 原样透传）
+    - 异步生成器 -> 异步生成器（可直接用于 async for / StreamingResponse）
+    成功路径只多一层 try，不做任何额外分配，可放在流式接口等热点路径上。
+
     Args:
-        logger (logging.Logger): 用于记录日志的Logger对象。如果为None，则使用默认logger。
+        logger (logging.Logger): 用于记录日志的Logger对象。如果为None，则使用 root logger。
         exclude_keys (list): 一个字符串列表，包含不希望记录的变量名。
         sensitive_keys (list): 一个字符串列表，包含需要脱敏的变量名。
         max_value_len (int): 字符串值的最大长度，超过此长度将被截断。
+        snapshotter (CrashSnapshotter): 异常快照器，默认使用模块级 crash_snapshots。
     """
 
     # 确保 exclude_keys 和 sensitive_keys 是可变对象的新实例，以防多个装饰器实例共享
-    exclude_keys_final = exclude_keys if exclude_keys is not None else []
-    sensitive_keys_final = sensitive_keys if sensitive_keys is not None else []
+    exclude_keys_final = list(exclude_keys) if exclude_keys is not None else []
+    sensitive_keys_final = list(sensitive_keys) if sensitive_keys is not None else []
 
     def outer_packing(func):
-        @functools.wraps(func)
-        async def wrapper(*args, **kwargs):
-            try:
-                if asyncio.iscoroutinefunction(func):
-                    result = await func(*args, **kwargs)
-                else:
-                    result = func(*args, **kwargs)
-                # logger.notice(f'{func.__name__} & {kwargs_dict} & {result}')
-                return result
-            except Exception as e:
-                # 获取异常信息
-                exc_type, exc_value, exc_traceback = sys.exc_info()
-                
-                # 格式化完整的堆栈信息
-                formatted_traceback = traceback.format_exc()
-                # 遍历栈帧
-                frames_data = []
-                tb_frame = exc_traceback
-                while tb_frame:
-                    frame = tb_frame.tb_frame
-                    
-                    # 获取栈帧的局部变量
-                    frame_locals = _get_sanitized_frame_locals(
-                        frame, 
-                        exclude_keys=exclude_keys_final, 
-                        sensitive_keys=sensitive_keys_final, 
-                        max_value_len=max_value_len
-                    )
-                    
-                    # 避免记录装饰器自身的内部变量，或者其他不必要的栈帧
-                    # 可以通过检查文件名或函数名来过滤
-                    if frame.f_code.co_filename != __file__: # 排除本文件内的栈帧
-                        frames_data.append({
-                            "filename": frame.f_code.co_filename,
-                            "function": frame.f_code.co_name,
-                            "lineno": frame.f_lineno,
-                            "locals": frame_locals
-                        })
-                    tb_frame = tb_frame.tb_next
-
-                # 构建结构化的错误信息
-                error_info = {
-                    "function_name": func.__name__, # 被装饰的函数名
-                    "error_type": type(e).__name__,
-                    "error_message": str(e),
-                    "frames": frames_data 
-                }
-                
-                # 使用logger记录错误信息，以JSON格式输出
-                logger.error(formatted_traceback + "$" +  json.dumps(error_info, indent=4, ensure_ascii=False))
-                pickle_file = f'{func.__name__}_{type(e).__name__}.pkl'
+        log = logger or logging.getLogger()
+
+        def on_error(e):
+            (snapshotter or crash_snapshots).capture(
+                log, func, e, exclude_keys_final, sensitive_keys_final, max_value_len
+            )
+
+        if inspect.isasyncgenfunction(func):
+            @functools.wraps(func)
+            async def agen_wrapper(*args, **kwargs):
+                agen = func(*args, **kwargs)
                 try:
-                    # 'wb' 表示以二进制写入模式打开文件
-                    with open(pickle_file, 'wb') as f:
-                        # pickle.dump() 将对象序列化到文件
-                        # 可以保存多个对象，但通常建议将所有要保存的对象打包到一个容器（如字典或列表）中一次性保存
-                        pickle.dump(error_info, f)
-                        # 如果要保存多个独立的dump，加载时也要独立load
-                        # pickle.dump(obj1, f)
-                        # pickle.dump(obj2, f)
-                        # pickle.dump(my_list, f)
-                    print("Objects successfully pickled.")
+                    value = await agen.__anext__()
+                    while True:
+                        try:
+                            sent = yield value
+                        except GeneratorExit:
+                            await agen.aclose()
+                            raise
+                        except BaseException as thrown:
+                            # 调用方 athrow 进来的异常（含取消）交给原生成器处理
+                            value = await agen.athrow(thrown)
+                        else:
+                            value = await (agen.__anext__() if sent is None else agen.asend(sent))
+                except StopAsyncIteration:
+                    return
                 except Exception as e:
-                    print(f"Error during pickling: {e}")
+                    on_error(e)
+                    raise
+            return agen_wrapper
 
-                raise # 重新抛出异常，保持原有的异常行为
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def gen_wrapper(*args, **kwargs):
+                try:
+                    return (yield from func(*args, **kwargs))
+                except Exception as e:
+                    on_error(e)
+                    raise
+            return gen_wrapper
 
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                try:
+                    return await func(*args, **kwargs)
+                except Exception as e:
+                    on_error(e)
+                    raise # 重新抛出异常，保持原有的异常行为
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                on_error(e)
+                raise # 重新抛出异常，保持原有的异常行为
         return wrapper
+
     return outer_packing
 
 def struct_log(logger_,title,content):
-    logger_(title +  "$" + content)
\ No newline at end of file
+    # 文本日志保持 title$content 格式，JSON 日志中拆成 title / content 两个字段
+    # logger_ 也可以是 print 等普通可调用对象，只有 Logger / LoggerAdapter 的方法才传 extra
+    if isinstance(getattr(logger_, "__self__", None), (logging.Logger, logging.LoggerAdapter)):
+        logger_(title +  "$" + content, extra={"struct_title": title, "struct_content": content})
+    else:
+        logger_(title +  "$" + content)
\ No newline at end of file
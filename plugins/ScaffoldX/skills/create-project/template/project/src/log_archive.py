@@ -0,0 +1,196 @@
+# AI_Amend 2026-10-17 JSON Lines 日志归档：轮转文件压缩为 gzip 列式分块 + 时间索引
+"""
+把 RotatingFileHandler 轮转出来的 JSONL 日志（app.jsonl.1 ... app.jsonl.N）压缩归档。
+
+每个分块是一个 gzip 压缩的列式 JSON：{"columns": [...], "data": {列名: [值, ...]}}，
+索引文件 index.jsonl 每行记录一个分块的起止时间、条数和各级别条数。
+查询时先用索引跳过时间 / 级别不相关的分块，只解压命中的分块。
+
+归档时先把轮转文件原子重命名为 *.archiving（之后 RotatingFileHandler 的重命名不会再碰到它，
+已被轮转移走的文件本轮跳过），每个文件的分块与索引条目 fsync 落盘后才删除源文件；
+中途崩溃留下的 *.archiving 会在下次归档时继续处理，索引里已有的直接删除。
+
+用法:
+    python -m <module>.log_archive archive
+    python -m <module>.log_archive query --level USECASE --since 2026-01-01
+"""
+import argparse
+import glob
+import gzip
+import json
+import os
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Iterator, Optional, Sequence
+
+COLUMNS = ["ts", "time", "level", "logger", "message", "title", "content", "exc"]
+INDEX_FILE = "index.jsonl"
+CLAIM_SUFFIX = ".archiving"
+
+
+def _rotated_files(log_dir: str, base_name: str) -> list:
+    """按从旧到新排序（app.jsonl.10 最旧，app.jsonl.1 最新），不包含正在写入的文件。"""
+    paths = []
+    for path in glob.glob(os.path.join(log_dir, f"{base_name}.*")):
+        suffix = path.rsplit(".", 1)[-1]
+        if suffix.isdigit():
+            paths.append((int(suffix), path))
+    return [path for _, path in sorted(paths, reverse=True)]
+
+
+def _claim(path: str) -> Optional[str]:
+    """原子重命名为本次归档独占的文件名；文件已被轮转移走时返回 None。"""
+    claimed = f"{path}.{os.getpid()}-{time.time_ns()}{CLAIM_SUFFIX}"
+    try:
+        os.rename(path, claimed)
+    except FileNotFoundError:
+        return None
+    return claimed
+
+
+def _fsync_write(path: str, mode: str, write) -> None:
+    with open(path, mode, encoding=None if "b" in mode else "utf-8") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _parse_record(line: str) -> Optional[dict]:
+    try:
+        record = json.loads(line)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(record, dict):
+        return None
+    ts = record.get("ts")
+    if isinstance(ts, bool) or not isinstance(ts, (int, float)):
+        return None
+    return record
+
+
+def _write_chunk(records: list, archive_dir: str, source: str) -> dict:
+    data = {column: [record.get(column) for record in records] for column in COLUMNS}
+    start, end = min(data["ts"]), max(data["ts"])
+    name = f"{int(start * 1000)}_{int(end * 1000)}_{len(records)}.json.gz"
+    payload = json.dumps({"columns": COLUMNS, "data": data}, ensure_ascii=False, separators=(",", ":"))
+    _fsync_write(os.path.join(archive_dir, name), "wb", lambda f: f.write(gzip.compress(payload.encode("utf-8"))))
+    return {
+        "file": name,
+        "source": source,
+        "start": start,
+        "end": end,
+        "count": len(records),
+        "levels": dict(Counter(data["level"])),
+    }
+
+
+def archive_rotated(log_dir: str = "logs", base_name: str = "app.jsonl",
+                    archive_dir: Optional[str] = None, chunk_records: int = 50000) -> list:
+    """压缩所有已轮转的 JSONL 文件，每个文件的索引条目落盘后再删除该源文件，返回新增的索引条目。"""
+    archive_dir = archive_dir or os.path.join(log_dir, "archive")
+    os.makedirs(archive_dir, exist_ok=True)
+    index_path = os.path.join(archive_dir, INDEX_FILE)
+    indexed = {entry.get("source") for entry in load_index(archive_dir)}
+    # 上次中途退出留下的已认领文件先处理，再认领新的轮转文件
+    leftovers = sorted(glob.glob(os.path.join(log_dir, f"{glob.escape(base_name)}.*{CLAIM_SUFFIX}")))
+    claimed = leftovers + [c for c in map(_claim, _rotated_files(log_dir, base_name)) if c is not None]
+
+    entries = []
+    for path in claimed:
+        source = os.path.basename(path)
+        if source in indexed:
+            os.remove(path)  # 索引已写入、源文件还没删时崩溃
+            continue
+        file_entries, records = [], []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                record = _parse_record(line)
+                if record is None:
+                    continue  # 半行（进程崩溃时写入）、非对象行、没有 ts 的记录直接跳过
+                records.append(record)
+                if len(records) >= chunk_records:
+                    file_entries.append(_write_chunk(records, archive_dir, source))
+                    records = []
+        if records:
+            file_entries.append(_write_chunk(records, archive_dir, source))
+        if file_entries:
+            lines = "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in file_entries)
+            _fsync_write(index_path, "a", lambda f: f.write(lines))
+        os.remove(path)
+        entries.extend(file_entries)
+    return entries
+
+
+def load_index(archive_dir: str = "logs/archive") -> list:
+    path = os.path.join(archive_dir, INDEX_FILE)
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def query(archive_dir: str = "logs/archive", since: Optional[float] = None,
+          until: Optional[float] = None, levels: Optional[Sequence[str]] = None,
+          title: Optional[str] = None) -> Iterator[dict]:
+    """按时间范围 / 级别 / struct_log 标题查询归档记录，逐条产出。"""
+    levels = set(levels) if levels else None
+    for entry in sorted(load_index(archive_dir), key=lambda e: e["start"]):
+        if since is not None and entry["end"] < since:
+            continue
+        if until is not None and entry["start"] > until:
+            continue
+        if levels is not None and not levels & set(entry["levels"]):
+            continue
+        with gzip.open(os.path.join(archive_dir, entry["file"]), "rt", encoding="utf-8") as f:
+            chunk = json.load(f)
+        columns, data = chunk["columns"], chunk["data"]
+        for i, ts in enumerate(data["ts"]):
+            if since is not None and ts < since:
+                continue
+            if until is not None and ts > until:
+                continue
+            if levels is not None and data["level"][i] not in levels:
+                continue
+            if title is not None and data["title"][i] != title:
+                continue
+            yield {column: data[column][i] for column in columns}
+
+
+def _parse_time(value: Optional[str]) -> Optional[float]:
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive and query JSON Lines logs.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_archive = sub.add_parser("archive", help="Compress rotated JSONL files into the archive.")
+    p_archive.add_argument("--log-dir", default="logs")
+    p_archive.add_argument("--base-name", default="app.jsonl")
+    p_archive.add_argument("--chunk-records", type=int, default=50000)
+
+    p_query = sub.add_parser("query", help="Query archived records, printed as JSON Lines.")
+    p_query.add_argument("--archive-dir", default="logs/archive")
+    p_query.add_argument("--since", help="ISO time or unix timestamp")
+    p_query.add_argument("--until", help="ISO time or unix timestamp")
+    p_query.add_argument("--level", action="append", help="e.g. USECASE, DATACOL (repeatable)")
+    p_query.add_argument("--title", help="struct_log title")
+
+    args = parser.parse_args()
+    if args.command == "archive":
+        for entry in archive_rotated(args.log_dir, args.base_name, chunk_records=args.chunk_records):
+            print(json.dumps(entry, ensure_ascii=False))
+    else:
+        for record in query(args.archive_dir, _parse_time(args.since), _parse_time(args.until),
+                            args.level, args.title):
+            sys.stdout.write(json.dumps(record, ensure_ascii=False) + "\n")
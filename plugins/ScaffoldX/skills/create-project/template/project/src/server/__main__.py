@@ -1,18 +1,28 @@
 # server
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from dotenv import load_dotenv, find_dotenv
 from contextlib import asynccontextmanager, AsyncExitStack
 
 import argparse
+import os
 import uvicorn
 
 
 
 default = 8007
 
-dotenv_path = find_dotenv()
-load_dotenv(dotenv_path, override=True)
+# AI_Amend 2026-10-17 .env 由包的 load_env() 统一加载（进程内一次，SKIP_DOTENV=1 时跳过）
+from .. import load_env
+load_env()
+
+# AI_Amend 2026-10-17 OpenAI 兼容代理 /v1/chat/completions，默认关闭，LLM_PROXY_ENABLED=1 开启
+LLM_PROXY_ENABLED = os.getenv("LLM_PROXY_ENABLED", "0") == "1"
+if LLM_PROXY_ENABLED:
+    from .llm_proxy import router as llm_router
+    from .llm_cache import llm_cache
+    from .scheduler import scheduler
+
+from .lifecycle import resources, router as lifecycle_router
 
 
 # Combine both lifespans
@@ -20,6 +30,10 @@ load_dotenv(dotenv_path, override=True)
 async def combined_lifespan(app: FastAPI):
     # Run both lifespans
     async with AsyncExitStack() as stack:
+        # AI_Amend 2026-10-17 各模块导入时登记的资源（上游连接池、LLM 响应缓存等）
+        # 按登记顺序启动并执行预热，完成后 /readyz 才返回 200；退出时按相反顺序关闭
+        await resources.start(stack)
+        print(resources.report())
         yield
 
 app = FastAPI(
@@ -44,6 +58,25 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers (Content-Type, Authorization, etc.)
 )
 
+# AI_Amend 2026-10-17 按路由的延迟直方图 / 在途请求数 / 响应大小，暴露在 /metrics；
+# 最后挂载，作为最外层中间件统计完整耗时
+if os.getenv("METRICS_ENABLED", "1") == "1":
+    from .metrics import install_metrics
+    metrics_registry = install_metrics(app)
+    if LLM_PROXY_ENABLED and llm_cache is not None:
+        metrics_registry.collectors.append(llm_cache.prometheus_lines)
+    # AI_Amend 2026-10-17 上游调度器：排队深度 / 等待时间 / 拒绝与重试次数
+    if LLM_PROXY_ENABLED and scheduler is not None:
+        metrics_registry.collectors.append(scheduler.prometheus_lines)
+
+
+
+if LLM_PROXY_ENABLED:
+    app.include_router(llm_router, tags=["llm"])
+
+# AI_Amend 2026-10-17 存活 / 就绪检查 /healthz /readyz；启动时预先生成 OpenAPI schema
+app.include_router(lifecycle_router)
+resources.add_warmup("openapi", app.openapi)
 
 
 @app.get("/")
@@ -53,6 +86,19 @@ async def root():
 
 
 
+def workers_arg(value: str) -> int:
+    """--workers / $WEB_CONCURRENCY：'auto'（每个 CPU 核一个）或正整数，其它值由 argparse 报错退出。"""
+    if value == "auto":
+        return os.cpu_count() or 1
+    try:
+        workers = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected 'auto' or a positive integer, got {value!r}")
+    if workers < 1:
+        raise argparse.ArgumentTypeError(f"expected 'auto' or a positive integer, got {value!r}")
+    return workers
+
+
 if __name__ == "__main__":
     # 这是一个标准的 Python 入口点惯用法
     # 当脚本直接运行时 (__name__ == "__main__")，这里的代码会被执行
@@ -86,6 +132,52 @@ if __name__ == "__main__":
         action="store_true",  # 当存在 --prod 时，该值为 True
         help="Run in production mode.",
     )
+
+    # AI_Amend 2026-10-17 多进程与 uvicorn 性能参数
+    parser.add_argument(
+        "--workers",
+        type=workers_arg,
+        default=os.getenv("WEB_CONCURRENCY", "1"),
+        help="Number of worker processes, or 'auto' for one per CPU core "
+             "[default: $WEB_CONCURRENCY or 1]. Ignored in dev mode (reload). "
+             "Send SIGHUP to the master process to restart workers gracefully.",
+    )
+    parser.add_argument(
+        "--loop",
+        choices=["auto", "asyncio", "uvloop"],
+        default="auto",
+        help="Event loop implementation, uvloop requires the uvloop package [default: auto].",
+    )
+    parser.add_argument(
+        "--http",
+        choices=["auto", "h11", "httptools"],
+        default="auto",
+        help="HTTP protocol implementation, httptools requires the httptools package [default: auto].",
+    )
+    parser.add_argument(
+        "--backlog",
+        type=int,
+        default=2048,
+        help="Maximum number of pending connections in the socket backlog [default: 2048].",
+    )
+    parser.add_argument(
+        "--limit-concurrency",
+        type=int,
+        default=None,
+        help="Respond with 503 once this many connections / tasks are in flight per worker.",
+    )
+    parser.add_argument(
+        "--limit-max-requests",
+        type=int,
+        default=None,
+        help="Recycle a worker after it has served this many requests (use with --workers > 1).",
+    )
+    parser.add_argument(
+        "--timeout-graceful-shutdown",
+        type=int,
+        default=30,
+        help="Seconds to wait for in-flight requests on shutdown / reload [default: 30].",
+    )
     args = parser.parse_args()
 
     if args.prod:
@@ -95,22 +187,38 @@ if __name__ == "__main__":
         env = "dev"
 
     port = args.port
+    workers = args.workers
 
     if env == "dev":
         port += 100
         reload = True
+        workers = 1  # 热重载与多进程互斥
         app_import_string = (
             f"{__package__}.__main__:app"  # <--- 关键修改：传递导入字符串
         )
     elif env == "prod":
         reload = False
-        app_import_string = app
+        # 多进程时每个 worker 需要自行导入 app，只能传导入字符串
+        app_import_string = f"{__package__}.__main__:app" if workers > 1 else app
     else:
         reload = False
         app_import_string = app
 
+    if args.limit_max_requests and workers == 1:
+        print("⚠️ --limit-max-requests 在单进程下会让服务直接退出，建议配合 --workers 使用")
+
     # 使用 uvicorn.run() 来启动服务器
     # 参数对应于命令行选项
     uvicorn.run(
-        app_import_string, host="0.0.0.0", port=port, reload=reload  # 启用热重载
+        app_import_string,
+        host="0.0.0.0",
+        port=port,
+        reload=reload,  # 启用热重载
+        workers=workers,
+        loop=args.loop,
+        http=args.http,
+        backlog=args.backlog,
+        limit_concurrency=args.limit_concurrency,
+        limit_max_requests=args.limit_max_requests,
+        timeout_graceful_shutdown=args.timeout_graceful_shutdown,
     )
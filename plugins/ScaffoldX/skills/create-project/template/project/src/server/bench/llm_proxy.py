@@ -0,0 +1,181 @@
+# AI_Amend 2026-10-17 LLM 代理基准：本地假上游 + 真实 TCP，对比直连与经代理的首 token 延迟（TTFT），并验证断开即取消
+"""
+用法（在项目包目录下）:
+
+    python -m <module>.server.bench.llm_proxy
+    python -m <module>.server.bench.llm_proxy --requests 500 --concurrency 50 --first-token-ms 100 --tokens 50 --token-ms 10
+
+本地起两个 uvicorn：假上游（按设定延迟逐 token 输出 SSE）与本服务（/v1/chat/completions 指向假上游），
+分别直连和经代理发流式请求，输出 TTFT / 总耗时分位数与代理带来的额外延迟（JSON）。
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from typing import List
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+os.environ["LLM_PROXY_ENABLED"] = "1"  # 代理路由默认不挂载，基准需在导入 app 前开启
+from ..__main__ import app
+from ..llm_proxy import upstream
+
+
+class FakeUpstream:
+    """
+    OpenAI 风格的假上游，统计开始 / 完成 / 被中途断开的流。
+
+    capacity > 0 时模拟上游并发限额：在途请求超过 capacity 直接返回 429。
+    """
+
+    def __init__(self, first_token_ms: float, tokens: int, token_ms: float, capacity: int = 0):
+        self.first_token = first_token_ms / 1000
+        self.tokens = tokens
+        self.token_delay = token_ms / 1000
+        self.capacity = capacity
+        self.in_flight = 0
+        self.started = 0
+        self.completed = 0
+        self.aborted = 0
+        self.throttled = 0
+        self.app = FastAPI()
+        self.app.post("/chat/completions")(self.chat_completions)
+
+    def _chunk(self, i: int) -> bytes:
+        data = {"id": "fake", "object": "chat.completion.chunk",
+                "choices": [{"index": 0, "delta": {"content": f"tok{i} "}, "finish_reason": None}]}
+        return b"data: " + json.dumps(data).encode() + b"\n\n"
+
+    async def _events(self):
+        self.started += 1
+        self.in_flight += 1
+        try:
+            await asyncio.sleep(self.first_token)
+            for i in range(self.tokens):
+                yield self._chunk(i)
+                await asyncio.sleep(self.token_delay)
+            yield b"data: [DONE]\n\n"
+            self.completed += 1
+        except (GeneratorExit, asyncio.CancelledError):
+            self.aborted += 1
+            raise
+        finally:
+            self.in_flight -= 1
+
+    async def chat_completions(self, request: Request):
+        payload = await request.json()
+        if self.capacity and self.in_flight >= self.capacity:
+            self.throttled += 1
+            return JSONResponse({"error": {"message": "rate limited", "type": "rate_limit"}}, status_code=429)
+        if payload.get("stream"):
+            return StreamingResponse(self._events(), media_type="text/event-stream")
+        self.in_flight += 1
+        try:
+            await asyncio.sleep(self.first_token + self.tokens * self.token_delay)
+        finally:
+            self.in_flight -= 1
+        return JSONResponse({"id": "fake", "object": "chat.completion",
+                             "choices": [{"index": 0, "message": {"role": "assistant", "content": "ok"}}]})
+
+
+async def serve(asgi_app, lifespan: str = "on") -> tuple:
+    server = uvicorn.Server(uvicorn.Config(asgi_app, host="127.0.0.1", port=0, log_level="warning",
+                                           lifespan=lifespan))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    return server, task, f"http://127.0.0.1:{port}"
+
+
+async def stream_once(client: httpx.AsyncClient, url: str, body: dict) -> tuple:
+    started = time.perf_counter()
+    ttft = None
+    async with client.stream("POST", url, json=body) as response:
+        response.raise_for_status()
+        async for chunk in response.aiter_bytes():
+            if ttft is None and b"data:" in chunk:
+                ttft = time.perf_counter() - started
+    return ttft, time.perf_counter() - started
+
+
+def _summary(values: List[float]) -> dict:
+    values = sorted(values)
+    pick = lambda q: round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 3)
+    return {"p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99), "max_ms": round(values[-1] * 1000, 3)}
+
+
+async def measure(url: str, requests: int, concurrency: int) -> dict:
+    body = {"model": "fake", "stream": True, "messages": [{"role": "user", "content": "hi"}]}
+    ttfts, totals = [], []
+    indexes = iter(range(requests))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=60, limits=limits) as client:
+        async def worker():
+            for _ in indexes:
+                ttft, total = await stream_once(client, url, body)
+                ttfts.append(ttft)
+                totals.append(total)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return {"requests": requests, "rps": round(requests / elapsed, 1),
+            "ttft": _summary(ttfts), "total": _summary(totals)}
+
+
+async def check_disconnect(proxy_url: str, fake: FakeUpstream) -> dict:
+    """读到第一块后断开，确认上游流随之被中止。"""
+    aborted_before = fake.aborted
+    body = {"model": "fake", "stream": True, "messages": [{"role": "user", "content": "hi"}]}
+    async with httpx.AsyncClient(timeout=60) as client:
+        async with client.stream("POST", f"{proxy_url}/v1/chat/completions", json=body) as response:
+            async for _ in response.aiter_bytes():
+                break
+    for _ in range(100):
+        if fake.aborted > aborted_before:
+            break
+        await asyncio.sleep(0.02)
+    return {"upstream_aborted": fake.aborted > aborted_before, "proxy_disconnects": upstream.disconnects}
+
+
+async def main(args) -> dict:
+    fake = FakeUpstream(args.first_token_ms, args.tokens, args.token_ms)
+    fake_server, fake_task, fake_url = await serve(fake.app, lifespan="off")
+    upstream.base_url = fake_url
+    upstream.api_key = None
+    proxy_server, proxy_task, proxy_url = await serve(app)
+    try:
+        if args.warmup:
+            await measure(f"{proxy_url}/v1/chat/completions", args.warmup, min(args.warmup, args.concurrency))
+        direct = await measure(f"{fake_url}/chat/completions", args.requests, args.concurrency)
+        proxied = await measure(f"{proxy_url}/v1/chat/completions", args.requests, args.concurrency)
+        disconnect = await check_disconnect(proxy_url, fake) if args.tokens > 1 else None
+    finally:
+        for server in (proxy_server, fake_server):
+            server.should_exit = True
+        await asyncio.gather(proxy_task, fake_task, return_exceptions=True)
+    return {
+        "config": vars(args),
+        "direct": direct,
+        "proxied": proxied,
+        "ttft_overhead_p50_ms": round(proxied["ttft"]["p50_ms"] - direct["ttft"]["p50_ms"], 3),
+        "ttft_overhead_p95_ms": round(proxied["ttft"]["p95_ms"] - direct["ttft"]["p95_ms"], 3),
+        "disconnect": disconnect,
+        "upstream": upstream.stats(),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure TTFT through the LLM proxy against a local fake upstream.")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--first-token-ms", type=float, default=50.0)
+    parser.add_argument("--tokens", type=int, default=20)
+    parser.add_argument("--token-ms", type=float, default=5.0)
+    print(json.dumps(asyncio.run(main(parser.parse_args())), indent=2))
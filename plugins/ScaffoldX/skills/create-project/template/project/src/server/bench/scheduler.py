@@ -0,0 +1,124 @@
+# AI_Amend 2026-10-17 调度器基准：一个租户持续突发、另一个租户少量请求，对比开启 / 关闭调度器时轻租户的尾延迟与上游 429
+"""
+用法（在项目包目录下）:
+
+    python -m <module>.server.bench.scheduler
+    python -m <module>.server.bench.scheduler --capacity 16 --heavy-concurrency 64 --light-requests 100
+
+假上游只允许 --capacity 个并发流，超出返回 429。重租户 heavy 以 --heavy-concurrency 个并发持续请求，
+轻租户 light 以 --light-concurrency 个并发发 --light-requests 个请求，分别在关闭（直接转发）与开启调度器
+（全局上限 = capacity，单 key 上限 = capacity / 2）时测量，输出轻租户的成功率 / TTFT / 总耗时分位数（JSON）。
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import Counter
+from typing import List
+
+import httpx
+
+os.environ["LLM_PROXY_ENABLED"] = "1"  # 代理路由默认不挂载，基准需在导入 app 前开启
+os.environ["LLM_TRUST_CLIENT_HEADERS"] = "1"  # 用 X-Tenant-Id 区分轻重租户
+from .. import llm_proxy
+from ..__main__ import app
+from ..llm_proxy import upstream
+from ..scheduler import FairScheduler
+from .llm_proxy import FakeUpstream, _summary, serve
+
+BODY = {"model": "fake", "stream": True, "messages": [{"role": "user", "content": "hi"}]}
+
+
+async def light_requests(client: httpx.AsyncClient, url: str, requests: int, concurrency: int) -> dict:
+    ttfts: List[float] = []
+    totals: List[float] = []
+    statuses: Counter = Counter()
+    indexes = iter(range(requests))
+
+    async def worker():
+        for _ in indexes:
+            started = time.perf_counter()
+            ttft = None
+            async with client.stream("POST", url, json=BODY, headers={"X-Tenant-Id": "light"}) as response:
+                async for chunk in response.aiter_bytes():
+                    if ttft is None and b"data:" in chunk:
+                        ttft = time.perf_counter() - started
+            statuses[response.status_code] += 1
+            if response.status_code == 200:
+                ttfts.append(ttft)
+                totals.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return {
+        "status_codes": {str(k): v for k, v in sorted(statuses.items())},
+        "ttft": _summary(ttfts) if ttfts else None,
+        "total": _summary(totals) if totals else None,
+    }
+
+
+async def heavy_load(client: httpx.AsyncClient, url: str, concurrency: int, stop: asyncio.Event) -> Counter:
+    statuses: Counter = Counter()
+
+    async def worker():
+        while not stop.is_set():
+            async with client.stream("POST", url, json=BODY, headers={"X-Tenant-Id": "heavy"}) as response:
+                async for _ in response.aiter_bytes():
+                    pass
+            statuses[response.status_code] += 1
+            if response.status_code != 200:
+                await asyncio.sleep(0.005)  # 被拒绝时稍等，避免空转
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return statuses
+
+
+async def run_mode(proxy_url: str, fake: FakeUpstream, args) -> dict:
+    url = f"{proxy_url}/v1/chat/completions"
+    throttled_before = fake.throttled
+    stop = asyncio.Event()
+    limits = httpx.Limits(max_connections=args.heavy_concurrency + args.light_concurrency)
+    async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+        heavy = asyncio.create_task(heavy_load(client, url, args.heavy_concurrency, stop))
+        await asyncio.sleep(0.2)  # 让重租户先占满上游
+        light = await light_requests(client, url, args.light_requests, args.light_concurrency)
+        stop.set()
+        heavy_statuses = await heavy
+    return {
+        "light": light,
+        "heavy_status_codes": {str(k): v for k, v in sorted(heavy_statuses.items())},
+        "upstream_429": fake.throttled - throttled_before,
+    }
+
+
+async def main(args) -> dict:
+    fake = FakeUpstream(args.first_token_ms, args.tokens, args.token_ms, capacity=args.capacity)
+    fake_server, fake_task, fake_url = await serve(fake.app, lifespan="off")
+    upstream.base_url = fake_url
+    upstream.api_key = None
+    upstream.max_connections = args.heavy_concurrency + args.light_concurrency
+    scheduler = FairScheduler(max_concurrency=args.capacity, per_key_concurrency=max(1, args.capacity // 2),
+                              queue_timeout=60, backoff_base=0.05, backoff_max=0.5)
+    proxy_server, proxy_task, proxy_url = await serve(app)
+    results = {}
+    try:
+        for mode, current in (("off", None), ("on", scheduler)):
+            llm_proxy.scheduler = current
+            results[mode] = await run_mode(proxy_url, fake, args)
+    finally:
+        for server in (proxy_server, fake_server):
+            server.should_exit = True
+        await asyncio.gather(proxy_task, fake_task, return_exceptions=True)
+    return {"config": vars(args), **results, "scheduler": scheduler.stats()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure light-tenant tail latency next to a bursting tenant.")
+    parser.add_argument("--capacity", type=int, default=16, help="Concurrent streams the fake upstream accepts.")
+    parser.add_argument("--heavy-concurrency", type=int, default=64)
+    parser.add_argument("--light-concurrency", type=int, default=2)
+    parser.add_argument("--light-requests", type=int, default=100)
+    parser.add_argument("--first-token-ms", type=float, default=50.0)
+    parser.add_argument("--tokens", type=int, default=20)
+    parser.add_argument("--token-ms", type=float, default=5.0)
+    print(json.dumps(asyncio.run(main(parser.parse_args())), indent=2))
@@ -0,0 +1,475 @@
+# AI_Amend 2026-10-17 幂等 GET 路由的响应缓存：LRU/TTL 与 Redis 两种后端、ETag/304、single-flight、按 tag 失效
+"""
+用法一：装饰器，缓存单个路由（推荐）
+
+    from .cache import cached, response_cache
+
+    @app.get("/items/{item_id}")
+    @cached(ttl=30, tags=["item:{item_id}"])
+    async def get_item(item_id: int):
+        ...
+
+    # 数据变更后按 tag 失效
+    await response_cache.invalidate_tags([f"item:{item_id}"])
+
+用法二：中间件，按路径前缀缓存整段响应
+
+    app.add_middleware(CacheMiddleware, cache=response_cache, prefixes=("/public/",), ttl=10)
+
+两种方式都会生成 ETag 与 Cache-Control（默认 private），命中 If-None-Match 时返回 304；
+同一个 key 的并发未命中只会执行一次路由函数（single-flight），其余请求等待其结果。
+带 Authorization / Cookie 的请求默认不走缓存（响应可能因人而异），除非这两个头列在 vary 中参与 key。
+"""
+import asyncio
+import functools
+import hashlib
+import inspect
+import json
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from starlette.concurrency import run_in_threadpool
+
+from .lifecycle import resources
+
+CACHEABLE_METHODS = ("GET", "HEAD")
+# 带这些请求头的响应通常因用户而异，未列入 vary 时不缓存
+CREDENTIAL_HEADERS = ("authorization", "cookie")
+
+
+@dataclass
+class CachedResponse:
+    status: int
+    body: bytes
+    media_type: str
+    etag: str
+    headers: List[Tuple[str, str]] = field(default_factory=list)
+    created_at: float = field(default_factory=time.time)
+
+    def dumps(self) -> bytes:
+        meta = json.dumps({
+            "status": self.status,
+            "media_type": self.media_type,
+            "etag": self.etag,
+            "headers": self.headers,
+            "created_at": self.created_at,
+        }).encode("utf-8")
+        return meta + b"\n" + self.body
+
+    @classmethod
+    def loads(cls, data: bytes) -> "CachedResponse":
+        meta, body = data.split(b"\n", 1)
+        meta = json.loads(meta)
+        return cls(
+            status=meta["status"],
+            body=body,
+            media_type=meta["media_type"],
+            etag=meta["etag"],
+            headers=[tuple(h) for h in meta["headers"]],
+            created_at=meta["created_at"],
+        )
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+
+class CacheBackend:
+    """缓存后端接口，值为 CachedResponse。"""
+
+    async def get(self, key: str) -> Optional[CachedResponse]:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: CachedResponse, ttl: float, tags: Iterable[str] = ()) -> None:
+        raise NotImplementedError
+
+    async def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    async def invalidate_tags(self, tags: Iterable[str]) -> int:
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+
+class MemoryCacheBackend(CacheBackend):
+    """进程内 LRU + TTL，另维护 tag -> keys 索引。多 worker 部署时各进程独立。"""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, Tuple[float, CachedResponse, Tuple[str, ...]]]" = OrderedDict()
+        self._tags: Dict[str, Set[str]] = {}
+
+    async def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value, _ = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    async def set(self, key, value, ttl, tags=()):
+        if key in self._data:
+            self._remove(key)
+        tags = tuple(tags)
+        self._data[key] = (time.monotonic() + ttl, value, tags)
+        for tag in tags:
+            self._tags.setdefault(tag, set()).add(key)
+        while len(self._data) > self.max_entries:
+            self._remove(next(iter(self._data)))
+
+    async def delete(self, key):
+        if key in self._data:
+            self._remove(key)
+
+    async def invalidate_tags(self, tags):
+        removed = 0
+        for tag in tags:
+            for key in self._tags.pop(tag, ()):
+                if key in self._data:
+                    self._remove(key)
+                    removed += 1
+        return removed
+
+    def _remove(self, key):
+        _, _, tags = self._data.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+class RedisCacheBackend(CacheBackend):
+    """
+    基于 Redis 协议的后端（SET EX 原生过期），多 worker / 多实例共享。
+
+    client 为 redis.asyncio.Redis（decode_responses=False），tag 用集合记录所属 key。
+    """
+
+    def __init__(self, client, prefix: str = "rcache:"):
+        self.client = client
+        self.prefix = prefix
+
+    async def get(self, key):
+        data = await self.client.get(self.prefix + key)
+        return CachedResponse.loads(data) if data is not None else None
+
+    async def set(self, key, value, ttl, tags=()):
+        pipe = self.client.pipeline(transaction=False)
+        pipe.set(self.prefix + key, value.dumps(), ex=max(1, int(ttl)))
+        for tag in tags:
+            tag_key = f"{self.prefix}tag:{tag}"
+            pipe.sadd(tag_key, key)
+            # tag 集合只是索引，给足够长的过期时间，防止残留；失效时成员 key 不存在也无妨
+            pipe.expire(tag_key, max(86400, int(ttl)))
+        await pipe.execute()
+
+    async def delete(self, key):
+        await self.client.delete(self.prefix + key)
+
+    async def invalidate_tags(self, tags):
+        removed = 0
+        for tag in tags:
+            tag_key = f"{self.prefix}tag:{tag}"
+            keys = await self.client.smembers(tag_key)
+            if keys:
+                removed += await self.client.delete(*(self.prefix + k.decode() for k in keys))
+            await self.client.delete(tag_key)
+        return removed
+
+    async def close(self):
+        await self.client.aclose()
+
+
+class ResponseCache:
+    """后端之上的 single-flight 层与统计。"""
+
+    def __init__(self, backend: CacheBackend, default_ttl: float = 60.0):
+        self.backend = backend
+        self.default_ttl = default_ttl
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    async def get_or_compute(self, key: str, producer: Callable[[], Awaitable[Optional[CachedResponse]]],
+                             ttl: Optional[float] = None, tags: Iterable[str] = ()) -> Tuple[Optional[CachedResponse], str]:
+        """
+        返回 (响应, 状态)，状态为 HIT / MISS / COALESCED；producer 返回 None 表示该响应不可缓存。
+
+        领头请求被取消（客户端断开等）时，合并等待的请求不跟着失败：重新查一次缓存，其中一个成为新的领头请求。
+        """
+        while True:
+            value = await self.backend.get(key)
+            if value is not None:
+                self.hits += 1
+                return value, "HIT"
+
+            waiter = self._inflight.get(key)
+            if waiter is None:
+                break
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(waiter), "COALESCED"
+            except asyncio.CancelledError:
+                # 只有领头请求被取消、本任务自身没有被取消时才重试
+                if not waiter.cancelled() or asyncio.current_task().cancelling():
+                    raise
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await producer()
+            if value is not None:
+                await self.backend.set(key, value, self.default_ttl if ttl is None else ttl, tags)
+            future.set_result(value)
+            return value, "MISS"
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # 没有等待者时也标记为已取回，避免 "exception was never retrieved"
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def invalidate_tags(self, tags: Iterable[str]) -> int:
+        return await self.backend.invalidate_tags(list(tags))
+
+    async def delete(self, key: str) -> None:
+        await self.backend.delete(key)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "coalesced": self.coalesced,
+                "inflight": len(self._inflight)}
+
+
+def create_response_cache() -> ResponseCache:
+    """根据环境变量 CACHE_BACKEND (memory | redis) 创建响应缓存。"""
+    ttl = float(os.getenv("CACHE_DEFAULT_TTL", "60"))
+    if os.getenv("CACHE_BACKEND", "memory") == "redis":
+        import redis.asyncio as redis
+
+        client = redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+        return ResponseCache(RedisCacheBackend(client), default_ttl=ttl)
+    return ResponseCache(MemoryCacheBackend(int(os.getenv("CACHE_MAX_ENTRIES", "1024"))), default_ttl=ttl)
+
+
+response_cache = create_response_cache()
+# AI_Amend 2026-10-17 退出时关闭缓存后端（Redis 连接）
+resources.register("response_cache", stop=response_cache.backend.close)
+
+
+def request_key(request: Request, vary: Iterable[str] = ()) -> str:
+    """路径 + 排序后的查询参数 + vary 指定的请求头。"""
+    parts = [request.url.path]
+    if request.query_params:
+        parts.append("?" + "&".join(f"{k}={v}" for k, v in sorted(request.query_params.multi_items())))
+    for header in vary:
+        parts.append(f"|{header.lower()}={request.headers.get(header, '')}")
+    return "".join(parts)
+
+
+def has_credentials(request: Request, vary: Iterable[str] = ()) -> bool:
+    """请求带 Authorization / Cookie 且它们没有参与缓存 key。"""
+    varied = {header.lower() for header in vary}
+    return any(header in request.headers and header not in varied for header in CREDENTIAL_HEADERS)
+
+
+def format_tags(tags: Iterable[str], params: dict) -> List[str]:
+    """用路径 / 查询参数填充 tag 模板，缺少参数的 tag 跳过（不让缓存层把请求变成 500）。"""
+    formatted = []
+    for tag in tags:
+        try:
+            formatted.append(tag.format_map(params))
+        except (KeyError, IndexError):
+            continue
+    return formatted
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+def build_response(request: Request, value: CachedResponse, state: str, ttl: float,
+                   cache_control: Optional[str]) -> Response:
+    headers = dict(value.headers)
+    headers["ETag"] = value.etag
+    headers["X-Cache"] = state
+    if cache_control is not None:
+        headers["Cache-Control"] = cache_control.format(ttl=int(ttl))
+    if _etag_matches(request, value.etag):
+        return Response(status_code=304, headers={k: v for k, v in headers.items()
+                                                  if k in ("ETag", "Cache-Control", "X-Cache")})
+    return Response(content=value.body, status_code=value.status, media_type=value.media_type, headers=headers)
+
+
+def _to_cached(result) -> Optional[CachedResponse]:
+    if isinstance(result, Response):
+        body = getattr(result, "body", None)
+        # 流式响应 / 非 200 / 设置 cookie 的响应不缓存
+        if body is None or result.status_code != 200 or "set-cookie" in result.headers:
+            return None
+        headers = [(k, v) for k, v in result.headers.items()
+                   if k.lower() not in ("content-length", "content-type", "etag", "cache-control")]
+        media_type = result.headers.get("content-type", result.media_type or "application/octet-stream")
+        return CachedResponse(200, body, media_type, make_etag(body), headers)
+    body = json.dumps(jsonable_encoder(result), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return CachedResponse(200, body, "application/json", make_etag(body))
+
+
+def cached(ttl: Optional[float] = None, tags: Iterable[str] = (), vary: Iterable[str] = (),
+           cache_control: Optional[str] = "private, max-age={ttl}",
+           key_builder: Optional[Callable[[Request], str]] = None,
+           cache: Optional[ResponseCache] = None):
+    """
+    缓存路由响应的装饰器，放在 @app.get(...) 下方。
+
+    Args:
+        ttl: 过期秒数，默认使用缓存实例的 default_ttl。
+        tags: 失效用的 tag，可引用路径 / 查询参数，如 "item:{item_id}"。
+        vary: 参与缓存 key 的请求头，如 ("Accept-Language",)。
+        cache_control: Cache-Control 模板，{ttl} 会被替换；None 表示不设置。
+            默认 private，只允许浏览器缓存；确认响应与用户无关时可改为 "public, max-age={ttl}"。
+        key_builder: 自定义缓存 key。
+        cache: 缓存实例，默认使用模块级 response_cache。
+
+    非 Response 返回值用 jsonable_encoder 序列化为 JSON 缓存，命中时直接返回字节，不再经过 response_model。
+    """
+    tags = tuple(tags)
+    vary = tuple(vary)
+
+    def decorator(func):
+        signature = inspect.signature(func)
+        request_param = next((name for name, p in signature.parameters.items()
+                              if p.annotation is Request), None)
+        injected = request_param is None
+        if injected:
+            # 被装饰函数没有声明 Request 参数时追加一个，让 FastAPI 注入
+            request_param = "_cache_request"
+            signature = signature.replace(parameters=[
+                *signature.parameters.values(),
+                inspect.Parameter(request_param, inspect.Parameter.KEYWORD_ONLY, annotation=Request),
+            ])
+        is_coroutine = inspect.iscoroutinefunction(func)
+
+        async def call(args, kwargs):
+            if is_coroutine:
+                return await func(*args, **kwargs)
+            return await run_in_threadpool(func, *args, **kwargs)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            request: Request = kwargs.pop(request_param) if injected else kwargs[request_param]
+            if request.method not in CACHEABLE_METHODS or (key_builder is None and has_credentials(request, vary)):
+                return await call(args, kwargs)
+
+            store = cache or response_cache
+            effective_ttl = store.default_ttl if ttl is None else ttl
+            key = key_builder(request) if key_builder else request_key(request, vary)
+            entry_tags = format_tags(tags, {**request.query_params, **request.path_params})
+
+            result = None
+
+            async def producer():
+                nonlocal result
+                result = await call(args, kwargs)
+                return _to_cached(result)
+
+            value, state = await store.get_or_compute(key, producer, effective_ttl, entry_tags)
+            if value is None:
+                # 不可缓存的响应：发起者直接返回原结果，并发等待者各自重新执行
+                return result if state == "MISS" else await call(args, kwargs)
+            return build_response(request, value, state, effective_ttl, cache_control)
+
+        wrapper.__signature__ = signature
+        return wrapper
+
+    return decorator
+
+
+class CacheMiddleware:
+    """
+    纯 ASGI 中间件：对 prefixes 下的 GET / HEAD 请求缓存完整响应（仅 200、无 Set-Cookie、
+    未声明 no-store / private 的响应），并统一处理 ETag / 304。
+    已经由 @cached 处理过的路由（带 X-Cache 头）不会重复缓存。
+
+    prefixes 默认为空（不缓存任何路径），需显式列出可缓存的前缀，避免把 /metrics、/readyz 等也缓存起来；
+    带 Authorization / Cookie（且未列入 vary）的请求直接透传。
+    """
+
+    def __init__(self, app, cache: Optional[ResponseCache] = None, prefixes: Tuple[str, ...] = (),
+                 ttl: Optional[float] = None, vary: Iterable[str] = (),
+                 cache_control: Optional[str] = "private, max-age={ttl}"):
+        self.app = app
+        self.cache = cache or response_cache
+        self.prefixes = tuple(prefixes)
+        self.ttl = self.cache.default_ttl if ttl is None else ttl
+        self.vary = tuple(vary)
+        self.cache_control = cache_control
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or scope["method"] not in CACHEABLE_METHODS
+                or not self.prefixes or not scope["path"].startswith(self.prefixes)):
+            return await self.app(scope, receive, send)
+
+        request = Request(scope, receive)
+        if has_credentials(request, self.vary):
+            return await self.app(scope, receive, send)
+        passthrough = None
+
+        async def producer():
+            nonlocal passthrough
+            start, chunks = None, []
+
+            async def capture(message):
+                nonlocal start
+                if message["type"] == "http.response.start":
+                    start = message
+                else:
+                    chunks.append(message.get("body", b""))
+
+            await self.app(scope, receive, capture)
+            body = b"".join(chunks)
+            headers = [(k.decode("latin-1"), v.decode("latin-1")) for k, v in start.get("headers", [])]
+            lowered = {k.lower(): v for k, v in headers}
+            cache_control = lowered.get("cache-control", "")
+            if (start["status"] != 200 or "set-cookie" in lowered or "x-cache" in lowered
+                    or "no-store" in cache_control or "private" in cache_control):
+                passthrough = (start, body)
+                return None
+            kept = [(k, v) for k, v in headers
+                    if k.lower() not in ("content-length", "content-type", "etag", "cache-control")]
+            media_type = lowered.get("content-type", "application/octet-stream")
+            return CachedResponse(200, body, media_type, make_etag(body), kept)
+
+        value, state = await self.cache.get_or_compute(
+            request_key(request, self.vary), producer, self.ttl
+        )
+        if value is None:
+            if passthrough is None:
+                # 等待的那次请求结果不可缓存，本请求自己执行
+                return await self.app(scope, receive, send)
+            start, body = passthrough
+            await send(start)
+            await send({"type": "http.response.body", "body": body})
+            return
+        response = build_response(request, value, state, self.ttl, self.cache_control)
+        await response(scope, receive, send)
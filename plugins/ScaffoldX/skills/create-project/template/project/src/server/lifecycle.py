@@ -0,0 +1,159 @@
+# AI_Amend 2026-10-17 资源注册表：各模块登记 start / stop 与预热任务，lifespan 统一启动，预热完成后才标记就绪
+"""
+模块内登记（导入即生效）：
+
+    from .lifecycle import resources
+    resources.register("llm_upstream", upstream.start, upstream.stop)
+    resources.add_warmup("llm_upstream", upstream.warmup)
+
+server/__main__.py 的 lifespan 中：
+
+    await resources.start(stack)
+
+- 按登记顺序 start，退出时由 AsyncExitStack 按相反顺序 stop；start / stop / 预热函数可以是同步或异步的
+- 全部 start 之后并发执行预热任务（与上游预先建连、从磁盘载入热点缓存等），首个请求不再承担冷启动开销；
+  单个预热超时或失败只记录，不阻止启动（WARMUP_STRICT=1 时启动失败）
+- GET /healthz 存活检查；GET /readyz 在预热完成前与收到 SIGTERM 后返回 503，滚动发布时负载均衡据此摘流；
+  SHUTDOWN_DRAIN_SECONDS > 0 时收到 SIGTERM 先只摘流，等待该秒数（留给探针发现）后再交给 uvicorn 开始关闭
+"""
+import asyncio
+import inspect
+import os
+import signal
+import threading
+import time
+from contextlib import AsyncExitStack
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+
+async def _call(fn: Callable) -> None:
+    result = fn()
+    if inspect.isawaitable(result):
+        await result
+
+
+@dataclass
+class Resource:
+    name: str
+    start: Optional[Callable] = None
+    stop: Optional[Callable] = None
+
+
+class ResourceRegistry:
+    def __init__(self, warmup_enabled: bool = True, warmup_timeout: float = 30.0, strict: bool = False,
+                 drain_seconds: float = 0.0):
+        self.warmup_enabled = warmup_enabled
+        self.warmup_timeout = warmup_timeout
+        self.strict = strict
+        self.drain_seconds = drain_seconds
+        self.resources: List[Resource] = []
+        self.warmups: List[Tuple[str, Callable]] = []
+        self.warmup_report: Dict[str, dict] = {}
+        self.ready = False
+        self.started_at: Optional[float] = None
+        self.ready_at: Optional[float] = None
+
+    def register(self, name: str, start: Optional[Callable] = None, stop: Optional[Callable] = None) -> None:
+        self.resources.append(Resource(name, start, stop))
+
+    def add_warmup(self, name: str, fn: Callable) -> None:
+        self.warmups.append((name, fn))
+
+    async def _warm(self, name: str, fn: Callable) -> None:
+        started = time.perf_counter()
+        try:
+            result = fn()
+            if inspect.isawaitable(result):
+                await asyncio.wait_for(result, self.warmup_timeout)
+            status = "ok"
+        except Exception as e:
+            if self.strict:
+                raise
+            status = f"failed: {type(e).__name__}: {e}"
+        self.warmup_report[name] = {"status": status, "seconds": round(time.perf_counter() - started, 3)}
+
+    def _not_ready(self) -> None:
+        self.ready = False
+
+    def _install_sigterm(self, stack: AsyncExitStack) -> None:
+        """
+        uvicorn 收到 SIGTERM 后立即停止 accept 再执行 lifespan 关闭，_not_ready 来不及被探针看到。
+        在 uvicorn 的处理函数之前先摘流，再（延迟 drain_seconds 后）转交给原处理函数。
+        """
+        if threading.current_thread() is not threading.main_thread():
+            return  # 只能在主线程注册信号处理
+        loop = asyncio.get_running_loop()
+        previous = signal.getsignal(signal.SIGTERM)
+
+        def forward(signum, frame):
+            if callable(previous):
+                previous(signum, frame)
+            elif previous == signal.SIG_DFL:
+                signal.signal(signum, signal.SIG_DFL)
+                os.kill(os.getpid(), signum)
+
+        def on_sigterm(signum, frame):
+            self.ready = False
+            if self.drain_seconds > 0:
+                loop.call_soon_threadsafe(loop.call_later, self.drain_seconds, forward, signum, frame)
+            else:
+                forward(signum, frame)
+
+        signal.signal(signal.SIGTERM, on_sigterm)
+        stack.callback(signal.signal, signal.SIGTERM, previous)
+
+    async def start(self, stack: AsyncExitStack) -> None:
+        self.started_at = time.perf_counter()
+        for resource in self.resources:
+            if resource.start is not None:
+                await _call(resource.start)
+            if resource.stop is not None:
+                stack.push_async_callback(_call, resource.stop)
+        if self.warmup_enabled:
+            await asyncio.gather(*(self._warm(name, fn) for name, fn in self.warmups))
+        self.ready = True
+        self.ready_at = time.perf_counter()
+        self._install_sigterm(stack)
+        # 最后登记，退出时最先执行：先摘流再关闭资源
+        stack.callback(self._not_ready)
+
+    def report(self) -> str:
+        """启动时打印的资源与预热耗时。"""
+        lines = [f"[BOOT] resources: {', '.join(r.name for r in self.resources) or '-'}"]
+        for name, result in self.warmup_report.items():
+            lines.append(f"[BOOT] warmup {name}: {result['status']} ({result['seconds']}s)")
+        if self.ready_at is not None:
+            lines.append(f"[BOOT] ready in {self.ready_at - self.started_at:.3f}s")
+        return "\n".join(lines)
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "resources": [r.name for r in self.resources],
+            "warmup": self.warmup_report,
+        }
+
+
+resources = ResourceRegistry(
+    warmup_enabled=os.getenv("WARMUP_ENABLED", "1") == "1",
+    warmup_timeout=float(os.getenv("WARMUP_TIMEOUT", "30")),
+    strict=os.getenv("WARMUP_STRICT", "0") == "1",
+    drain_seconds=float(os.getenv("SHUTDOWN_DRAIN_SECONDS", "0")),
+)
+
+router = APIRouter()
+
+
+@router.get("/healthz", include_in_schema=False)
+async def healthz():
+    return {"status": "ok"}
+
+
+@router.get("/readyz", include_in_schema=False)
+async def readyz():
+    stats = resources.stats()
+    return JSONResponse(stats, status_code=200 if stats["ready"] else 503)
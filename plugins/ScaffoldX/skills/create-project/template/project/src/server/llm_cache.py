@@ -0,0 +1,350 @@
+# AI_Amend 2026-10-17 LLM 响应缓存：temperature=0 的相同请求直接回放，内存 LRU + SQLite 磁盘两级
+"""
+由 llm_proxy 的 /v1/chat/completions 自动使用（LLM_CACHE_ENABLED=0 关闭）。
+
+- 只缓存确定性请求：temperature == 0 且 n == 1；其余请求直接透传
+- key 为规范化请求体（键排序、去掉 user 字段）的哈希；透传客户端密钥时 key 里还包含密钥哈希，不同密钥互不共享
+- 流式与非流式分别缓存：流式命中时按原始 SSE 事件逐条回放，与上游返回的字节完全一致
+- 只有完整结束的响应才会写入（非流式 200；流式读到 data: [DONE]）
+- 请求头 Cache-Control: no-cache 跳过读取缓存（仍会写入新结果）
+- 统计在 /metrics（llm_cache_*）与 llm_cache.stats()
+"""
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from fastapi import Response
+from fastapi.responses import StreamingResponse
+
+from .lifecycle import resources
+
+# 不影响输出内容的字段
+IGNORED_FIELDS = ("user",)
+
+
+@dataclass
+class CachedCompletion:
+    body: bytes
+    media_type: str
+    stream: bool
+    expires_at: float
+    tokens: int = 0  # 上游 usage.total_tokens，命中时计入节省的 token 数
+
+    @property
+    def size(self) -> int:
+        return len(self.body)
+
+
+def usage_tokens(body: bytes, stream: bool) -> int:
+    """尽量从响应中取 usage.total_tokens（流式需要请求里带 stream_options.include_usage）。"""
+    try:
+        if not stream:
+            return int(json.loads(body).get("usage", {}).get("total_tokens") or 0)
+        for event in reversed(body.split(b"\n\n")):
+            if event.startswith(b"data: {") and b'"usage"' in event:
+                return int((json.loads(event[6:]).get("usage") or {}).get("total_tokens") or 0)
+    except (ValueError, AttributeError, TypeError):
+        pass
+    return 0
+
+
+class MemoryTier:
+    """按条目数与总字节数双重限制的 LRU。"""
+
+    def __init__(self, max_entries: int = 1000, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.evictions = 0
+        self._data: "OrderedDict[str, CachedCompletion]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key: str, now: float) -> Optional[CachedCompletion]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= now:
+            self._remove(key)
+            return None
+        self._data.move_to_end(key)
+        return entry
+
+    def set(self, key: str, entry: CachedCompletion) -> None:
+        if entry.size > self.max_bytes:
+            return
+        if key in self._data:
+            self._remove(key)
+        self._data[key] = entry
+        self.bytes += entry.size
+        while len(self._data) > self.max_entries or self.bytes > self.max_bytes:
+            self._remove(next(iter(self._data)))
+            self.evictions += 1
+
+    def _remove(self, key: str) -> None:
+        self.bytes -= self._data.pop(key).size
+
+
+class SQLiteTier:
+    """
+    磁盘层：单个 SQLite 文件（WAL），进程重启后仍可命中。
+
+    所有方法为同步调用，由 LLMResponseCache 放到线程中执行；总大小超过 max_bytes 时
+    先删过期条目，再按最近访问时间淘汰到 90%。
+    """
+
+    def __init__(self, path: str, max_bytes: int = 1024 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.evictions = 0
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def open(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            " key TEXT PRIMARY KEY, body BLOB NOT NULL, media_type TEXT NOT NULL, stream INTEGER NOT NULL,"
+            " tokens INTEGER NOT NULL, size INTEGER NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_accessed_at ON llm_cache (accessed_at)")
+        self._conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (time.time(),))
+        self.bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def get(self, key: str, now: float) -> Optional[CachedCompletion]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT body, media_type, stream, tokens, expires_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[4] <= now:
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self.bytes -= len(row[0])
+                return None
+            self._conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+        return CachedCompletion(body=row[0], media_type=row[1], stream=bool(row[2]), expires_at=row[4], tokens=row[3])
+
+    def set(self, key: str, entry: CachedCompletion) -> None:
+        if entry.size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, entry.body, entry.media_type, int(entry.stream), entry.tokens, entry.size,
+                 entry.expires_at, time.time()),
+            )
+            self.bytes += entry.size - (old[0] if old else 0)
+            if self.bytes > self.max_bytes:
+                self._evict()
+
+    def recent(self, limit: int, now: float) -> List[Tuple[str, CachedCompletion]]:
+        """最近访问的未过期条目，按访问时间从旧到新。"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, body, media_type, stream, tokens, expires_at FROM llm_cache"
+                " WHERE expires_at > ? ORDER BY accessed_at DESC LIMIT ?", (now, limit)
+            ).fetchall()
+        return [
+            (key, CachedCompletion(body=body, media_type=media_type, stream=bool(stream), expires_at=expires_at,
+                                   tokens=tokens))
+            for key, body, media_type, stream, tokens, expires_at in reversed(rows)
+        ]
+
+    def _evict(self) -> None:
+        now = time.time()
+        self._conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,))
+        self.bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        target = self.max_bytes * 0.9
+        while self.bytes > target:
+            rows = self._conn.execute(
+                "SELECT key, size FROM llm_cache ORDER BY accessed_at LIMIT 100"
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self.bytes <= target:
+                    break
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self.bytes -= size
+                self.evictions += 1
+
+
+class LLMResponseCache:
+    def __init__(self, memory: MemoryTier, disk: Optional[SQLiteTier] = None, ttl: float = 86400.0):
+        self.memory = memory
+        self.disk = disk
+        self.ttl = ttl
+        self._writes = set()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.stores = 0
+        self.saved_tokens = 0
+        self.saved_bytes = 0
+
+    def key_for(self, path: str, payload: dict, scope: Optional[str] = None) -> Optional[str]:
+        """不可缓存时返回 None（并计入 bypassed）。"""
+        temperature = payload.get("temperature")
+        if temperature is None or temperature != 0 or payload.get("n", 1) != 1:
+            self.bypassed += 1
+            return None
+        normalized = {k: v for k, v in payload.items() if k not in IGNORED_FIELDS}
+        normalized["stream"] = bool(normalized.get("stream"))
+        canonical = json.dumps([path, scope, normalized], sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.blake2b(canonical.encode("utf-8"), digest_size=20).hexdigest()
+
+    async def get(self, key: str) -> Optional[CachedCompletion]:
+        now = time.time()
+        entry = self.memory.get(key, now)
+        if entry is not None:
+            self.memory_hits += 1
+        elif self.disk is not None:
+            entry = await asyncio.to_thread(self.disk.get, key, now)
+            if entry is not None:
+                self.disk_hits += 1
+                self.memory.set(key, entry)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.saved_tokens += entry.tokens
+        self.saved_bytes += entry.size
+        return entry
+
+    def put(self, key: str, body: bytes, media_type: str, stream: bool) -> None:
+        """写入内存层，磁盘层在后台线程中写入，不阻塞响应结束。"""
+        if stream and b"data: [DONE]" not in body[-64:]:
+            return  # 未完整结束的流不缓存
+        entry = CachedCompletion(body=body, media_type=media_type, stream=stream,
+                                 expires_at=time.time() + self.ttl, tokens=usage_tokens(body, stream))
+        self.memory.set(key, entry)
+        self.stores += 1
+        if self.disk is not None:
+            task = asyncio.get_running_loop().create_task(asyncio.to_thread(self.disk.set, key, entry))
+            self._writes.add(task)
+            task.add_done_callback(self._write_done)
+
+    def _write_done(self, task: asyncio.Task) -> None:
+        # 后台写入的异常没有人 await，不取出会被静默吞掉（只在 GC 时打印一次 "exception was never retrieved"）
+        self._writes.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"[LLM_CACHE] disk write failed: {task.exception()!r}")
+
+    @staticmethod
+    async def _events(body: bytes):
+        # 按原始 SSE 事件边界逐条发出；异步生成器，不经过线程池
+        start = 0
+        while start < len(body):
+            end = body.find(b"\n\n", start)
+            end = len(body) if end < 0 else end + 2
+            yield body[start:end]
+            start = end
+
+    def replay(self, entry: CachedCompletion) -> Response:
+        headers = {"X-Cache": "HIT"}
+        if not entry.stream:
+            return Response(entry.body, media_type=entry.media_type, headers=headers)
+        return StreamingResponse(
+            self._events(entry.body),
+            media_type=entry.media_type,
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", **headers},
+        )
+
+    async def start(self) -> None:
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.open)
+
+    async def prime(self) -> int:
+        """把磁盘层最近访问的条目载入内存层（受内存层上限约束），重启后热点请求直接命中内存。"""
+        if self.disk is None:
+            return 0
+        entries = await asyncio.to_thread(self.disk.recent, self.memory.max_entries, time.time())
+        for key, entry in entries:
+            self.memory.set(key, entry)
+        return len(entries)
+
+    async def stop(self) -> None:
+        if self._writes:
+            await asyncio.gather(*self._writes, return_exceptions=True)
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.close)
+
+    def stats(self) -> dict:
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "stores": self.stores,
+            "saved_tokens": self.saved_tokens,
+            "saved_bytes": self.saved_bytes,
+            "memory_entries": len(self.memory),
+            "memory_bytes": self.memory.bytes,
+            "disk_bytes": self.disk.bytes if self.disk is not None else 0,
+            "evictions": self.memory.evictions + (self.disk.evictions if self.disk is not None else 0),
+        }
+
+    def prometheus_lines(self) -> List[str]:
+        s = self.stats()
+        return [
+            "# HELP llm_cache_lookups_total LLM response cache lookups by result.",
+            "# TYPE llm_cache_lookups_total counter",
+            f'llm_cache_lookups_total{{result="memory_hit"}} {s["memory_hits"]}',
+            f'llm_cache_lookups_total{{result="disk_hit"}} {s["disk_hits"]}',
+            f'llm_cache_lookups_total{{result="miss"}} {s["misses"]}',
+            f'llm_cache_lookups_total{{result="bypass"}} {s["bypassed"]}',
+            "# HELP llm_cache_saved_tokens_total Upstream tokens served from cache.",
+            "# TYPE llm_cache_saved_tokens_total counter",
+            f"llm_cache_saved_tokens_total {s['saved_tokens']}",
+            "# HELP llm_cache_bytes Bytes held per cache tier.",
+            "# TYPE llm_cache_bytes gauge",
+            f'llm_cache_bytes{{tier="memory"}} {s["memory_bytes"]}',
+            f'llm_cache_bytes{{tier="disk"}} {s["disk_bytes"]}',
+        ]
+
+
+def create_llm_cache() -> Optional[LLMResponseCache]:
+    """
+    LLM_CACHE_ENABLED=0 时返回 None。
+    LLM_CACHE_TTL / LLM_CACHE_MAX_ENTRIES / LLM_CACHE_MAX_MEMORY_MB / LLM_CACHE_DISK_PATH（默认为空，只用内存层）/ LLM_CACHE_DISK_MAX_MB
+    """
+    if os.getenv("LLM_CACHE_ENABLED", "1") == "0":
+        return None
+    memory = MemoryTier(
+        max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1000")),
+        max_bytes=int(float(os.getenv("LLM_CACHE_MAX_MEMORY_MB", "64")) * 1024 * 1024),
+    )
+    path = os.getenv("LLM_CACHE_DISK_PATH", "")
+    disk = SQLiteTier(path, int(float(os.getenv("LLM_CACHE_DISK_MAX_MB", "1024")) * 1024 * 1024)) if path else None
+    return LLMResponseCache(memory, disk, ttl=float(os.getenv("LLM_CACHE_TTL", "86400")))
+
+
+llm_cache = create_llm_cache()
+if llm_cache is not None:
+    # AI_Amend 2026-10-17 打开磁盘层并把热点条目载入内存；退出时等待未完成的写入
+    resources.register("llm_cache", llm_cache.start, llm_cache.stop)
+    resources.add_warmup("llm_cache", llm_cache.prime)
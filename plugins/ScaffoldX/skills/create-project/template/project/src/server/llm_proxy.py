@@ -0,0 +1,324 @@
+# AI_Amend 2026-10-17 OpenAI 兼容的上游代理：全局复用一个连接池，SSE 逐块转发，客户端断开即取消上游请求
+"""
+挂载方式（server/__main__.py 在 LLM_PROXY_ENABLED=1 时挂载，默认关闭）：
+
+    from .llm_proxy import router as llm_router
+    app.include_router(llm_router)
+    # upstream 在导入时登记到 lifecycle.resources，由 lifespan 统一启动 / 关闭
+
+- POST /v1/chat/completions  原样转发请求体到 {LLM_UPSTREAM_BASE}/chat/completions
+  stream=true 时逐块转发上游 SSE，不缓冲整段响应；下游写不出去时不再读取上游（背压）
+- 客户端断开时关闭上游响应，上游连接随之中止生成，不再消耗 token
+- 配置了 LLM_UPSTREAM_API_KEY 时统一使用服务端密钥，此时客户端必须携带 Authorization: Bearer {LLM_PROXY_TOKEN}
+  （未配置 LLM_PROXY_TOKEN 时返回 503，避免把服务端密钥开放给任何人）；否则透传客户端的 Authorization
+- 启用调度器（scheduler.py）时先排队申请上游名额，响应读完 / 流结束 / 客户端断开后归还
+"""
+import asyncio
+import hashlib
+import hmac
+import importlib.util
+import json
+import os
+from typing import Awaitable, Callable, Optional
+
+import httpx
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+
+from .lifecycle import resources
+from .llm_cache import llm_cache
+from .scheduler import request_key, request_lane, scheduler
+
+# 透传给上游的客户端请求头（其余如 Host / Content-Length 由 httpx 重新生成）
+FORWARD_HEADERS = ("authorization", "openai-organization", "openai-project", "x-request-id")
+# 回传给客户端的上游响应头
+RETURN_HEADERS = ("x-request-id", "openai-processing-ms", "retry-after")
+
+
+def _sse_error(message: str) -> bytes:
+    # 响应头已发出后无法再改状态码，用一条 SSE 错误事件结束流
+    return b"data: " + json.dumps({"error": {"message": message, "type": "upstream_error"}}).encode() + b"\n\n"
+
+
+class RelayResponse(StreamingResponse):
+    """
+    响应结束后一定执行 cleanup（关闭上游响应、归还调度名额）。
+
+    客户端在响应体开始发送前就断开时，Starlette 不会启动 body 生成器，生成器里的 finally 也就不会执行。
+    """
+
+    def __init__(self, content, cleanup: Callable[[], Awaitable[None]], **kwargs):
+        super().__init__(content, **kwargs)
+        self.cleanup = cleanup
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.cleanup()
+
+
+class LLMUpstream:
+    """
+    上游 HTTP 客户端，整个进程共用一个 httpx.AsyncClient（连接池 + keep-alive，安装了 h2 时走 HTTP/2 多路复用）。
+
+    read_timeout 是两次读到数据之间的最长间隔，流式响应不会因为总时长长而被误杀。
+    """
+
+    def __init__(self, base_url: str, api_key: Optional[str] = None, connect_timeout: float = 5.0,
+                 read_timeout: float = 120.0, max_connections: int = 100, max_keepalive: int = 20,
+                 http2: Optional[bool] = None, warmup_connections: int = 2):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.http2 = importlib.util.find_spec("h2") is not None if http2 is None else http2
+        self.warmup_connections = warmup_connections
+        self.client: Optional[httpx.AsyncClient] = None
+        self.requests = 0
+        self.errors = 0
+        self.disconnects = 0
+        self.active_streams = 0
+
+    async def start(self) -> None:
+        if self.client is not None:
+            return
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            http2=self.http2,
+            timeout=httpx.Timeout(
+                connect=self.connect_timeout,
+                read=self.read_timeout,
+                write=self.connect_timeout,
+                pool=self.connect_timeout,
+            ),
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive,
+                keepalive_expiry=60,
+            ),
+        )
+
+    async def stop(self) -> None:
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def warmup(self) -> None:
+        """
+        预先与上游建好连接（TCP + TLS；HTTP/2 时一条即可），首批请求不再承担握手耗时。
+        没有服务端密钥时跳过（/models 只会返回 401）；上游返回非 2xx 时抛错，预热报告记为 failed。
+        """
+        if not self.api_key:
+            return
+        n = min(1, self.warmup_connections) if self.http2 else self.warmup_connections
+        headers = {"authorization": f"Bearer {self.api_key}"}
+        responses = await asyncio.gather(*(self.client.get("/models", headers=headers) for _ in range(n)))
+        for response in responses:
+            response.raise_for_status()
+
+    def _headers(self, request: Request) -> dict:
+        headers = {k: v for k, v in request.headers.items() if k in FORWARD_HEADERS}
+        if self.api_key:
+            headers["authorization"] = f"Bearer {self.api_key}"
+        headers["content-type"] = "application/json"
+        headers["accept"] = request.headers.get("accept", "application/json")
+        return headers
+
+    async def send(self, path: str, body: bytes, request: Request) -> httpx.Response:
+        """发起请求并返回未读取响应体的 httpx.Response（调用方负责 aclose）。"""
+        if self.client is None:
+            raise HTTPException(503, "upstream client not started")
+        self.requests += 1
+        upstream_request = self.client.build_request("POST", path, content=body, headers=self._headers(request))
+        try:
+            return await self.client.send(upstream_request, stream=True)
+        except httpx.TimeoutException:
+            self.errors += 1
+            raise HTTPException(504, "upstream timeout")
+        except httpx.TransportError as e:
+            self.errors += 1
+            raise HTTPException(502, f"upstream unavailable: {type(e).__name__}")
+
+    @staticmethod
+    def _return_headers(response: httpx.Response) -> dict:
+        return {k: response.headers[k] for k in RETURN_HEADERS if k in response.headers}
+
+    async def read(self, response: httpx.Response, sink: Optional[Callable[[bytes], None]] = None,
+                   headers: Optional[dict] = None, on_close: Optional[Callable[[], None]] = None) -> Response:
+        """非流式：读完整个上游响应再返回（单个 JSON，体积有限）；200 时把响应体交给 sink。"""
+        try:
+            content = await response.aread()
+        except httpx.TimeoutException:
+            self.errors += 1
+            raise HTTPException(504, "upstream timeout")
+        except httpx.TransportError as e:
+            self.errors += 1
+            raise HTTPException(502, f"upstream unavailable: {type(e).__name__}")
+        finally:
+            await response.aclose()
+            if on_close is not None:
+                on_close()
+        media_type = response.headers.get("content-type", "application/json")
+        if sink is not None and response.status_code == 200:
+            sink(content)
+        return Response(
+            content,
+            status_code=response.status_code,
+            media_type=media_type,
+            headers={**self._return_headers(response), **(headers or {})},
+        )
+
+    async def relay(self, response: httpx.Response, sink: Optional[Callable[[bytes], None]] = None,
+                    on_close: Optional[Callable[[], None]] = None):
+        """
+        逐块转发上游响应体。
+
+        StreamingResponse 每发出一块才会向生成器要下一块，下游慢时上游读取随之暂停；
+        客户端断开时 Starlette 取消该生成器，finally 中关闭上游响应。
+        给了 sink 时顺带保留已转发的块，流正常读完后把完整响应体交给 sink（断开 / 出错则丢弃）。
+        """
+        self.active_streams += 1
+        chunks = [] if sink is not None else None
+        try:
+            async for chunk in response.aiter_bytes():
+                if chunks is not None:
+                    chunks.append(chunk)
+                yield chunk
+            if chunks is not None:
+                sink(b"".join(chunks))
+        except (httpx.TimeoutException, httpx.TransportError) as e:
+            self.errors += 1
+            yield _sse_error(f"upstream stream interrupted: {type(e).__name__}")
+        except (GeneratorExit, asyncio.CancelledError):
+            self.disconnects += 1
+            raise
+        finally:
+            self.active_streams -= 1
+            await response.aclose()
+            if on_close is not None:
+                on_close()
+
+    def stream(self, response: httpx.Response, sink: Optional[Callable[[bytes], None]] = None,
+               headers: Optional[dict] = None, on_close: Optional[Callable[[], None]] = None) -> StreamingResponse:
+        async def cleanup() -> None:
+            await response.aclose()
+            if on_close is not None:
+                on_close()
+
+        return RelayResponse(
+            self.relay(response, sink, on_close),
+            cleanup,
+            status_code=response.status_code,
+            media_type=response.headers.get("content-type", "text/event-stream"),
+            headers={
+                "Cache-Control": "no-cache",
+                "X-Accel-Buffering": "no",  # 关闭 nginx 缓冲，逐块下发
+                **self._return_headers(response),
+                **(headers or {}),
+            },
+        )
+
+    async def forward(self, path: str, body: bytes, request: Request, stream: bool,
+                      sink: Optional[Callable[[bytes], None]] = None, headers: Optional[dict] = None) -> Response:
+        if scheduler is None:
+            response, on_close = await self.send(path, body, request), None
+        else:
+            # AI_Amend 2026-10-17 按 key 公平排队；429 / 5xx 在向客户端发送任何字节前重试
+            key = request_key(request, credentials=not self.api_key)
+            response, slot = await scheduler.send(key, request_lane(request), lambda: self.send(path, body, request))
+            on_close = slot.release
+        if stream and response.status_code < 400:
+            return self.stream(response, sink, headers, on_close)
+        return await self.read(response, sink, headers, on_close)
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "disconnects": self.disconnects,
+            "active_streams": self.active_streams,
+            "http2": self.http2,
+        }
+
+
+def create_upstream() -> LLMUpstream:
+    """
+    LLM_UPSTREAM_BASE（默认取 BIANXIE_BASE）/ LLM_UPSTREAM_API_KEY（默认取 BIANXIE_API_KEY）
+    LLM_CONNECT_TIMEOUT / LLM_READ_TIMEOUT / LLM_MAX_CONNECTIONS / LLM_MAX_KEEPALIVE / LLM_HTTP2 (auto | 1 | 0)
+    LLM_WARMUP_CONNECTIONS 启动时预先建立的上游连接数（0 不预热）
+    """
+    http2 = os.getenv("LLM_HTTP2", "auto")
+    return LLMUpstream(
+        base_url=os.getenv("LLM_UPSTREAM_BASE") or os.getenv("BIANXIE_BASE", "https://api.openai.com/v1"),
+        api_key=os.getenv("LLM_UPSTREAM_API_KEY") or os.getenv("BIANXIE_API_KEY") or None,
+        connect_timeout=float(os.getenv("LLM_CONNECT_TIMEOUT", "5")),
+        read_timeout=float(os.getenv("LLM_READ_TIMEOUT", "120")),
+        max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", "100")),
+        max_keepalive=int(os.getenv("LLM_MAX_KEEPALIVE", "20")),
+        http2=None if http2 == "auto" else http2 == "1",
+        warmup_connections=int(os.getenv("LLM_WARMUP_CONNECTIONS", "2")),
+    )
+
+
+upstream = create_upstream()
+# AI_Amend 2026-10-17 进程内共用的连接池：启动时建连预热，退出时关闭
+resources.register("llm_upstream", upstream.start, upstream.stop)
+resources.add_warmup("llm_upstream", upstream.warmup)
+
+# AI_Amend 2026-10-17 使用服务端密钥时客户端须携带的共享令牌
+PROXY_TOKEN = os.getenv("LLM_PROXY_TOKEN") or None
+
+
+async def require_proxy_token(request: Request) -> None:
+    """使用服务端密钥时校验 Authorization: Bearer {LLM_PROXY_TOKEN}；透传客户端密钥时由上游鉴权。"""
+    if not upstream.api_key:
+        return
+    if PROXY_TOKEN is None:
+        raise HTTPException(503, "LLM_PROXY_TOKEN is not configured")
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode("utf-8"), PROXY_TOKEN.encode("utf-8")):
+        raise HTTPException(401, "invalid proxy token", headers={"WWW-Authenticate": "Bearer"})
+
+
+router = APIRouter()
+
+
+async def read_payload(request: Request):
+    body = await request.body()
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        raise HTTPException(400, "request body must be JSON")
+    if not isinstance(payload, dict):
+        raise HTTPException(400, "request body must be a JSON object")
+    return body, payload
+
+
+def _cache_scope(request: Request) -> Optional[str]:
+    # 透传客户端密钥时按密钥隔离缓存，避免不同账号（不同私有模型 / 配额）共享结果
+    if upstream.api_key:
+        return None
+    authorization = request.headers.get("authorization", "")
+    return hashlib.blake2b(authorization.encode("utf-8"), digest_size=12).hexdigest()
+
+
+@router.post("/v1/chat/completions", dependencies=[Depends(require_proxy_token)])
+async def chat_completions(request: Request):
+    body, payload = await read_payload(request)
+    stream = bool(payload.get("stream"))
+    # AI_Amend 2026-10-17 temperature=0 的请求先查响应缓存，未命中时边转发边写入
+    key = llm_cache.key_for("/chat/completions", payload, _cache_scope(request)) if llm_cache is not None else None
+    if key is None:
+        return await upstream.forward("/chat/completions", body, request, stream)
+    if "no-cache" not in request.headers.get("cache-control", ""):
+        entry = await llm_cache.get(key)
+        if entry is not None and entry.stream == stream:
+            return llm_cache.replay(entry)
+
+    def sink(content: bytes) -> None:
+        llm_cache.put(key, content, "text/event-stream" if stream else "application/json", stream)
+
+    return await upstream.forward("/chat/completions", body, request, stream, sink=sink, headers={"X-Cache": "MISS"})
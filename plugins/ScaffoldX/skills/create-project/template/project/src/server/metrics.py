@@ -0,0 +1,336 @@
+# AI_Amend 2026-10-17 内置观测：按路由的延迟直方图 / 在途请求数 / 响应大小 + 采样 profiler
+"""
+挂载方式（server/__main__.py 已默认挂载，METRICS_ENABLED=0 可关闭）：
+
+    from .metrics import install_metrics
+    install_metrics(app)
+
+- GET  /metrics                  Prometheus 文本格式
+- GET  /admin/profiler           profiler 状态
+- POST /admin/profiler/start     开始采样（interval_ms / duration_s）
+- POST /admin/profiler/stop      停止并返回 collapsed stacks，可直接交给 flamegraph.pl / speedscope
+
+指标只在当前进程内累计，多 worker 部署时每个 worker 各自暴露一份。
+"""
+import hmac
+import math
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Tuple
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+
+# 直方图范围 2^-13 s (~122µs) 到 2^6 s (64s)，每个 2 倍区间再线性切 SUB_BUCKETS 份（HDR 风格 log-linear）
+MIN_EXP = -13
+MAX_EXP = 6
+SUB_BUCKETS = 2
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+class LatencyHistogram:
+    """
+    固定桶的 log-linear 直方图，record 为 O(1)：frexp 取指数定位区间，尾数定位子桶。
+    相对误差不超过 1 / SUB_BUCKETS。
+    """
+
+    __slots__ = ("counts", "count", "sum")
+
+    n_buckets = (MAX_EXP - MIN_EXP) * SUB_BUCKETS
+    # 各桶上界（秒），最后一个桶之外的值记入 +Inf
+    bounds = tuple(
+        2.0 ** (MIN_EXP + i // SUB_BUCKETS) * (1 + (i % SUB_BUCKETS + 1) / SUB_BUCKETS)
+        for i in range(n_buckets)
+    )
+
+    def __init__(self):
+        self.counts = [0] * (self.n_buckets + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    @classmethod
+    def bucket_index(cls, value: float) -> int:
+        if value <= 0:
+            return 0
+        mantissa, exp = math.frexp(value)  # value = mantissa * 2**exp, mantissa ∈ [0.5, 1)
+        octave = exp - 1
+        if octave < MIN_EXP:
+            return 0
+        if octave >= MAX_EXP:
+            return cls.n_buckets
+        sub = int((mantissa * 2 - 1) * SUB_BUCKETS)
+        return (octave - MIN_EXP) * SUB_BUCKETS + sub
+
+    def record(self, value: float) -> None:
+        self.counts[self.bucket_index(value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, q: float) -> float:
+        """近似分位数（返回所在桶的上界），q ∈ [0, 1]。"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank and c:
+                return self.bounds[i] if i < self.n_buckets else math.inf
+        return math.inf
+
+
+class RouteStats:
+    __slots__ = ("latency", "statuses", "response_bytes")
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.statuses: Counter = Counter()
+        self.response_bytes = 0
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.routes: Dict[Tuple[str, str], RouteStats] = {}
+        self.in_flight = 0
+        self.started_at = time.time()
+        # 其它模块的附加指标：无参函数，返回 Prometheus 文本行
+        self.collectors: List[Callable[[], List[str]]] = []
+
+    def observe(self, method: str, route: str, status: int, seconds: float, size: int) -> None:
+        key = (method, route)
+        stats = self.routes.get(key)
+        if stats is None:
+            stats = self.routes[key] = RouteStats()
+        stats.latency.record(seconds)
+        stats.statuses[status] += 1
+        stats.response_bytes += size
+
+    def summary(self) -> dict:
+        return {
+            f"{method} {route}": {
+                "count": s.latency.count,
+                "p50": s.latency.percentile(0.50),
+                "p95": s.latency.percentile(0.95),
+                "p99": s.latency.percentile(0.99),
+            }
+            for (method, route), s in self.routes.items()
+        }
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_prometheus(registry: MetricsRegistry, profiler: Optional["SamplingProfiler"] = None) -> str:
+    lines = [
+        "# HELP http_requests_in_flight Requests currently being served.",
+        "# TYPE http_requests_in_flight gauge",
+        f"http_requests_in_flight {registry.in_flight}",
+        "# HELP http_request_duration_seconds Request latency by route template.",
+        "# TYPE http_request_duration_seconds histogram",
+    ]
+    bounds = [repr(b) for b in LatencyHistogram.bounds] + ["+Inf"]
+    items = sorted(registry.routes.items())
+    for (method, route), s in items:
+        labels = f'method="{method}",route="{_escape(route)}"'
+        cumulative = 0
+        for le, c in zip(bounds, s.latency.counts):
+            cumulative += c
+            lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+        lines.append(f"http_request_duration_seconds_sum{{{labels}}} {s.latency.sum}")
+        lines.append(f"http_request_duration_seconds_count{{{labels}}} {s.latency.count}")
+
+    lines += [
+        "# HELP http_requests_total Completed requests by route template and status.",
+        "# TYPE http_requests_total counter",
+    ]
+    for (method, route), s in items:
+        for status, c in sorted(s.statuses.items()):
+            lines.append(
+                f'http_requests_total{{method="{method}",route="{_escape(route)}",status="{status}"}} {c}'
+            )
+
+    lines += [
+        "# HELP http_response_size_bytes Response body bytes by route template.",
+        "# TYPE http_response_size_bytes summary",
+    ]
+    for (method, route), s in items:
+        labels = f'method="{method}",route="{_escape(route)}"'
+        lines.append(f"http_response_size_bytes_sum{{{labels}}} {s.response_bytes}")
+        lines.append(f"http_response_size_bytes_count{{{labels}}} {s.latency.count}")
+
+    if profiler is not None:
+        lines += [
+            "# HELP profiler_running Whether the sampling profiler is active.",
+            "# TYPE profiler_running gauge",
+            f"profiler_running {int(profiler.running)}",
+        ]
+    for collect in registry.collectors:
+        lines += collect()
+    return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """
+    纯 ASGI 中间件（不经过 BaseHTTPMiddleware，不缓冲响应体，流式响应也适用）。
+
+    路由模板取自 FastAPI 路由匹配后写入的 scope["route"]，例如 /items/{item_id}，
+    未匹配的请求统一记为 <unmatched>，避免路径参数导致指标基数爆炸。
+    """
+
+    def __init__(self, app, registry: MetricsRegistry):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        registry = self.registry
+        status = 500
+        size = 0
+
+        async def send_wrapper(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        registry.in_flight += 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            registry.in_flight -= 1
+            route = scope.get("route")
+            registry.observe(
+                scope["method"],
+                getattr(route, "path", UNMATCHED_ROUTE),
+                status,
+                time.perf_counter() - start,
+                size,
+            )
+
+
+class SamplingProfiler:
+    """
+    统计采样 profiler：后台线程每 interval 秒用 sys._current_frames() 抓取所有线程的调用栈，
+    累计为 collapsed stacks（"frame;frame;frame count"），对被采样代码没有插桩开销。
+    """
+
+    def __init__(self, max_depth: int = 64):
+        self.max_depth = max_depth
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.interval = 0.01
+        self.started_at: Optional[float] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval: float = 0.01, duration: float = 30.0) -> None:
+        if self.running:
+            raise RuntimeError("profiler already running")
+        self.stacks = Counter()
+        self.samples = 0
+        self.interval = interval
+        self.started_at = time.time()
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(interval, time.monotonic() + duration),
+            name="sampling-profiler", daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self) -> str:
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        return self.collapsed()
+
+    def _run(self, interval: float, deadline: float) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(interval) and time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                names = []
+                while frame is not None and len(names) < self.max_depth:
+                    code = frame.f_code
+                    names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(names))] += 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def status(self) -> dict:
+        return {
+            "running": self.running,
+            "interval": self.interval,
+            "samples": self.samples,
+            "unique_stacks": len(self.stacks),
+            "started_at": self.started_at,
+        }
+
+
+registry = MetricsRegistry()
+profiler = SamplingProfiler()
+
+router = APIRouter()
+
+
+def _require_admin(request: Request) -> None:
+    """设置了 METRICS_ADMIN_TOKEN 时校验 X-Admin-Token 请求头，否则只允许本机访问。"""
+    token = os.getenv("METRICS_ADMIN_TOKEN")
+    if token:
+        if not hmac.compare_digest(request.headers.get("x-admin-token", ""), token):
+            raise HTTPException(status_code=403, detail="invalid admin token")
+    elif request.client is None or request.client.host not in ("127.0.0.1", "::1", "localhost"):
+        raise HTTPException(status_code=403, detail="admin routes are local-only without METRICS_ADMIN_TOKEN")
+
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(
+        render_prometheus(registry, profiler),
+        media_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+
+@router.get("/admin/profiler", include_in_schema=False)
+async def profiler_status(request: Request):
+    _require_admin(request)
+    return profiler.status()
+
+
+@router.post("/admin/profiler/start", include_in_schema=False)
+async def profiler_start(request: Request, interval_ms: float = 10.0, duration_s: float = 30.0):
+    _require_admin(request)
+    if profiler.running:
+        raise HTTPException(status_code=409, detail="profiler already running")
+    profiler.start(interval=max(interval_ms, 1.0) / 1000, duration=min(duration_s, 600.0))
+    return profiler.status()
+
+
+@router.post("/admin/profiler/stop", include_in_schema=False)
+async def profiler_stop(request: Request):
+    _require_admin(request)
+    return PlainTextResponse(profiler.stop())
+
+
+def install_metrics(app) -> MetricsRegistry:
+    """挂载中间件与 /metrics、/admin/profiler 路由，应放在其它 add_middleware 之后（最外层）。"""
+    app.add_middleware(MetricsMiddleware, registry=registry)
+    app.include_router(router)
+    return registry
@@ -0,0 +1,384 @@
+# AI_Amend 2026-10-17 上游调用调度：全局 / 单 key 并发上限、按 key 加权公平排队、优先级通道、排队超时、429/5xx 重试与对冲请求
+"""
+llm_proxy 转发前先向调度器申请槽位，流式响应结束（或客户端断开）后归还。
+
+- 全局在途上限 LLM_MAX_CONCURRENCY，单个 key 在途上限 LLM_PER_KEY_CONCURRENCY
+- key 取透传给上游的 Authorization / X-API-Key（摘要），使用服务端密钥时取客户端 IP
+- 同一优先级通道内按 start-time fair queuing 出队：每个 key 按权重（LLM_KEY_WEIGHTS）分享吞吐，
+  一个 key 的突发只会排在它自己的队列里，不会挤占其它 key
+- 优先级通道 high / normal / low，严格按通道优先出队
+- LLM_TRUST_CLIENT_HEADERS=1 时（部署在会覆写这两个头的网关之后）key 取 X-Tenant-Id、通道取 X-Priority；
+  默认不信任，否则客户端换个头就能绕过单 key 上限或插队
+- 排队超过 LLM_QUEUE_TIMEOUT 或队列满（LLM_MAX_QUEUE）返回 503 + Retry-After
+- 上游返回 429 / 5xx 或连接失败时，在未向客户端发送任何字节前重试（指数退避 + 全抖动，优先遵循 Retry-After）
+- LLM_HEDGE_AFTER_MS > 0 时，首个请求超过该时间仍未返回响应头则再发一个对冲请求，取先成功的一个，另一个立即取消
+"""
+import asyncio
+import hashlib
+import heapq
+import itertools
+import os
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, Request
+
+from .metrics import LatencyHistogram
+
+LANES = ("high", "normal", "low")
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# AI_Amend 2026-10-17 只有网关已校验 / 覆写 X-Tenant-Id 与 X-Priority 时才信任这两个客户端请求头
+TRUST_CLIENT_HEADERS = os.getenv("LLM_TRUST_CLIENT_HEADERS", "0") == "1"
+
+
+@dataclass(order=True)
+class _Waiter:
+    start_tag: float
+    seq: int
+    key: str = field(compare=False)
+    lane: int = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+    enqueued_at: float = field(compare=False)
+    abandoned: bool = field(default=False, compare=False)
+
+
+class Slot:
+    """一个上游在途名额；release 可重复调用。"""
+
+    __slots__ = ("_scheduler", "key", "_released")
+
+    def __init__(self, scheduler: "FairScheduler", key: str):
+        self._scheduler = scheduler
+        self.key = key
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._scheduler._release(self.key)
+
+
+def _retryable(response) -> bool:
+    return response.status_code in RETRY_STATUSES
+
+
+def _retry_after(response) -> Optional[float]:
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class FairScheduler:
+    def __init__(self, max_concurrency: int = 64, per_key_concurrency: int = 8, max_queue: int = 1000,
+                 queue_timeout: float = 30.0, weights: Optional[Dict[str, float]] = None,
+                 max_retries: int = 2, backoff_base: float = 0.5, backoff_max: float = 8.0,
+                 hedge_after: float = 0.0):
+        self.max_concurrency = max_concurrency
+        self.per_key_concurrency = per_key_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.weights = weights or {}
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_after = hedge_after
+
+        self._lanes: List[List[_Waiter]] = [[] for _ in LANES]
+        # 已到单 key 上限的 key 的等待者，该 key 归还名额时放回通道
+        self._blocked: Dict[str, List[_Waiter]] = {}
+        self._active_by_key: Dict[str, int] = {}
+        self._finish_tag: Dict[str, float] = {}
+        self._vtime = 0.0
+        self._seq = itertools.count()
+
+        self.active = 0
+        self.queued_by_lane = [0] * len(LANES)
+        self.wait_time = LatencyHistogram()
+        self.rejected = {"queue_full": 0, "queue_timeout": 0}
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    @property
+    def queued(self) -> int:
+        return sum(self.queued_by_lane)
+
+    def _has_capacity(self, key: str) -> bool:
+        return self.active < self.max_concurrency and self._active_by_key.get(key, 0) < self.per_key_concurrency
+
+    def _take(self, key: str) -> Slot:
+        self.active += 1
+        self._active_by_key[key] = self._active_by_key.get(key, 0) + 1
+        return Slot(self, key)
+
+    def try_acquire(self, key: str) -> Optional[Slot]:
+        """不排队：有空闲名额且没有人在排队时立即拿到，否则返回 None。"""
+        if self.queued == 0 and self._has_capacity(key):
+            return self._take(key)
+        return None
+
+    async def acquire(self, key: str, lane: str = "normal", cost: float = 1.0) -> Slot:
+        slot = self.try_acquire(key)
+        if slot is not None:
+            self.wait_time.record(0.0)
+            return slot
+        if self.queued >= self.max_queue:
+            self.rejected["queue_full"] += 1
+            raise HTTPException(503, "upstream queue is full", headers={"Retry-After": "1"})
+
+        lane_index = LANES.index(lane) if lane in LANES else 1
+        start_tag = max(self._vtime, self._finish_tag.get(key, 0.0))
+        self._finish_tag[key] = start_tag + cost / self.weights.get(key, 1.0)
+        waiter = _Waiter(start_tag, next(self._seq), key, lane_index,
+                         asyncio.get_running_loop().create_future(), time.perf_counter())
+        heapq.heappush(self._lanes[lane_index], waiter)
+        self.queued_by_lane[lane_index] += 1
+        self._dispatch()
+        try:
+            return await asyncio.wait_for(waiter.future, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._abandon(waiter)
+            self.rejected["queue_timeout"] += 1
+            raise HTTPException(503, "upstream busy, queue timeout",
+                                headers={"Retry-After": str(max(1, int(self.queue_timeout / 2)))})
+        except asyncio.CancelledError:
+            self._abandon(waiter)
+            raise
+
+    def _abandon(self, waiter: _Waiter) -> None:
+        if waiter.future.done() and not waiter.future.cancelled():
+            waiter.future.result().release()  # 名额已分配但调用方已离开
+        elif not waiter.abandoned:
+            waiter.abandoned = True
+            self.queued_by_lane[waiter.lane] -= 1
+
+    def _next_waiter(self) -> Optional[_Waiter]:
+        for heap in self._lanes:
+            while heap:
+                waiter = heapq.heappop(heap)
+                if waiter.abandoned:
+                    continue
+                if self._active_by_key.get(waiter.key, 0) >= self.per_key_concurrency:
+                    self._blocked.setdefault(waiter.key, []).append(waiter)
+                    continue
+                return waiter
+        return None
+
+    def _dispatch(self) -> None:
+        while self.active < self.max_concurrency:
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+            self.queued_by_lane[waiter.lane] -= 1
+            self._vtime = max(self._vtime, waiter.start_tag)
+            self.wait_time.record(time.perf_counter() - waiter.enqueued_at)
+            waiter.future.set_result(self._take(waiter.key))
+
+    def _release(self, key: str) -> None:
+        self.active -= 1
+        remaining = self._active_by_key.get(key, 1) - 1
+        if remaining:
+            self._active_by_key[key] = remaining
+        else:
+            self._active_by_key.pop(key, None)
+        for waiter in self._blocked.pop(key, ()):
+            if not waiter.abandoned:
+                heapq.heappush(self._lanes[waiter.lane], waiter)
+        if key not in self._active_by_key and self._finish_tag.get(key, 0.0) <= self._vtime:
+            self._finish_tag.pop(key, None)  # 空闲 key 不再保留虚拟时间
+        self._dispatch()
+
+    def _backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def _hedged(self, key: str, send: Callable[[], Awaitable], slot: Slot):
+        """首个请求 hedge_after 秒内没有返回响应头时，再发一个，取先成功的一个。"""
+        primary = asyncio.ensure_future(send())
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=self.hedge_after)
+        except asyncio.CancelledError:
+            primary.cancel()
+            raise
+        if done:
+            return primary.result(), slot
+        hedge_slot = self.try_acquire(key)
+        if hedge_slot is None:
+            return await primary, slot
+        self.hedges += 1
+        slots = {primary: slot, asyncio.ensure_future(send()): hedge_slot}
+        pending = set(slots)
+        fallback = None  # 都失败时返回最后一个可重试的响应（或异常）
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and not _retryable(task.result()):
+                        if task is not primary:
+                            self.hedge_wins += 1
+                        for other in pending:
+                            other.cancel()
+                            slots[other].release()
+                        pending = set()
+                        if fallback is not None:
+                            await self._discard(*fallback)
+                        return task.result(), slots[task]
+                    if fallback is not None:
+                        await self._discard(*fallback)
+                    fallback = (task, slots[task])
+        except asyncio.CancelledError:
+            for task in slots:
+                task.cancel()
+                slots[task].release()
+            raise
+        task, task_slot = fallback
+        if task.exception() is not None:
+            task_slot.release()  # 调用方只会归还首个请求的名额，对冲请求的名额在这里归还
+        return task.result(), task_slot
+
+    @staticmethod
+    async def _discard(task: asyncio.Task, slot: Slot) -> None:
+        if task.exception() is None:
+            await task.result().aclose()
+        slot.release()
+
+    async def send(self, key: str, lane: str, send: Callable[[], Awaitable]) -> Tuple[object, Slot]:
+        """
+        申请名额并调用 send()（返回未读取响应体的 httpx.Response），必要时重试 / 对冲。
+
+        返回 (response, slot)：调用方读完或关闭响应后必须 slot.release()。
+        """
+        attempt = 0
+        while True:
+            slot = await self.acquire(key, lane)
+            try:
+                if self.hedge_after > 0:
+                    response, slot = await self._hedged(key, send, slot)
+                else:
+                    response = await send()
+            except HTTPException as e:
+                slot.release()
+                # llm_proxy 把连接失败 / 超时转换为 502 / 504
+                if e.status_code not in (502, 504) or attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt, None)
+            except BaseException:
+                slot.release()
+                raise
+            else:
+                if not _retryable(response) or attempt >= self.max_retries:
+                    return response, slot
+                delay = self._backoff(attempt, _retry_after(response))
+                await response.aclose()
+                slot.release()
+            attempt += 1
+            self.retries += 1
+            await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "queued": dict(zip(LANES, self.queued_by_lane)),
+            "active_keys": len(self._active_by_key),
+            "wait_p50": self.wait_time.percentile(0.50),
+            "wait_p99": self.wait_time.percentile(0.99),
+            "rejected": dict(self.rejected),
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+        }
+
+    def prometheus_lines(self) -> List[str]:
+        lines = [
+            "# HELP llm_scheduler_active Upstream requests in flight.",
+            "# TYPE llm_scheduler_active gauge",
+            f"llm_scheduler_active {self.active}",
+            "# HELP llm_scheduler_queue_depth Requests waiting for an upstream slot by priority lane.",
+            "# TYPE llm_scheduler_queue_depth gauge",
+        ]
+        lines += [f'llm_scheduler_queue_depth{{lane="{lane}"}} {n}' for lane, n in zip(LANES, self.queued_by_lane)]
+        lines += [
+            "# HELP llm_scheduler_wait_seconds Time spent waiting for an upstream slot.",
+            "# TYPE llm_scheduler_wait_seconds histogram",
+        ]
+        cumulative = 0
+        bounds = [repr(b) for b in LatencyHistogram.bounds] + ["+Inf"]
+        for le, c in zip(bounds, self.wait_time.counts):
+            cumulative += c
+            lines.append(f'llm_scheduler_wait_seconds_bucket{{le="{le}"}} {cumulative}')
+        lines += [
+            f"llm_scheduler_wait_seconds_sum {self.wait_time.sum}",
+            f"llm_scheduler_wait_seconds_count {self.wait_time.count}",
+            "# HELP llm_scheduler_rejected_total Requests rejected before reaching the upstream.",
+            "# TYPE llm_scheduler_rejected_total counter",
+        ]
+        lines += [f'llm_scheduler_rejected_total{{reason="{r}"}} {n}' for r, n in self.rejected.items()]
+        lines += [
+            "# HELP llm_scheduler_retries_total Upstream retries after 429 / 5xx / connection errors.",
+            "# TYPE llm_scheduler_retries_total counter",
+            f"llm_scheduler_retries_total {self.retries}",
+            "# HELP llm_scheduler_hedges_total Hedged upstream requests (and how many the hedge won).",
+            "# TYPE llm_scheduler_hedges_total counter",
+            f'llm_scheduler_hedges_total{{result="sent"}} {self.hedges}',
+            f'llm_scheduler_hedges_total{{result="won"}} {self.hedge_wins}',
+        ]
+        return lines
+
+
+def request_key(request: Request, credentials: bool = True) -> str:
+    """
+    调度 key。credentials=True（透传客户端密钥，由上游鉴权）时取 Authorization / X-API-Key 的摘要，
+    否则（所有客户端共用一个代理令牌）取客户端 IP；LLM_TRUST_CLIENT_HEADERS=1 时优先取 X-Tenant-Id。
+    """
+    if TRUST_CLIENT_HEADERS and request.headers.get("x-tenant-id"):
+        return request.headers["x-tenant-id"]
+    if credentials:
+        for header in ("authorization", "x-api-key"):
+            value = request.headers.get(header)
+            if value:
+                return "cred:" + hashlib.blake2b(value.encode("utf-8"), digest_size=12).hexdigest()
+    return request.client.host if request.client else "unknown"
+
+
+def request_lane(request: Request) -> str:
+    if not TRUST_CLIENT_HEADERS:
+        return "normal"
+    lane = request.headers.get("x-priority", "normal").lower()
+    return lane if lane in LANES else "normal"
+
+
+def _parse_weights(spec: str) -> Dict[str, float]:
+    weights = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        key, _, weight = part.rpartition("=")
+        weights[key] = float(weight)
+    return weights
+
+
+def create_scheduler() -> Optional[FairScheduler]:
+    """
+    LLM_SCHEDULER_ENABLED=0 时返回 None（不限流、不重试）。
+    LLM_MAX_CONCURRENCY / LLM_PER_KEY_CONCURRENCY / LLM_MAX_QUEUE / LLM_QUEUE_TIMEOUT / LLM_KEY_WEIGHTS ("tenant-a=3,tenant-b=1")
+    LLM_MAX_RETRIES / LLM_RETRY_BACKOFF_BASE / LLM_RETRY_BACKOFF_MAX / LLM_HEDGE_AFTER_MS
+    LLM_TRUST_CLIENT_HEADERS 见模块说明
+    """
+    if os.getenv("LLM_SCHEDULER_ENABLED", "1") == "0":
+        return None
+    return FairScheduler(
+        max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "64")),
+        per_key_concurrency=int(os.getenv("LLM_PER_KEY_CONCURRENCY", "8")),
+        max_queue=int(os.getenv("LLM_MAX_QUEUE", "1000")),
+        queue_timeout=float(os.getenv("LLM_QUEUE_TIMEOUT", "30")),
+        weights=_parse_weights(os.getenv("LLM_KEY_WEIGHTS", "")),
+        max_retries=int(os.getenv("LLM_MAX_RETRIES", "2")),
+        backoff_base=float(os.getenv("LLM_RETRY_BACKOFF_BASE", "0.5")),
+        backoff_max=float(os.getenv("LLM_RETRY_BACKOFF_MAX", "8")),
+        hedge_after=float(os.getenv("LLM_HEDGE_AFTER_MS", "0")) / 1000,
+    )
+
+
+scheduler = create_scheduler()